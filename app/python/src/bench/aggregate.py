@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# laurent.martin.aspera@fr.ibm.com
+# Benchmark small-file aggregation against a local target folder (stands for the destination of a transfer)
+# Compares sending each file (one transfer spec path and one copy per file) with packing small files into archives,
+# sending the archives, and unpacking them at destination.
+# Default: 1M files of 4 KB (about 4 GB and 1M inodes are needed in the work folder, use `--files` for a quick run).
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import utils.aggregate
+import utils.incremental
+
+# files per generated folder
+FILES_PER_FOLDER = 1000
+
+
+def generate(folder, files, size):
+    '''Create `files` files of `size` bytes in sub folders of `folder` (kept between runs if already there)'''
+    marker = f'{folder}.generated_{files}_{size}'
+    if os.path.exists(marker):
+        return
+    shutil.rmtree(folder, ignore_errors=True)
+    data = os.urandom(size)
+    for index in range(files):
+        sub_folder = os.path.join(folder, f'd{index // FILES_PER_FOLDER:05d}')
+        if index % FILES_PER_FOLDER == 0:
+            os.makedirs(sub_folder)
+        with open(os.path.join(sub_folder, f'f{index:08d}'), 'wb') as the_file:
+            the_file.write(data)
+    open(marker, 'w').close()
+
+
+def send(paths, target):
+    '''Copy transfer spec paths to target folder, as a transfer would'''
+    created = set()
+    for path in paths:
+        destination = os.path.join(target, path['destination'])
+        parent = os.path.dirname(destination)
+        if parent not in created:
+            os.makedirs(parent, exist_ok=True)
+            created.add(parent)
+        shutil.copyfile(path['source'], destination)
+
+
+def timed(function, *args):
+    start_time = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark small-file aggregation against a local target folder')
+    parser.add_argument('--files', type=int, default=1000000, help='number of files')
+    parser.add_argument('--size', type=int, default=4096, help='size of each file in bytes')
+    parser.add_argument('--work', default=os.path.join(tempfile.gettempdir(), 'bench_aggregate'), help='work folder (generated files are kept)')
+    parser.add_argument('--workers', type=int, default=utils.aggregate.PACK_WORKERS, help='archives written in parallel')
+    parser.add_argument('--archive-size', type=int, default=utils.aggregate.ARCHIVE_SIZE, help='maximum bytes per archive')
+    parser.add_argument('--json', action='store_true', help='output results in JSON')
+    args = parser.parse_args()
+    source = os.path.join(args.work, 'source')
+    spool = os.path.join(args.work, 'spool')
+    target = os.path.join(args.work, 'target')
+    _, generate_time = timed(generate, source, args.files, args.size)
+    results = {'files': args.files, 'size': args.size, 'generate_sec': generate_time}
+
+    # baseline: one path per file
+    paths = [{'source': item.path, 'destination': item.relative} for item in utils.incremental.iter_local([source])]
+    results['individual'] = {'paths': len(paths), 'spec_bytes': len(json.dumps(paths))}
+    shutil.rmtree(target, ignore_errors=True)
+    _, results['individual']['send_sec'] = timed(send, paths, target)
+    del paths
+
+    # aggregation: pack, send archives, unpack
+    shutil.rmtree(spool, ignore_errors=True)
+    shutil.rmtree(target, ignore_errors=True)
+    aggregator = utils.aggregate.Aggregator(spool=spool, threshold=args.size + 1, archive_size=args.archive_size, workers=args.workers)
+    aggregated, pack_time = timed(aggregator.pack, [source])
+    _, send_time = timed(send, aggregated.paths, target)
+    _, unpack_time = timed(utils.aggregate.unpack, target)
+    results['aggregated'] = {
+        'paths': len(aggregated.paths), 'spec_bytes': len(json.dumps(aggregated.paths)), 'archives': len(aggregated.archives),
+        'pack_sec': pack_time, 'send_sec': send_time, 'unpack_sec': unpack_time}
+    shutil.rmtree(spool, ignore_errors=True)
+    shutil.rmtree(target, ignore_errors=True)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    individual = results['individual']
+    aggregated = results['aggregated']
+    print(f'{args.files} files of {args.size} bytes (generated in {generate_time:.1f}s)')
+    print(f'{"mode":<11} {"paths":>9} {"spec MB":>8} {"pack s":>8} {"send s":>8} {"unpack s":>9} {"total s":>8} {"files/s":>9}')
+    for mode, item in (('individual', individual), ('aggregated', aggregated)):
+        total = item.get('pack_sec', 0) + item['send_sec'] + item.get('unpack_sec', 0)
+        print(f'{mode:<11} {item["paths"]:>9} {item["spec_bytes"] / 1e6:>8.1f} {item.get("pack_sec", 0):>8.1f} {item["send_sec"]:>8.1f} '
+              f'{item.get("unpack_sec", 0):>9.1f} {total:>8.1f} {args.files / total:>9.0f}')
+
+
+if __name__ == '__main__':
+    main()
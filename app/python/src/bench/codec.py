@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# laurent.martin.aspera@fr.ibm.com
+# Benchmark JSON codecs on synthetic payloads: standard `json` versus `orjson`, full load versus streaming of items
+# Payloads look like a large list response (packages) and a transfer spec with many paths, about 10 MB each.
+# Times are the median of several runs, peak memory is measured with `tracemalloc` (Python allocations only).
+import json
+import time
+import argparse
+import statistics
+import tracemalloc
+import utils.codec
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# size of chunks given to streaming parsers, as received from the network
+STREAM_CHUNK_SIZE = utils.codec.CHUNK_SIZE
+
+
+def list_payload(size):
+    '''List response of about `size` bytes: packages with recipients and files'''
+    items = []
+    length = 0
+    while length < size:
+        index = len(items)
+        item = {
+            'id': f'pkg{index:08d}',
+            'title': f'Package number {index} - données de test',
+            'created_time': '2024-05-21T10:15:30Z',
+            'size': index * 1024,
+            'completed': index % 3 == 0,
+            'recipients': [{'name': f'user{index % 50}@example.com', 'type': 'user'}],
+            'files': [{'name': f'file_{index}_{sub}.bin', 'size': sub * 4096} for sub in range(3)],
+        }
+        items.append(item)
+        length += len(json.dumps(item)) + 2
+    return items
+
+
+def transfer_spec_payload(size):
+    '''Transfer spec of about `size` bytes: many paths'''
+    paths = []
+    length = 0
+    while length < size:
+        path = {'source': f'/data/project/folder_{len(paths) // 1000:04d}/file_{len(paths):08d}.dat', 'destination': f'file_{len(paths):08d}.dat'}
+        paths.append(path)
+        length += len(json.dumps(path)) + 2
+    return {'direction': 'send', 'remote_host': 'demo.asperasoft.com', 'ssh_port': 33001, 'token': 'Basic ' + 'x' * 1000, 'paths': paths}
+
+
+def median_time(function, runs):
+    '''Median duration of `function()` in milliseconds'''
+    samples = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        function()
+        samples.append(1000 * (time.perf_counter() - start_time))
+    return statistics.median(samples)
+
+
+def peak_memory(function):
+    '''Peak of memory allocated by `function()` in bytes'''
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def chunks_of(data):
+    return [data[index:index + STREAM_CHUNK_SIZE] for index in range(0, len(data), STREAM_CHUNK_SIZE)]
+
+
+def consume(items):
+    '''Read items one by one, as a caller that does not keep them'''
+    count = 0
+    for _ in items:
+        count += 1
+    return count
+
+
+def codecs_to_compare():
+    '''name -> (dumps to bytes, loads from bytes)'''
+    result = {'json': (lambda value: json.dumps(value).encode('utf-8'), json.loads)}
+    if orjson is not None:
+        result['orjson'] = (orjson.dumps, orjson.loads)
+    return result
+
+
+def bench_payload(name, value, runs):
+    '''Results of all codecs and parsers on one payload'''
+    data = json.dumps(value).encode('utf-8')
+    results = []
+    for codec_name, (dumps, loads) in codecs_to_compare().items():
+        results.append({'payload': name, 'bytes': len(data), 'case': f'{codec_name} dumps', 'ms': median_time(lambda: dumps(value), runs)})
+        results.append({'payload': name, 'bytes': len(data), 'case': f'{codec_name} loads', 'ms': median_time(lambda: loads(data), runs)})
+    if not isinstance(value, list):
+        return results
+    # streaming versus full load: memory to process all items of a list response
+    chunks = chunks_of(data)
+    parsers = {
+        f'{utils.codec.backend()} full load': lambda: consume(utils.codec.loads(b''.join(chunks))),
+        'json stream': lambda: consume(utils.codec._iter_array(chunks)),
+    }
+    if ijson is not None:
+        parsers['ijson stream'] = lambda: consume(utils.codec.iter_items(chunks))
+    for case, function in parsers.items():
+        results.append({
+            'payload': name, 'bytes': len(data), 'case': case,
+            'ms': median_time(function, runs), 'peak_bytes': peak_memory(function)})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark JSON codecs on synthetic payloads')
+    parser.add_argument('--size', type=int, default=10000000, help='approximate size of payloads in bytes')
+    parser.add_argument('--runs', type=int, default=5, help='runs per case (median is reported)')
+    parser.add_argument('--json', action='store_true', help='output results in JSON')
+    args = parser.parse_args()
+    results = []
+    results.extend(bench_payload('list', list_payload(args.size), args.runs))
+    results.extend(bench_payload('transfer_spec', transfer_spec_payload(args.size), args.runs))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f'installed: orjson={orjson is not None} ijson={ijson is not None}, codec backend: {utils.codec.backend()}')
+    print(f'{"payload":<14} {"MB":>6} {"case":<20} {"ms":>9} {"peak MB":>9}')
+    for result in results:
+        peak = f'{result["peak_bytes"] / 1e6:.1f}' if 'peak_bytes' in result else ''
+        print(f'{result["payload"]:<14} {result["bytes"] / 1e6:>6.1f} {result["case"]:<20} {result["ms"]:>9.1f} {peak:>9}')
+
+
+if __name__ == '__main__':
+    main()
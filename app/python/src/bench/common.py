@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# laurent.martin.aspera@fr.ibm.com
+# Common helpers for benchmarks: configuration pointing to local stand-ins, resource usage
+import os
+import sys
+import json
+import resource
+import tempfile
+import contextlib
+import subprocess
+import utils.configuration
+
+
+@contextlib.contextmanager
+def bench_configuration(sections, level='warning'):
+    '''
+    Configuration built from `sections` instead of the main config file.
+
+    The config file is written in a temporary file, in JSON, which is valid YAML.
+    '''
+    config_data = {'misc': {'level': level}}
+    config_data.update(sections)
+    with tempfile.NamedTemporaryFile('w', suffix='.yaml', prefix='bench_config_', delete=False) as config_file:
+        json.dump(config_data, config_file)
+    try:
+        yield utils.configuration.Configuration(file_list=[], files_required=False, config_file=config_file.name)
+    finally:
+        os.remove(config_file.name)
+        # the file name is unique: its parsed configuration would stay in cache
+        utils.configuration.remove_cache(utils.configuration.cache_file(utils.configuration.CONFIG_CACHE_PREFIX, config_file.name))
+
+
+@contextlib.contextmanager
+def standin_process(api, *options):
+    '''Run `python -m standin` in a subprocess, yield its base URL'''
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'standin', api, '--port', '0', *[str(option) for option in options]],
+        stdout=subprocess.PIPE, text=True, env=os.environ)
+    try:
+        url = process.stdout.readline().strip()
+        if not url:
+            raise Exception(f'stand-in {api} failed to start: exit code {process.wait()}')
+        yield url
+    finally:
+        process.terminate()
+        process.wait()
+
+
+class ResourceUsage:
+    '''CPU time and maximum resident memory of this process, between creation and `stop`'''
+
+    def __init__(self):
+        self._start = resource.getrusage(resource.RUSAGE_SELF)
+        self.cpu_sec = None
+        self.max_rss_growth_kb = None
+
+    def stop(self):
+        end = resource.getrusage(resource.RUSAGE_SELF)
+        self.cpu_sec = (end.ru_utime - self._start.ru_utime) + (end.ru_stime - self._start.ru_stime)
+        # Linux reports kilobytes, macOS bytes
+        scale = 1024 if sys.platform == 'darwin' else 1
+        self.max_rss_growth_kb = (end.ru_maxrss - self._start.ru_maxrss) / scale
+        return self
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# laurent.martin.aspera@fr.ibm.com
+# End-to-end benchmark of the example flows against local stand-ins, with timing per phase
+# Each example is run many times in this process, with tracing recorded in memory.
+# Stand-ins (HTTP APIs and transferd) run in subprocesses, so that they do not compete with the client for the GIL.
+# Spans are grouped by phase, and p50/p95/p99 of each phase are reported, in a table and optionally in JSON.
+# Results of two commits can be compared with `--baseline`.
+import os
+import sys
+import json
+import time
+import runpy
+import logging
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+import utils.configuration
+import utils.tracing
+from bench.common import standin_process
+
+EXAMPLES_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples')
+# flow name -> stand-ins used by the example (transferd is always used)
+FLOWS = {
+    'server': [],
+    'aoc': ['aoc'],
+    'aoc_async': ['aoc'],
+    'faspex5': ['faspex5'],
+    'node': ['node'],
+    'shares': ['shares'],
+    'node_v2': ['node'],
+}
+# phases in report order, `total` is the wall clock time of one run
+PHASES = ['config', 'token', 'lookups', 'api', 'spec', 'daemon', 'transfer', 'total']
+# span name -> phase, for spans not from REST calls
+SPAN_PHASES = {
+    'config.load': 'config',
+    'oauth.token': 'token',
+    'transferd.start': 'daemon',
+    'transfer.start': 'transfer',
+    'transfer.wait': 'transfer',
+}
+# REST endpoints generating transfer specs
+SPEC_ENDPOINTS = ['transfer_spec', 'upload_setup', 'download_setup']
+PERCENTILES = [50, 95, 99]
+# size of the file sent by the examples (transfers are simulated)
+SAMPLE_FILE_SIZE = 1024
+
+
+def span_phase(span):
+    '''Phase of a span, or None if not timed (e.g. root span of a job)'''
+    if span.name in SPAN_PHASES:
+        return SPAN_PHASES[span.name]
+    if span.kind != utils.tracing.KIND_CLIENT:
+        return None
+    method, _, endpoint = span.name.partition(' ')
+    if any(item in endpoint for item in SPEC_ENDPOINTS):
+        return 'spec'
+    return 'lookups' if method == 'GET' else 'api'
+
+
+def percentile(values, percent):
+    '''Nearest-rank percentile'''
+    ordered = sorted(values)
+    rank = max(int(-(-percent * len(ordered) // 100)), 1)
+    return ordered[rank - 1]
+
+
+def flow_config(flow, urls, transferd_url, key_file, sample_file):
+    '''Configuration sections for a flow, pointing to stand-ins'''
+    sections = {
+        'misc': {'level': 'warning'},
+        'trsdk': {'url': transferd_url, 'level': 'info', 'ascp_level': 'info', 'start_daemon': False},
+    }
+    if flow == 'server':
+        sections['server'] = {
+            'url': 'ssh://127.0.0.1:33001', 'username': 'bench', 'password': 'bench',
+            'file_download': sample_file, 'folder_upload': '/Upload'}
+    elif flow in ('node', 'node_v2'):
+        sections['node'] = {'url': urls['node'], 'verify': False, 'username': 'bench', 'password': 'bench', 'folder_upload': '/Upload'}
+    elif flow == 'shares':
+        # the example adds the node API path
+        sections['shares'] = {
+            'url': urls['shares'].removesuffix('/node_api'), 'verify': False, 'username': 'bench', 'password': 'bench',
+            'folder_upload': '/Upload'}
+    elif flow == 'faspex5':
+        sections['faspex5'] = {
+            'url': urls['faspex5'], 'verify': False, 'username': 'john@example.com', 'client_id': 'bench', 'client_secret': 'bench',
+            'private_key': key_file, 'shared_folder_name': 'Server Files', 'shared_folder_file': '/file.bin'}
+    elif flow in ('aoc', 'aoc_async'):
+        sections['aoc'] = {
+            'url': urls['aoc'], 'org': 'bench', 'user_email': 'john@example.com', 'private_key': key_file,
+            'client_id': 'bench', 'client_secret': 'bench', 'workspace': 'Default', 'shared_inbox': 'Inbox'}
+    return sections
+
+
+def generate_private_key(path):
+    '''RSA private key in PEM format, for JWT signature'''
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    with open(path, 'wb') as key_file:
+        key_file.write(key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption()))
+
+
+def run_flow(flow, config_file, sample_file, exporter):
+    '''Run one example once, return duration of each phase in seconds'''
+    sys.argv = [flow, sample_file]
+    os.environ[utils.configuration.CONFIG_FILE_VAR] = config_file
+    exporter.take()
+    start_time = time.monotonic()
+    runpy.run_path(os.path.join(EXAMPLES_FOLDER, f'{flow}.py'), run_name='__main__')
+    durations = dict.fromkeys(PHASES, 0.0)
+    durations['total'] = time.monotonic() - start_time
+    for span in exporter.take():
+        phase = span_phase(span)
+        if phase is not None:
+            durations[phase] += span.duration
+    return durations
+
+
+def bench_flow(flow, runs, warmup, config_file, sample_file, exporter):
+    '''Run a flow several times, return statistics per phase in milliseconds'''
+    samples = []
+    errors = 0
+    for index in range(warmup + runs):
+        try:
+            durations = run_flow(flow, config_file, sample_file, exporter)
+        except Exception as e:
+            logging.error('%s: %s', flow, e)
+            errors += 1
+            continue
+        if index >= warmup:
+            samples.append(durations)
+    result = {'runs': len(samples), 'errors': errors, 'phases': {}}
+    if not samples:
+        return result
+    for phase in PHASES:
+        values = [1000 * sample[phase] for sample in samples]
+        result['phases'][phase] = {f'p{percent}': percentile(values, percent) for percent in PERCENTILES}
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results, baseline=None):
+    '''Table of percentiles per flow and phase, with change of p50 relative to baseline'''
+    print(f'{"flow":<9} {"phase":<9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"p50 vs base":>12}')
+    for flow, result in results['flows'].items():
+        if result['errors']:
+            print(f'{flow:<9} {result["errors"]} failed runs')
+        for phase, stats in result['phases'].items():
+            if stats['p99'] == 0:
+                continue
+            change = ''
+            base = (baseline or {}).get('flows', {}).get(flow, {}).get('phases', {}).get(phase)
+            if base and base['p50'] > 0:
+                change = f'{100 * (stats["p50"] - base["p50"]) / base["p50"]:+.1f}%'
+            print(f'{flow:<9} {phase:<9} {stats["p50"]:>9.2f} {stats["p95"]:>9.2f} {stats["p99"]:>9.2f} {change:>12}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark example flows against local stand-ins')
+    parser.add_argument('flows', nargs='*', help=f'flows to run (default: all): {", ".join(FLOWS.keys())}')
+    parser.add_argument('--runs', type=int, default=50, help='measured runs per flow')
+    parser.add_argument('--warmup', type=int, default=2, help='runs per flow not measured')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added by stand-ins to each API response')
+    parser.add_argument('--transfer-duration', type=float, default=0.05, help='seconds per simulated transfer')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='JSON results of a previous run, to compare with')
+    args = parser.parse_args()
+    unknown = set(args.flows) - FLOWS.keys()
+    if unknown:
+        parser.error(f'unknown flows: {", ".join(sorted(unknown))}')
+    logging.basicConfig(format='%(levelname)-8s %(message)s', level=logging.WARNING)
+    flows = args.flows or list(FLOWS.keys())
+    apis = sorted({api for flow in flows for api in FLOWS[flow]})
+    exporter = utils.tracing.MemoryExporter()
+    utils.tracing.enable(exporter)
+    results = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'parameters': {'runs': args.runs, 'warmup': args.warmup, 'latency': args.latency, 'transfer_duration': args.transfer_duration},
+        'flows': {},
+    }
+    with contextlib.ExitStack() as stack:
+        work_folder = stack.enter_context(tempfile.TemporaryDirectory(prefix='bench_flows_'))
+        key_file = os.path.join(work_folder, 'private_key.pem')
+        generate_private_key(key_file)
+        sample_file = os.path.join(work_folder, 'sample.bin')
+        with open(sample_file, 'wb') as file:
+            file.write(os.urandom(SAMPLE_FILE_SIZE))
+        transferd_url = stack.enter_context(standin_process('transferd', '--duration', args.transfer_duration, '--event-rate', 100))
+        urls = {api: stack.enter_context(standin_process(api, '--latency', args.latency)) for api in apis}
+        for flow in flows:
+            config_file = os.path.join(work_folder, f'{flow}.yaml')
+            with open(config_file, 'w') as file:
+                json.dump(flow_config(flow, urls, transferd_url, key_file, sample_file), file)
+            results['flows'][flow] = bench_flow(flow, args.runs, args.warmup, config_file, sample_file, exporter)
+            # the work folder is unique: its parsed configuration would stay in cache
+            utils.configuration.remove_cache(utils.configuration.cache_file(utils.configuration.CONFIG_CACHE_PREFIX, config_file))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    print_report(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# laurent.martin.aspera@fr.ibm.com
+# Check cold-start import time of utils modules against a budget
+# Each module is imported in a new interpreter with `python -X importtime`, several times, and the median is kept.
+# Exits with non-zero status if a module exceeds its budget or imports a module that shall be deferred to first use.
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+# maximum cumulative import time per module, in milliseconds (at least twice the time measured on a developer machine)
+IMPORT_BUDGET_MS = {
+    'utils.codec': 80,
+    'utils.configuration': 100,
+    'utils.metrics': 60,
+    'utils.tracing': 60,
+    'utils.transfer_client': 120,
+    'utils.rest': 300,
+}
+# modules that must not be loaded when importing a module: they are imported on first use
+DEFERRED_IMPORTS = {
+    'utils.configuration': ['yaml', 'http.client'],
+    'utils.transfer_client': ['grpc', 'transferd_pb2', 'transferd_pb2_grpc', 'subprocess', 'google.protobuf'],
+    'utils.rest': ['jwt', 'cryptography'],
+}
+
+
+def import_times(module):
+    '''Cumulative import time in microseconds of each module loaded when importing `module` in a new interpreter'''
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, env=os.environ)
+    if result.returncode != 0:
+        raise Exception(f'failed to import {module}: {result.stderr.splitlines()[-1:]}')
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def check(module, budget_ms, runs):
+    '''Check one module, return list of errors'''
+    errors = []
+    samples = []
+    for _ in range(runs):
+        times = import_times(module)
+        samples.append(times[module] / 1000)
+    median = statistics.median(samples)
+    print(f'{module:<25} {median:8.1f} ms (budget {budget_ms} ms)')
+    if median > budget_ms:
+        errors.append(f'{module}: import time {median:.1f} ms exceeds budget {budget_ms} ms')
+    for deferred in DEFERRED_IMPORTS.get(module, []):
+        if deferred in times:
+            errors.append(f'{module}: imports {deferred} which shall be deferred to first use')
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check import time budget of utils modules')
+    parser.add_argument('--runs', type=int, default=5, help='number of imports per module (median is used)')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply budgets, for slower machines')
+    args = parser.parse_args()
+    errors = []
+    for module, budget_ms in IMPORT_BUDGET_MS.items():
+        errors.extend(check(module, budget_ms * args.scale, args.runs))
+    for error in errors:
+        print(f'ERROR: {error}')
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
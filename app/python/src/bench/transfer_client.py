@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# laurent.martin.aspera@fr.ibm.com
+# Benchmark client-side overhead of TransferClient against the transferd stand-in (no ascp)
+# Reports transfers/sec, events/sec, and client CPU time and memory per transfer, for each scenario and concurrency.
+# The stand-in runs in a subprocess by default, so that measured CPU is the client's only.
+import json
+import time
+import argparse
+import contextlib
+import threading
+from concurrent import futures
+import utils.transfer_client
+from bench.common import bench_configuration, standin_process, ResourceUsage
+
+# transfer spec sent to the stand-in: not used, except for direction
+BENCH_TRANSFER_SPEC = {'direction': 'send', 'remote_host': '127.0.0.1', 'paths': [{'source': 'bench.bin'}]}
+
+
+class EventCounter:
+    '''Thread safe counter of progress events received by the client'''
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, progress):
+        with self._lock:
+            self.count += 1
+
+
+def scenario_wait_transfer(client, counter):
+    '''One transfer: start_transfer and wait_transfer'''
+    client.wait_transfer(client.start_transfer(BENCH_TRANSFER_SPEC), on_progress=counter)
+
+
+# scenario name -> function(client, counter) doing one transfer, raises on failure
+# add here concurrent APIs of TransferClient as they come
+SCENARIOS = {
+    'wait_transfer': scenario_wait_transfer,
+}
+
+
+def run(client, scenario, transfers, concurrency):
+    '''Run `transfers` transfers with `concurrency` threads, return measurements'''
+    counter = EventCounter()
+    failed = 0
+    usage = ResourceUsage()
+    start_time = time.monotonic()
+    with futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for job in [executor.submit(SCENARIOS[scenario], client, counter) for _ in range(transfers)]:
+            try:
+                job.result()
+            except Exception:
+                failed += 1
+    elapsed = time.monotonic() - start_time
+    usage.stop()
+    return {
+        'scenario': scenario,
+        'concurrency': concurrency,
+        'transfers': transfers,
+        'failed': failed,
+        'elapsed_sec': elapsed,
+        'transfers_per_sec': transfers / elapsed,
+        'events_per_sec': counter.count / elapsed,
+        'cpu_ms_per_transfer': 1000 * usage.cpu_sec / transfers,
+        'max_rss_growth_kb_per_transfer': usage.max_rss_growth_kb / transfers,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark TransferClient against a simulated transfer daemon')
+    parser.add_argument('--scenario', choices=SCENARIOS.keys(), action='append', help='scenario to run (default: all)')
+    parser.add_argument('--transfers', type=int, default=100, help='transfers per run')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8], help='number of client threads, one run for each')
+    parser.add_argument('--duration', type=float, default=0.1, help='seconds per simulated transfer')
+    parser.add_argument('--event-rate', type=float, default=100.0, help='progress events per second per transfer')
+    parser.add_argument('--bytes', type=int, default=10000000, help='bytes per transfer')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='probability of transfer failure')
+    parser.add_argument('--in-process', action='store_true', help='run the stand-in in this process (CPU includes server)')
+    parser.add_argument('--json', action='store_true', help='output results in JSON')
+    args = parser.parse_args()
+    options = {
+        'duration': args.duration,
+        'event_rate': args.event_rate,
+        'total_bytes': args.bytes,
+        'failure_rate': args.failure_rate,
+        'workers': max(args.concurrency) * 2 + 4,
+    }
+    if args.in_process:
+        from standin.transferd import FakeTransferd
+        server = FakeTransferd(**options).start()
+        url_context = contextlib.nullcontext(server.url)
+    else:
+        url_context = standin_process(
+            'transferd', '--duration', args.duration, '--event-rate', args.event_rate, '--bytes', args.bytes,
+            '--error-rate', args.failure_rate, '--workers', options['workers'])
+    results = []
+    with url_context as url:
+        # every event is reported to the client: no throttling
+        with bench_configuration({'trsdk': {'url': url, 'level': 'info', 'ascp_level': 'info', 'progress_interval': 0}}) as config:
+            client = utils.transfer_client.TransferClient(config)
+            client.connect_to_daemon()
+            for scenario in args.scenario or SCENARIOS.keys():
+                for concurrency in args.concurrency:
+                    results.append(run(client, scenario, args.transfers, concurrency))
+    if args.in_process:
+        server.stop()
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f'{"scenario":<15} {"threads":>7} {"failed":>6} {"transfers/s":>11} {"events/s":>9} {"CPU ms/tr":>9} {"RSS kB/tr":>9}')
+    for result in results:
+        print(f'{result["scenario"]:<15} {result["concurrency"]:>7} {result["failed"]:>6} {result["transfers_per_sec"]:>11.1f} '
+              f'{result["events_per_sec"]:>9.0f} {result["cpu_ms_per_transfer"]:>9.2f} {result["max_rss_growth_kb_per_transfer"]:>9.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,7 @@
 import utils.configuration
 import utils.transfer_client
 import utils.rest
+import utils.tracing
 import logging as log
 import uuid
 import base64
@@ -20,7 +21,8 @@ package_name = 'sample package Python'
 transfer_sessions = 1
 
 config = utils.configuration.Configuration()
-transfer_client = utils.transfer_client.TransferClient(config).startup()
+# optional: other API URL, e.g. a local stand-in
+aoc_api_url = config.param('aoc', 'url', AOC_API_V1_BASE_URL)
 
 
 def generate_cookie(app: str, user_name: str, user_id: str) -> str:
@@ -30,10 +32,11 @@ def generate_cookie(app: str, user_name: str, user_id: str) -> str:
     return f"aspera.aoc:{encoded_app}:{encoded_user_name}:{encoded_user_id}"
 
 
-try:
-    aoc_api = utils.rest.Rest(AOC_API_V1_BASE_URL)
+def main(transfer_client, job_span):
+    '''Send a package to the shared inbox'''
+    aoc_api = utils.rest.Rest(aoc_api_url)
     aoc_api.setAuthBearer({
-        'token_url': f'{AOC_API_V1_BASE_URL}/oauth2/{config.param('aoc', 'org')}/token',
+        'token_url': f'{aoc_api_url}/oauth2/{config.param('aoc', 'org')}/token',
         'key_pem_path': config.param('aoc', 'private_key'),
         'client_id': config.param('aoc', 'client_id'),
         'client_secret': config.param('aoc', 'client_secret'),
@@ -56,6 +59,7 @@ try:
     if len(response_data) != 1:
         raise Exception(f'Found {len(response_data)} workspace for {workspace_name}')
     workspace_info = response_data[0]
+    job_span.set_attribute('workspace.id', workspace_info['id'])
 
     # Get dropbox information (shared inbox name in config file)
     shared_inbox_name = config.param('aoc', 'shared_inbox')
@@ -78,6 +82,7 @@ try:
         'transfers_expected': transfer_sessions,
     })
     log.debug(package_info)
+    job_span.set_attribute('package.id', package_info['id'])
 
     #  get node information for the node on which package must be created
     log.info('getting node information')
@@ -128,5 +133,12 @@ try:
 
     # Finally send files to package folder on server
     transfer_client.start_transfer_and_wait(t_spec)
-finally:
-    transfer_client.shutdown()
+
+
+with utils.tracing.span('aoc.send_package', package_name=package_name) as job_span:
+    # start local transfer SDK (in job span: startup is traced)
+    transfer_client = utils.transfer_client.TransferClient(config).startup()
+    try:
+        main(transfer_client, job_span)
+    finally:
+        transfer_client.shutdown()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# laurent.martin.aspera@fr.ibm.com
+# Aspera on Cloud, with the asynchronous REST client (requires httpx)
+# Send a package to shared inbox (name in config file) in given workspace (name in config file)
+# Same as `aoc.py`, but independent API calls are made concurrently
+import utils.configuration
+import utils.transfer_client
+import utils.async_rest
+import utils.tracing
+import logging as log
+import asyncio
+import base64
+
+# AoC API base URL: https://developer.ibm.com/apis/catalog?search=%22aspera%20on%20cloud%20api%22
+AOC_API_V1_BASE_URL = 'https://api.ibmaspera.com/api/v1'
+AOC_OAUTH_AUDIENCE = 'https://api.asperafiles.com/api/v1/oauth2/token'
+
+# name of package to send
+package_name = 'sample package Python'
+
+# number of parallel transfer sessions (typically, 1)
+transfer_sessions = 1
+
+config = utils.configuration.Configuration()
+# optional: other API URL, e.g. a local stand-in
+aoc_api_url = config.param('aoc', 'url', AOC_API_V1_BASE_URL)
+transfer_client = utils.transfer_client.TransferClient(config).startup()
+
+
+def generate_cookie(app: str, user_name: str, user_id: str) -> str:
+    encoded_app = base64.b64encode(app.encode('utf-8')).decode('utf-8')
+    encoded_user_name = base64.b64encode(user_name.encode('utf-8')).decode('utf-8')
+    encoded_user_id = base64.b64encode(user_id.encode('utf-8')).decode('utf-8')
+    return f"aspera.aoc:{encoded_app}:{encoded_user_name}:{encoded_user_id}"
+
+
+async def find_one(aoc_api, endpoint, params, kind, name):
+    '''Get the only item matching a search'''
+    response_data = await aoc_api.read(endpoint, params=params)
+    log.debug(response_data)
+    if len(response_data) != 1:
+        raise Exception(f'Found {len(response_data)} {kind} for {name}')
+    return response_data[0]
+
+
+async def send_package(job_span):
+    org = config.param('aoc', 'org')
+    async with utils.async_rest.AsyncRest(aoc_api_url) as aoc_api:
+        aoc_api.setAuthBearer({
+            'token_url': f'{aoc_api_url}/oauth2/{org}/token',
+            'key_pem_path': config.param('aoc', 'private_key'),
+            'client_id': config.param('aoc', 'client_id'),
+            'client_secret': config.param('aoc', 'client_secret'),
+            'iss': config.param('aoc', 'client_id'),
+            'aud': AOC_OAUTH_AUDIENCE,
+            'sub': config.param('aoc', 'user_email'),
+            'org': org,
+        })
+        await aoc_api.setDefaultScope('user:all')
+
+        # get my user information and workspace information, concurrently
+        workspace_name = config.param('aoc', 'workspace')
+        log.info(f'getting user and workspace information for {workspace_name}')
+        user_info, workspace_info = await asyncio.gather(
+            aoc_api.read('self'),
+            find_one(aoc_api, 'workspaces', {'q': workspace_name}, 'workspace', workspace_name))
+        log.debug(user_info)
+        job_span.set_attribute('workspace.id', workspace_info['id'])
+
+        # Get dropbox information (shared inbox name in config file)
+        shared_inbox_name = config.param('aoc', 'shared_inbox')
+        log.info('getting shared inbox information')
+        dropbox_info = await find_one(
+            aoc_api, 'dropboxes', {'current_workspace_id': workspace_info['id'], 'q': shared_inbox_name}, 'dropbox', shared_inbox_name)
+
+        # Create a new package (this allocates a reception folder on package storage)
+        log.info('creating package')
+        package_info = await aoc_api.create('packages', {
+            'workspace_id': workspace_info['id'],
+            'recipients': [{'id': dropbox_info['id'], 'type': 'dropbox'}],
+            'name': package_name,
+            'note': 'My package note',
+            'sent': True,
+            'transfers_expected': transfer_sessions,
+        })
+        log.debug(package_info)
+        job_span.set_attribute('package.id', package_info['id'])
+
+        #  get node information for the node on which package must be created
+        log.info('getting node information')
+        node_info = await aoc_api.read(f'nodes/{package_info["node_id"]}')
+        log.debug(node_info)
+
+        # Note: generate a bearer token for the node on which package was created
+        # (not all tags are mandatory, but some are, like 'node')
+        t_spec = {
+            'direction': 'send',
+            'token': await aoc_api.getBearerTokenAuthorization(f"node.{node_info['access_key']}:user:all"),
+            'tags': {
+                'aspera': {
+                    'app': 'packages',
+                    'files': {
+                        'node_id': node_info['id'],
+                        'package_id': package_info['id'],
+                        'package_name': package_info['name'],
+                        'package_operation': 'upload',
+                        'files_transfer_action': 'upload_package',
+                        'workspace_name': workspace_info['name'],
+                        'workspace_id': workspace_info['id'],
+                    },
+                    'node': {
+                        'access_key': node_info['access_key'],
+                        'file_id': package_info['contents_file_id'],
+                    },
+                    'usage_id': f"aspera.files.workspace.{workspace_info['id']}",
+                    'xfer_retry': 3600,
+                }
+            },
+            'remote_host': node_info['host'],
+            'remote_user': 'xfer',
+            'ssh_port': 33001,
+            'fasp_port': 33001,
+            'cookie': generate_cookie('packages', user_info['name'], user_info['email']),
+            'create_dir': True,
+            'target_rate_kbps': 2000000,
+            'paths': []
+        }
+
+    if transfer_sessions != 1:
+        t_spec['multi_session'] = transfer_sessions
+        t_spec['multi_session_threshold'] = 500000
+
+    # add file list in transfer spec
+    config.add_sources(t_spec, 'paths')
+
+    # Finally send files to package folder on server (blocking: in a thread, not to block other tasks of the event loop)
+    await asyncio.to_thread(transfer_client.start_transfer_and_wait, t_spec)
+
+
+try:
+    with utils.tracing.span('aoc.send_package', package_name=package_name) as job_span:
+        asyncio.run(send_package(job_span))
+finally:
+    transfer_client.shutdown()
@@ -5,9 +5,10 @@ import utils.configuration
 import utils.transfer_client
 import utils.helper_aspera_cos
 import utils.rest
+import utils.node
 import logging as log
 
-config = utils.configuration.Configuration()
+config = utils.configuration.Configuration(files_required=False)
 transfer_client = utils.transfer_client.TransferClient(config)
 
 try:
@@ -19,17 +20,15 @@ try:
         auth=config.param('cos', 'auth'),
     )
 
-    node_api = utils.rest.Rest(
-        base_url=node_info['url'],
-        auth=node_info['auth'],
-        headers=node_info['headers'],
-    )
-
-    # call Aspera Node API: list transfers that occurred in the last day.
-    # filtering options possible.
-    transfer_list = node_api.get('ops/transfers')
+    node_api = utils.rest.Rest(node_info['url'])
+    node_api.setAuthBasic(*node_info['auth'])
+    node_api.addHeaders(node_info['headers'])
 
-    log.info('transfers: %s', transfer_list)
+    # call Aspera Node API: list transfers changed since last run (first run: transfers of the last day)
+    # the iteration token is persisted in the private cache folder, filtering options possible with `query`
+    poller = utils.node.TransferPoller(node_api)
+    for transfer in poller.poll():
+        log.info('transfer: %s %s', transfer.get('id'), transfer.get('status'))
 
 finally:
     # no need shutdown, as we did not setup a server
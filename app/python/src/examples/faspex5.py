@@ -5,6 +5,7 @@
 import utils.configuration
 import utils.transfer_client
 import utils.rest
+import utils.tracing
 import logging as log
 import time
 import re
@@ -82,11 +83,9 @@ transfer_sessions = 1
 # get testing environment configuration
 config = utils.configuration.Configuration()
 
-# start local transfer SDK and get its gRPC API for locally initiated transfers
-transfer_client = utils.transfer_client.TransferClient(config).startup()
 
-
-try:
+def main(transfer_client, job_span):
+    '''Send a package with local files, and a package with files of a shared folder'''
     # Get access to the Faspex 5 API
     #
 
@@ -118,6 +117,7 @@ try:
         'recipients': recipients
     })
     log.debug(package_info)
+    job_span.set_attribute('package.local.id', package_info['id'])
 
     # build payload to specify files to send
     upload_request = {}
@@ -150,6 +150,7 @@ try:
         'recipients': recipients
     })
     log.debug(package_info)
+    job_span.set_attribute('package.remote.id', package_info['id'])
 
     # In this example, we have the name, not the id of the shared folder
     # so we need to get the id from the name
@@ -180,5 +181,11 @@ try:
             raise "Remote transfer failed"
         time.sleep(1)
 
-finally:
-    transfer_client.shutdown()
+
+with utils.tracing.span('faspex5.send_packages') as job_span:
+    # start local transfer SDK and get its gRPC API for locally initiated transfers (in job span: startup is traced)
+    transfer_client = utils.transfer_client.TransferClient(config).startup()
+    try:
+        main(transfer_client, job_span)
+    finally:
+        transfer_client.shutdown()
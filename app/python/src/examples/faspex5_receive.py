@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# laurent.martin.aspera@fr.ibm.com
+# Faspex 5
+# Download all packages received in inbox into a local folder (given on command line), one sub folder per package
+# Packages already downloaded by a previous run are skipped (see utils.faspex5)
+import utils.configuration
+import utils.transfer_client
+import utils.rest
+import utils.tracing
+import utils.faspex5
+import logging as log
+
+# base path for v5 api
+F5_API_PATH_V5 = '/api/v5'
+# path for oauth2 token generation
+F5_API_PATH_TOKEN = '/auth/token'
+
+config = utils.configuration.Configuration()
+if len(config.file_list()) != 1:
+    raise Exception('give one destination folder')
+
+# start local transfer SDK and get its gRPC API for locally initiated transfers
+transfer_client = utils.transfer_client.TransferClient(config).startup()
+
+try:
+    with utils.tracing.span('faspex5.receive_packages') as job_span:
+        f5_api = utils.rest.Rest(f'{config.param("faspex5", "url")}{F5_API_PATH_V5}')
+        f5_api.setVerify(config.param('faspex5', 'verify', True))
+        f5_api.setAuthBearer({
+            'token_url': f'{config.param("faspex5", "url")}{F5_API_PATH_TOKEN}',
+            'key_pem_path': config.param('faspex5', 'private_key'),
+            'client_id': config.param('faspex5', 'client_id'),
+            'client_secret': config.param('faspex5', 'client_secret'),
+            'iss': config.param('faspex5', 'client_id'),
+            'aud': config.param('faspex5', 'client_id'),
+            'sub': f'user:{config.param("faspex5", "username")}',
+        })
+        f5_api.setDefaultScope()
+
+        receiver = utils.faspex5.BulkReceiver(
+            f5_api, transfer_client, config.file_list()[0],
+            setup_workers=config.param('faspex5', 'receive_setup_workers', utils.faspex5.SETUP_WORKERS),
+            max_downloads=config.param('faspex5', 'receive_max_downloads', utils.faspex5.MAX_DOWNLOADS))
+        result = receiver.receive(config.param('faspex5', 'receive_mailbox', 'inbox'))
+        job_span.set_attribute('packages.downloaded', len(result.completed))
+        job_span.set_attribute('packages.failed', len(result.failed))
+        log.info(f'Packages: {result}')
+        if result.failed:
+            raise Exception(f'{len(result.failed)} packages failed, see journal: {receiver.journal.path}')
+finally:
+    transfer_client.shutdown()
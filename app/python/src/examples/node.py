@@ -4,6 +4,8 @@
 import utils.configuration
 import utils.transfer_client
 import utils.rest
+import utils.node
+import utils.incremental
 import logging as log
 
 config = utils.configuration.Configuration()
@@ -15,20 +17,26 @@ try:
     node_api.setVerify(config.param('node', 'verify', True))
 
     # call Node API with a single transfer request to get one transfer spec with Aspera token
-    log.info('Generating transfer spec')
-    response_data = node_api.create('files/upload_setup', {
-        'transfer_requests': [
-            {'transfer_request': {'paths': [{'destination': config.param('node', 'folder_upload')}]}}
-        ]
-    })
+    # (several destinations can be set up in one call, see utils.node.upload_setup)
+    # the transfer spec is re-used by next runs while its token is valid (`spec_cache_ttl` seconds, 0 to disable)
+    spec_cache = utils.node.TransferSpecCache(ttl=config.param('node', 'spec_cache_ttl', utils.node.SPEC_CACHE_TTL_SEC))
 
-    # extract the single transfer spec (we sent a single transfer request)
-    t_spec = response_data['transfer_specs'][0]['transfer_spec']
-
-    # add file list in transfer spec
-    config.add_sources(t_spec, 'paths')
-
-    # start transfer, here we use the FASP Manager, but the newer Transfer SDK can be used as well
-    transfer_client.start_transfer_and_wait(t_spec)
+    if config.param('node', 'incremental', False):
+        # send only files that are new or changed compared to destination (listings are cached in a manifest)
+        manifest = utils.incremental.RemoteManifest(node_api, config.param('node', 'username'), config.param('node', 'folder_upload'))
+        files = utils.incremental.changed_files(node_api, config.param('node', 'folder_upload'), config.file_list(), manifest)
+        if files:
+            utils.node.upload(transfer_client, node_api, config.param('node', 'folder_upload'), utils.incremental.upload_paths(files),
+                              cache=spec_cache, user=config.param('node', 'username'))
+            utils.incremental.uploaded(manifest, files)
+        else:
+            log.info('Destination is up to date')
+    else:
+        # add file list in transfer spec
+        sources = {}
+        config.add_sources(sources, 'paths')
+        # a cached transfer spec rejected by the node is replaced by a new one (see utils.node.upload)
+        utils.node.upload(transfer_client, node_api, config.param('node', 'folder_upload'), sources['paths'],
+                          cache=spec_cache, user=config.param('node', 'username'))
 finally:
     transfer_client.shutdown()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# laurent.martin.aspera@fr.ibm.com
+# Download a remote folder tree using node API (download_setup), into a local folder (given on command line)
+# - the remote tree is listed with concurrent `files/browse` calls (utils.node.browse_tree)
+# - files are grouped in batches while listed: the first transfers start before the whole tree is listed
+# - transfers run in parallel through the transfer scheduler
+import os
+import utils.configuration
+import utils.transfer_client
+import utils.rest
+import utils.node
+import utils.scheduler
+import logging as log
+
+# a transfer is started for this number of files, or this size
+BATCH_FILES = 1000
+BATCH_BYTES = 1024 * 1024 * 1024
+
+config = utils.configuration.Configuration()
+if len(config.file_list()) != 1:
+    raise Exception('give one destination folder')
+local_folder = config.file_list()[0]
+transfer_client = utils.transfer_client.TransferClient(config).startup()
+
+try:
+    node_api = utils.rest.Rest(config.param('node', 'url'))
+    node_api.setAuthBasic(config.param('node', 'username'), config.param('node', 'password'))
+    node_api.setVerify(config.param('node', 'verify', True))
+    remote_folder = config.param('node', 'folder_download').rstrip('/')
+    scheduler = utils.scheduler.TransferScheduler(
+        transfer_client, per_destination=config.param('node', 'download_transfers', utils.scheduler.MAX_PER_DESTINATION))
+    jobs = []
+
+    def download(batch):
+        # the Aspera token authorizes the listed sources, files keep their path relative to the remote folder
+        t_spec = utils.node.download_setup(node_api, [([item['path'] for _, item in batch], local_folder)])[0].check()
+        t_spec['paths'] = [{'source': item['path'], 'destination': relative} for relative, item in batch]
+        jobs.append(scheduler.submit(t_spec, expected_bytes=sum(item.get('size', 0) for _, item in batch)))
+
+    os.makedirs(local_folder, exist_ok=True)
+    batch = []
+    batch_bytes = 0
+    for relative, item in utils.node.browse_tree(node_api, remote_folder, workers=config.param('node', 'browse_workers', utils.node.BROWSE_WORKERS)):
+        batch.append((relative, item))
+        batch_bytes += item.get('size', 0)
+        if len(batch) >= BATCH_FILES or batch_bytes >= BATCH_BYTES:
+            download(batch)
+            batch = []
+            batch_bytes = 0
+    if batch:
+        download(batch)
+    log.info(f'Listing done: {len(jobs)} transfers')
+    scheduler.shutdown()
+    for job in jobs:
+        job.result()
+finally:
+    transfer_client.shutdown()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# laurent.martin.aspera@fr.ibm.com
+# Watch a local folder and upload new or modified files as soon as they are written, using node API (upload_setup)
+# - the folder is given on command line, optionally synchronized first with `incremental`
+# - ready files are sent in batches, one transfer per batch, on the same transfer daemon
+# - a failed batch is logged and recorded in `node_watch_failed.jsonl` (log folder), watching continues
+# - stop with Ctrl-C
+import os
+import json
+import time
+import utils.configuration
+import utils.transfer_client
+import utils.rest
+import utils.node
+import utils.incremental
+import utils.watch
+import logging as log
+
+config = utils.configuration.Configuration()
+if len(config.file_list()) != 1:
+    raise Exception('give one folder to watch')
+folder = config.file_list()[0]
+transfer_client = utils.transfer_client.TransferClient(config).startup()
+
+try:
+    node_api = utils.rest.Rest(config.param('node', 'url'))
+    node_api.setAuthBasic(config.param('node', 'username'), config.param('node', 'password'))
+    node_api.setVerify(config.param('node', 'verify', True))
+    # transfer specs are re-used while their token is valid: no node API call for most batches
+    spec_cache = utils.node.TransferSpecCache(ttl=config.param('node', 'spec_cache_ttl', utils.node.SPEC_CACHE_TTL_SEC))
+
+    def upload(paths):
+        # a cached transfer spec rejected by the node is replaced by a new one
+        utils.node.upload(transfer_client, node_api, config.param('node', 'folder_upload'), paths,
+                          cache=spec_cache, user=config.param('node', 'username'))
+
+    # events are received from now on: files written during the initial synchronization are not missed
+    watcher = utils.watch.FolderWatcher(
+        folder,
+        settle=config.param('node', 'watch_settle', utils.watch.SETTLE_SEC),
+        window=config.param('node', 'watch_window', utils.watch.BATCH_WINDOW_SEC),
+        batch_bytes=config.param('node', 'watch_batch_bytes', utils.watch.BATCH_BYTES),
+        batch_files=config.param('node', 'watch_batch_files', utils.watch.BATCH_FILES),
+        polling=config.param('node', 'watch_polling', False))
+    if config.param('node', 'incremental', False):
+        manifest = utils.incremental.RemoteManifest(node_api, config.param('node', 'username'), config.param('node', 'folder_upload'))
+        files = utils.incremental.changed_files(node_api, config.param('node', 'folder_upload'), [folder], manifest)
+        if files:
+            upload(utils.incremental.upload_paths(files))
+            utils.incremental.uploaded(manifest, files)
+    failed_file = os.path.join(config._log_folder, 'node_watch_failed.jsonl')
+    log.info('Watching %s', folder)
+    try:
+        for batch in watcher.batches():
+            try:
+                upload([{'source': path, 'destination': relative} for path, relative in batch])
+            except Exception as e:
+                log.error('batch of %d files failed: %s (recorded in %s)', len(batch), e, failed_file)
+                with open(failed_file, 'a') as the_file:
+                    the_file.write(json.dumps({'time': time.time(), 'error': str(e), 'files': [path for path, _ in batch]}) + '\n')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+finally:
+    transfer_client.shutdown()
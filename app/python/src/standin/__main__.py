@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# laurent.martin.aspera@fr.ibm.com
+# Run a stand-in server in foreground: python3 -m standin <node|shares|faspex5|aoc|transferd> [options]
+# The base URL is printed on stdout when the server is ready (useful with port 0)
+import argparse
+import logging
+from standin.node import NodeStandin
+from standin.faspex5 import Faspex5Standin
+from standin.aoc import AocStandin
+
+# stand-in name -> (class, constructor arguments)
+STANDINS = {
+    'node': (NodeStandin, {}),
+    'shares': (NodeStandin, {'prefix': '/node_api'}),
+    'faspex5': (Faspex5Standin, {}),
+    'aoc': (AocStandin, {}),
+}
+# gRPC stand-in for the Transfer SDK daemon, imported only when used (requires grpc and stubs)
+TRANSFERD = 'transferd'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in server for Aspera APIs')
+    parser.add_argument('api', choices=list(STANDINS.keys()) + [TRANSFERD])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0, help='listening port, 0 for any')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to each response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='maximum random seconds added to latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='probability of HTTP 503 response (transferd: of transfer failure)')
+    parser.add_argument('--seed', type=int, help='seed for reproducible error injection')
+    parser.add_argument('--duration', type=float, default=1.0, help='transferd: seconds per transfer')
+    parser.add_argument('--event-rate', type=float, default=10.0, help='transferd: progress events per second per transfer')
+    parser.add_argument('--bytes', type=int, default=10000000, help='transferd: bytes per transfer')
+    parser.add_argument('--files', type=int, default=1, help='transferd: files per transfer')
+    parser.add_argument('--workers', type=int, default=64, help='transferd: maximum concurrent calls')
+    parser.add_argument('--level', default='info', help='log level')
+    args = parser.parse_args()
+    logging.basicConfig(format='%(levelname)-8s %(message)s', level=getattr(logging, args.level.upper(), logging.INFO))
+    if args.api == TRANSFERD:
+        from standin.transferd import FakeTransferd
+        standin = FakeTransferd(
+            host=args.host,
+            port=args.port,
+            workers=args.workers,
+            duration=args.duration,
+            event_rate=args.event_rate,
+            total_bytes=args.bytes,
+            files=args.files,
+            failure_rate=args.error_rate,
+            latency=args.latency,
+            seed=args.seed)
+    else:
+        standin_class, options = STANDINS[args.api]
+        standin = standin_class(
+            host=args.host,
+            port=args.port,
+            latency=args.latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+            seed=args.seed,
+            **options)
+    print(standin.url, flush=True)
+    try:
+        standin.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# laurent.martin.aspera@fr.ibm.com
+# Stand-in for the Aspera on Cloud API
+# State: user, workspaces, shared inboxes (dropboxes), packages and nodes
+import uuid
+import threading
+from standin.server import StandinServer, HttpError, token_response
+
+AOC_SPEC_FILE = 'IBM Aspera on Cloud API-0.2.6.yaml'
+# path of API v1 on server, not included in specification paths
+AOC_API_V1_PATH = '/api/v1'
+NODE_ID = '1'
+
+
+class AocStandin(StandinServer):
+    '''Aspera on Cloud API with token, self, workspaces, dropboxes, packages and nodes'''
+
+    def __init__(self, user_email='john@example.com', workspaces=('Default',), shared_inboxes=('Inbox',), **kwargs):
+        super().__init__(AOC_SPEC_FILE, prefix=AOC_API_V1_PATH, **kwargs)
+        self._state_lock = threading.Lock()
+        self._user = {'id': '100', 'name': user_email.split('@')[0], 'email': user_email}
+        self._workspaces = [{'id': str(10 + index), 'name': name} for index, name in enumerate(workspaces)]
+        self._dropboxes = [
+            {'id': str(20 + index), 'name': name, 'workspace_id': workspace['id']}
+            for workspace in self._workspaces for index, name in enumerate(shared_inboxes)]
+        self._packages = {}
+        self._nodes = {NODE_ID: {'id': NODE_ID, 'host': self.host, 'access_key': 'standin_access_key', 'url': self.address}}
+        # not in specification: user info and token endpoint
+        self.route('POST', '/oauth2/{org}/token', lambda request: token_response((request.body or {}).get('scope')), extra=True)
+        self.route('GET', '/self', lambda request: self._user, extra=True)
+        self.route('GET', '/workspaces', lambda request: search(self._workspaces, request.query.get('q')))
+        self.route('GET', '/dropboxes', self._dropboxes_list)
+        self.route('POST', '/packages', self._package_create)
+        self.route('GET', '/packages/{id}', lambda request: lookup(self._packages, request.params['id']))
+        self.route('GET', '/nodes/{id}', lambda request: lookup(self._nodes, request.params['id']))
+
+    def _dropboxes_list(self, request):
+        workspace_id = request.query.get('current_workspace_id')
+        dropboxes = [dropbox for dropbox in self._dropboxes if workspace_id is None or dropbox['workspace_id'] == workspace_id]
+        return search(dropboxes, request.query.get('q'))
+
+    def _package_create(self, request):
+        body = request.body or {}
+        if 'workspace_id' not in body or not body.get('recipients'):
+            raise HttpError(400, 'workspace_id and recipients required')
+        package = dict(body)
+        package.update({'id': uuid.uuid4().hex[:12], 'node_id': NODE_ID, 'contents_file_id': str(len(self._packages) + 1000)})
+        with self._state_lock:
+            self._packages[package['id']] = package
+        return 201, package
+
+
+def search(items, value):
+    '''Items whose name contains the value'''
+    if not value:
+        return items
+    return [item for item in items if value.lower() in item['name'].lower()]
+
+
+def lookup(items, item_id):
+    if item_id not in items:
+        raise HttpError(404, f'not found: {item_id}')
+    return items[item_id]
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# laurent.martin.aspera@fr.ibm.com
+# Stand-in for the Aspera Faspex 5 API
+# State: contacts, packages sent and received, shared folders
+import uuid
+import threading
+from standin.server import StandinServer, HttpError, token_response, transfer_spec, paginate
+
+FASPEX5_SPEC_FILE = 'IBM Aspera Faspex API-5.0.json'
+# base path of Faspex on server, as in specification paths
+FASPEX5_PATH = '/aspera/faspex'
+API_V5 = f'{FASPEX5_PATH}/api/v5'
+# mailbox types of packages
+MAILBOX_RECEIVED = ['inbox', 'inbox_history', 'inbox_all', 'inbox_all_history']
+MAILBOX_SENT = ['outbox', 'outbox_history']
+
+
+class Faspex5Standin(StandinServer):
+    '''Faspex 5 API with token, contacts, packages, transfer specs and shared folders'''
+
+    def __init__(self, username='john@example.com', shared_folders=('Server Files',), **kwargs):
+        super().__init__(FASPEX5_SPEC_FILE, url_path=FASPEX5_PATH, **kwargs)
+        self.username = username
+        self._state_lock = threading.Lock()
+        self._contacts = [{'id': '1', 'name': username, 'type': 'user', 'email': username}]
+        # package id -> package, in creation order
+        self._packages = {}
+        self._shared_folders = [{'id': str(index + 1), 'name': name} for index, name in enumerate(shared_folders)]
+        self.route('POST', f'{FASPEX5_PATH}/auth/token', lambda request: token_response())
+        self.route('GET', f'{API_V5}/contacts', self._contacts_list)
+        self.route('POST', f'{API_V5}/packages', self._package_create)
+        self.route('GET', f'{API_V5}/packages/{{id}}', lambda request: self._package(request.params['id']))
+        self.route('GET', f'{API_V5}/{{type}}/packages', self._packages_list)
+        self.route('POST', f'{API_V5}/packages/{{id}}/transfer_spec/upload', lambda request: self._transfer_spec(request, 'send'))
+        self.route('POST', f'{API_V5}/packages/{{id}}/transfer_spec/download', lambda request: self._transfer_spec(request, 'receive'))
+        self.route('GET', f'{API_V5}/shared_folders', lambda request: {'shared_folders': self._shared_folders})
+        self.route('POST', f'{API_V5}/packages/{{id}}/remote_transfer', self._remote_transfer)
+        self.route('GET', f'{API_V5}/packages/{{id}}/upload_details', self._upload_details)
+
+    def add_received_package(self, title, files=('file.bin',), sender='sender@example.com'):
+        '''Create a package in the inbox of user, return its id'''
+        return self._add_package({
+            'title': title,
+            'sender': {'name': sender},
+            'recipients': [{'name': self.username, 'recipient_type': 'user'}],
+            'files': list(files),
+        }, 'received')
+
+    def _add_package(self, package, mailbox):
+        package_id = uuid.uuid4().hex[:10]
+        package.update({'id': package_id, 'state': 'created', 'upload_status': 'completed', 'mailbox': mailbox})
+        with self._state_lock:
+            self._packages[package_id] = package
+        return package_id
+
+    def _package(self, package_id):
+        with self._state_lock:
+            package = self._packages.get(package_id)
+        if package is None:
+            raise HttpError(404, f'no such package: {package_id}')
+        return package
+
+    def _contacts_list(self, request):
+        value = request.query.get('q', '').lower()
+        contacts = [contact for contact in self._contacts if value in contact['name'].lower()]
+        return {'contacts': contacts, 'total_count': len(contacts)}
+
+    def _package_create(self, request):
+        body = request.body or {}
+        if 'title' not in body or not body.get('recipients'):
+            raise HttpError(400, 'title and recipients required')
+        package = dict(body)
+        package_id = self._add_package(package, 'sent')
+        package['upload_status'] = 'pending'
+        return 201, self._package(package_id)
+
+    def _packages_list(self, request):
+        mailbox = request.params['type']
+        if mailbox in MAILBOX_RECEIVED:
+            kind = 'received'
+        elif mailbox in MAILBOX_SENT:
+            kind = 'sent'
+        elif mailbox in ['all', 'global']:
+            kind = None
+        else:
+            raise HttpError(400, f'invalid mailbox: {mailbox}')
+        with self._state_lock:
+            packages = [package for package in self._packages.values() if kind is None or package['mailbox'] == kind]
+        return {
+            'packages': paginate(packages, request.query.get('offset'), request.query.get('limit')),
+            'total_count': len(packages),
+        }
+
+    def _transfer_spec(self, request, direction):
+        package = self._package(request.params['id'])
+        if 'transfer_type' not in request.query:
+            raise HttpError(400, 'transfer_type required')
+        if direction == 'receive' and request.query.get('type') not in ('sent', 'received'):
+            raise HttpError(400, 'type required: sent or received')
+        if direction == 'send':
+            paths = (request.body or {}).get('paths', [])
+        else:
+            paths = [{'source': name} for name in package.get('files', [])]
+            package['state'] = 'downloaded'
+        return transfer_spec(self.host, direction, paths, tags={'aspera': {'faspex': {'package_id': package['id']}}})
+
+    def _remote_transfer(self, request):
+        package = self._package(request.params['id'])
+        shared_folder_id = (request.body or {}).get('shared_folder_id')
+        if shared_folder_id not in [folder['id'] for folder in self._shared_folders]:
+            raise HttpError(404, f'no such shared folder: {shared_folder_id}')
+        package['upload_status'] = 'completed'
+        return {'id': package['id']}
+
+    def _upload_details(self, request):
+        package = self._package(request.params['id'])
+        return {'upload_status': package['upload_status']}
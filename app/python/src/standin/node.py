@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# laurent.martin.aspera@fr.ibm.com
+# Stand-in for the Aspera Node API (also used behind Shares with prefix `/node_api`)
+# State: an in-memory file tree, and a log of transfers
+import time
+import threading
+import posixpath
+from standin.server import StandinServer, HttpError, transfer_spec
+
+NODE_SPEC_FILE = 'IBM Aspera Node API-4.4.6.yaml'
+# default number of items returned by browse
+BROWSE_DEFAULT_COUNT = 100
+# default number of transfers returned by ops/transfers
+TRANSFERS_DEFAULT_COUNT = 100
+
+
+class NodeStandin(StandinServer):
+    '''Node API with files/upload_setup, files/download_setup, files/browse and ops/transfers'''
+
+    def __init__(self, folders=('/Upload',), **kwargs):
+        super().__init__(NODE_SPEC_FILE, **kwargs)
+        self._state_lock = threading.Lock()
+        # folder path -> {name: metadata}
+        self._folders = {'/': {}}
+        # transfer records, in order of last event
+        self._transfers = []
+        for folder in folders:
+            self.add_folder(folder)
+        self.route('POST', '/files/upload_setup', lambda request: self._setup(request, 'send', 'destination'))
+        self.route('POST', '/files/download_setup', lambda request: self._setup(request, 'receive', 'source'))
+        self.route('POST', '/files/browse', self._browse)
+        self.route('GET', '/ops/transfers', self._transfers_list)
+        self.route('GET', '/ops/transfers/{transfer_id}', self._transfer_get)
+
+    def add_folder(self, path):
+        '''Create a folder and its parents'''
+        path = posixpath.normpath(path)
+        with self._state_lock:
+            self._add_folder(path)
+
+    def add_file(self, path, size, mtime=None):
+        '''Create or replace a file, and create its parent folders'''
+        path = posixpath.normpath(path)
+        parent, name = posixpath.split(path)
+        with self._state_lock:
+            self._add_folder(parent)
+            self._folders[parent][name] = {
+                'path': path,
+                'basename': name,
+                'type': 'file',
+                'size': size,
+                'mtime': format_time(time.time() if mtime is None else mtime),
+            }
+
+    def add_transfer(self, record):
+        '''Add a transfer record, as reported by ops/transfers'''
+        with self._state_lock:
+            self._transfers.append(record)
+
+    def _add_folder(self, path):
+        if path in self._folders:
+            return
+        parent, name = posixpath.split(path)
+        self._add_folder(parent)
+        self._folders[path] = {}
+        self._folders[parent][name] = {'path': path, 'basename': name, 'type': 'directory', 'size': 0, 'mtime': format_time(time.time())}
+
+    def _setup(self, request, direction, path_key):
+        '''Generate one transfer spec per transfer request, or an error for this entry'''
+        transfer_specs = []
+        for item in (request.body or {}).get('transfer_requests', []):
+            paths = item.get('transfer_request', {}).get('paths')
+            if not paths or not all(path_key in path for path in paths):
+                transfer_specs.append({'error': {'code': 400, 'reason': 'Bad Request', 'user_message': f'paths with {path_key} required'}})
+                continue
+            if direction == 'send':
+                destination = paths[0][path_key]
+                if posixpath.normpath(posixpath.dirname(destination) or '/') not in self._folders:
+                    transfer_specs.append({'error': {'code': 404, 'reason': 'Not Found', 'user_message': f'no such folder: {destination}'}})
+                    continue
+            transfer_specs.append({'transfer_spec': transfer_spec(self.host, direction, paths)})
+        return {'transfer_specs': transfer_specs}
+
+    def _browse(self, request):
+        body = request.body or {}
+        if 'path' not in body:
+            raise HttpError(400, 'path required')
+        path = posixpath.normpath(body['path'])
+        skip = int(body.get('skip', 0))
+        count = int(body.get('count', BROWSE_DEFAULT_COUNT))
+        with self._state_lock:
+            parent, name = posixpath.split(path)
+            if path in self._folders:
+                items = sorted(self._folders[path].values(), key=lambda item: item['basename'])
+                meta = {'path': path, 'basename': name, 'type': 'directory', 'size': 0}
+            elif name in self._folders.get(parent, {}):
+                return {'self': self._folders[parent][name], 'items': [], 'item_count': 0, 'total_count': 0}
+            else:
+                raise HttpError(404, f'no such file or directory: {path}')
+        page = items[skip:skip + count]
+        return {'self': meta, 'items': page, 'item_count': len(page), 'total_count': len(items)}
+
+    def _transfers_list(self, request):
+        '''Transfers after `iteration_token`, oldest first, with a Link header to get the next ones'''
+        start = int(request.query.get('iteration_token', 0))
+        count = int(request.query.get('count', TRANSFERS_DEFAULT_COUNT))
+        with self._state_lock:
+            page = self._transfers[start:start + count]
+        next_query = dict(request.query)
+        next_query['iteration_token'] = start + len(page)
+        link = f'<{request.url(self.prefix + request.path, next_query)}>; rel="next"'
+        return 200, page, {'Link': link}
+
+    def _transfer_get(self, request):
+        with self._state_lock:
+            for record in self._transfers:
+                if record.get('id') == request.params['transfer_id']:
+                    return record
+        raise HttpError(404, 'no such transfer')
+
+
+def format_time(timestamp):
+    '''Time in ISO format as used by Node API'''
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp))
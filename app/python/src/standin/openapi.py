@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# laurent.martin.aspera@fr.ibm.com
+# OpenAPI specification loader for stand-in servers: route matching and sample responses built from schemas
+import os
+import re
+import json
+import utils.configuration
+
+# folder with OpenAPI specifications, relative to project's root folder
+OPENAPI_FOLDER_REL = 'openapi'
+# maximum depth when building a sample value from a schema (schemas are recursive)
+SAMPLE_MAX_DEPTH = 6
+HTTP_METHODS = ['get', 'put', 'post', 'delete', 'patch']
+# sample values by schema type, when schema has no example
+SAMPLE_VALUES = {
+    'string': 'string',
+    'integer': 0,
+    'number': 0.0,
+    'boolean': False,
+}
+
+
+def spec_path(file_name):
+    '''Path of a bundled OpenAPI specification file'''
+    top_folder = os.getenv(utils.configuration.DIR_TOP_VAR)
+    if top_folder is None:
+        top_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', '..')
+    return os.path.join(os.path.abspath(top_folder), OPENAPI_FOLDER_REL, file_name)
+
+
+class OpenApiSpec:
+    '''Operations of an OpenAPI specification, indexed for request routing'''
+
+    def __init__(self, file_name):
+        path = spec_path(file_name)
+        if path.endswith('.json'):
+            with open(path) as the_file:
+                self._spec = json.load(the_file)
+        else:
+            self._spec = utils.configuration.load_yaml_cached(path)
+        self.title = self._spec.get('info', {}).get('title', file_name)
+        # (method, template) -> operation
+        self.operations = {}
+        # list of (literal segment count, method, template, compiled regex), most specific first
+        self._routes = []
+        for template, path_item in self._spec.get('paths', {}).items():
+            for method in HTTP_METHODS:
+                if method in path_item:
+                    self.operations[(method.upper(), template)] = path_item[method]
+            literals = len([segment for segment in template.split('/') if segment and not segment.startswith('{')])
+            self._routes.append((literals, template, template_regex(template)))
+        self._routes.sort(key=lambda route: -route[0])
+
+    def match(self, path):
+        '''
+        Find path template matching a request path.
+
+        :return: (template, path parameters) or (None, None)
+        '''
+        for _, template, regex in self._routes:
+            match = regex.match(path)
+            if match:
+                return template, match.groupdict()
+        return None, None
+
+    def has_operation(self, method, template):
+        return (method, template) in self.operations
+
+    def resolve(self, schema):
+        '''Resolve a local `$ref`'''
+        while isinstance(schema, dict) and '$ref' in schema:
+            node = self._spec
+            for key in schema['$ref'].lstrip('#/').split('/'):
+                node = node[key]
+            schema = node
+        return schema
+
+    def sample_response(self, method, template):
+        '''
+        Build a canned response for an operation, from the example or schema of its success response.
+
+        :return: (status code, body)
+        '''
+        responses = self.operations[(method, template)].get('responses', {})
+        for code in sorted(responses):
+            if not code.startswith('2'):
+                continue
+            content = self.resolve(responses[code]).get('content', {})
+            media = content.get('application/json')
+            if media is None:
+                return int(code), None
+            if 'example' in media:
+                return int(code), media['example']
+            return int(code), self.sample(media.get('schema', {}))
+        return 200, None
+
+    def sample(self, schema, depth=0):
+        '''Build a sample value conforming to a schema'''
+        schema = self.resolve(schema)
+        if 'example' in schema:
+            return schema['example']
+        if 'enum' in schema:
+            return schema['enum'][0]
+        for combination in ['allOf', 'oneOf', 'anyOf']:
+            if combination in schema:
+                if combination != 'allOf':
+                    return self.sample(schema[combination][0], depth)
+                result = {}
+                for item in schema['allOf']:
+                    value = self.sample(item, depth)
+                    if isinstance(value, dict):
+                        result.update(value)
+                return result
+        schema_type = schema.get('type', 'object' if 'properties' in schema else None)
+        if depth >= SAMPLE_MAX_DEPTH:
+            return [] if schema_type == 'array' else {} if schema_type == 'object' else None
+        if schema_type == 'array':
+            return [self.sample(schema.get('items', {}), depth + 1)]
+        if schema_type == 'object':
+            return {name: self.sample(value, depth + 1) for name, value in schema.get('properties', {}).items()}
+        return SAMPLE_VALUES.get(schema_type)
+
+
+def template_regex(template):
+    '''Regular expression matching a path template, with named groups for parameters'''
+    pattern = re.sub(r'\\{(\w+)\\}', r'(?P<\1>[^/]+)', re.escape(template))
+    return re.compile(f'^{pattern}$')
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# laurent.martin.aspera@fr.ibm.com
+# Base HTTP stand-in server for Aspera APIs, driven by an OpenAPI specification
+# - requests are routed according to the path templates of the specification
+# - operations with a handler get stateful responses, others get a sample response built from the specification
+# - latency and errors can be injected, globally or per path template
+import json
+import time
+import uuid
+import random
+import logging
+import threading
+from urllib.parse import urlparse, parse_qsl
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from standin.openapi import OpenApiSpec, template_regex
+
+MIME_JSON = 'application/json'
+# validity of generated bearer tokens
+TOKEN_VALIDITY_SEC = 3600
+# port of the (fake) transfer server in generated transfer specs
+FASP_PORT = 33001
+
+
+class Request:
+    '''Request received by a stand-in handler'''
+
+    def __init__(self, method, path, params, query, headers, body):
+        self.method = method
+        self.path = path
+        # path parameters, from path template
+        self.params = params
+        # list of (name, value) query parameters
+        self.query_list = query
+        # query parameters, last value wins
+        self.query = dict(query)
+        self.headers = headers
+        self.body = body
+
+    def url(self, path, query=None):
+        '''Absolute URL on this server, for Link headers'''
+        host = self.headers.get('Host', 'localhost')
+        result = f'http://{host}{path}'
+        if query:
+            result += '?' + '&'.join(f'{name}={value}' for name, value in query.items())
+        return result
+
+
+class HttpError(Exception):
+    '''Raised by handlers to return an error response'''
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class StandinServer:
+    '''
+    Local HTTP server standing in for an Aspera API.
+
+    :param spec_file: file name of the OpenAPI specification in the `openapi` folder
+    :param prefix: path prefix of the API on the server, not included in specification paths
+    :param latency: seconds added to each response
+    :param jitter: maximum random seconds added to latency
+    :param error_rate: probability (0-1) to answer with an HTTP 503 error
+    :param error_rates: per path template error probability, overrides `error_rate`
+    :param seed: seed of random generator for reproducible error injection
+    :param url_path: path appended to the server address to build the base URL used by clients
+    '''
+
+    def __init__(self, spec_file, prefix='', host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate=0.0, error_rates=None, seed=None,
+                 url_path=''):
+        self.spec = OpenApiSpec(spec_file)
+        self.prefix = prefix.rstrip('/')
+        self.url_path = url_path
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_rates = error_rates or {}
+        self.request_count = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        # (method, template) -> handler
+        self._handlers = {}
+        # handlers for endpoints not described in specification: list of (method, template, regex)
+        self._extra_routes = []
+        self._http_server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._http_server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        '''Base URL of the API'''
+        return f'{self.address}{self.prefix}{self.url_path}'
+
+    @property
+    def address(self):
+        '''Scheme, host and port of the server'''
+        host, port = self._http_server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def host(self):
+        return self._http_server.server_address[0]
+
+    def route(self, method, template, handler, extra=False):
+        '''
+        Register a handler for an operation.
+
+        :param template: path template as in specification
+        :param extra: endpoint is not in specification
+        '''
+        if extra:
+            self._extra_routes.append((method, template, template_regex(template)))
+        elif not self.spec.has_operation(method, template):
+            raise KeyError(f'{self.spec.title}: no operation {method} {template}')
+        self._handlers[(method, template)] = handler
+
+    def start(self):
+        '''Serve requests in a background thread'''
+        self._thread = threading.Thread(target=self._http_server.serve_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        logging.info('%s stand-in on %s', self.spec.title, self.url)
+        return self
+
+    def stop(self):
+        self._http_server.shutdown()
+        self._http_server.server_close()
+
+    def serve_forever(self):
+        logging.info('%s stand-in on %s', self.spec.title, self.url)
+        self._http_server.serve_forever()
+
+    def _match(self, method, path):
+        for extra_method, template, regex in self._extra_routes:
+            match = regex.match(path)
+            if match and extra_method == method:
+                return template, match.groupdict()
+        return self.spec.match(path)
+
+    def _inject(self, template):
+        '''Apply latency, and return True if an error shall be returned'''
+        with self._lock:
+            self.request_count += 1
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+            error = self._random.random() < self.error_rates.get(template, self.error_rate)
+        if delay > 0:
+            time.sleep(delay)
+        return error
+
+    def handle(self, method, raw_path, headers, raw_body):
+        '''Process one request, return (status, body, headers)'''
+        url = urlparse(raw_path)
+        path = url.path
+        if self.prefix:
+            if not path.startswith(self.prefix):
+                return 404, error_body(404, f'not under {self.prefix}'), {}
+            path = path[len(self.prefix):]
+        template, params = self._match(method, path)
+        if template is None:
+            return 404, error_body(404, f'no such endpoint: {path}'), {}
+        if self._inject(template):
+            return 503, error_body(503, 'injected error'), {}
+        handler = self._handlers.get((method, template))
+        if handler is None:
+            if not self.spec.has_operation(method, template):
+                return 405, error_body(405, f'{method} not allowed on {template}'), {}
+            status, body = self.spec.sample_response(method, template)
+            return status, body, {}
+        body = None
+        if raw_body:
+            try:
+                body = json.loads(raw_body)
+            except json.JSONDecodeError:
+                # e.g. form encoded token requests
+                body = dict(parse_qsl(raw_body.decode('utf-8')))
+        request = Request(method, path, params, parse_qsl(url.query), headers, body)
+        try:
+            result = handler(request)
+        except HttpError as e:
+            return e.status, error_body(e.status, str(e)), {}
+        if isinstance(result, tuple):
+            return result if len(result) == 3 else (result[0], result[1], {})
+        return 200, result, {}
+
+    def _handler_class(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # headers and body are written separately: without this, clients re-using connections wait for delayed ACK
+            disable_nagle_algorithm = True
+
+            def _process(self):
+                length = int(self.headers.get('Content-Length', 0))
+                raw_body = self.rfile.read(length) if length else b''
+                status, body, headers = standin.handle(self.command, self.path, self.headers, raw_body)
+                data = b'' if body is None else json.dumps(body, default=str).encode('utf-8')
+                self.send_response(status)
+                if body is not None:
+                    self.send_header('Content-Type', MIME_JSON)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = _process
+            do_POST = _process
+            do_PUT = _process
+            do_DELETE = _process
+            do_PATCH = _process
+
+            def log_message(self, format, *args):
+                logging.debug('stand-in: ' + format, *args)
+
+        return Handler
+
+
+def error_body(status, message):
+    '''Error in Aspera API format'''
+    return {'error': {'code': status, 'reason': message, 'user_message': message}}
+
+
+def token_response(scope=None):
+    '''OAuth 2 token endpoint response with a new random token'''
+    result = {
+        'access_token': uuid.uuid4().hex,
+        'token_type': 'Bearer',
+        'expires_in': TOKEN_VALIDITY_SEC,
+    }
+    if scope is not None:
+        result['scope'] = scope
+    return result
+
+
+def transfer_spec(remote_host, direction, paths, **extra):
+    '''Transfer spec with an Aspera transfer token, as generated by the Node API'''
+    result = {
+        'direction': direction,
+        'remote_host': remote_host,
+        'remote_user': 'xfer',
+        'ssh_port': FASP_PORT,
+        'fasp_port': FASP_PORT,
+        'authentication': 'token',
+        'token': f'ATV2_standin_{uuid.uuid4().hex}',
+        'target_rate_kbps': 100000,
+        'rate_policy': 'fair',
+        'cipher': 'aes-128',
+        'http_fallback': False,
+        'paths': paths,
+    }
+    result.update(extra)
+    return result
+
+
+def paginate(items, offset, limit):
+    '''Slice of a list, with offset and limit from query parameters'''
+    offset = int(offset or 0)
+    if limit is None:
+        return items[offset:]
+    return items[offset:offset + int(limit)]
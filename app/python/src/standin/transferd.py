@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# laurent.martin.aspera@fr.ibm.com
+# Stand-in for the Transfer SDK daemon (transferd): gRPC TransferService with StartTransfer and MonitorTransfers
+# Transfers are simulated (no ascp): each one follows a timeline of events computed at start,
+# with configurable duration, event rate, size, number of files and failure rate.
+import json
+import time
+import uuid
+import heapq
+import random
+import logging
+import threading
+from concurrent import futures
+import utils.transfer_client
+
+utils.transfer_client.load_stubs()
+grpc = utils.transfer_client.grpc
+transfer_manager = utils.transfer_client.transfer_manager
+transfer_manager_grpc = utils.transfer_client.transfer_manager_grpc
+
+# default simulated transfer
+DEFAULT_DURATION_SEC = 1.0
+DEFAULT_EVENT_RATE = 10.0
+DEFAULT_BYTES = 10000000
+DEFAULT_FILES = 1
+# error code reported for simulated failures (ascp: network failure)
+FAILURE_CODE = 13
+# gRPC worker threads: each monitored transfer holds one while it streams
+DEFAULT_WORKERS = 64
+
+
+class SimulatedTransfer:
+    '''One simulated transfer: list of (offset_sec, status, event, bytes, files, error) computed at start'''
+
+    def __init__(self, transfer_id, duration, event_rate, total_bytes, files, fails, rng):
+        self.transfer_id = transfer_id
+        self.start_time = time.monotonic()
+        self.timeline = []
+        progress_count = max(int(duration * event_rate), 1)
+        # a failed transfer stops at a random point of its timeline
+        last_index = rng.randint(0, progress_count - 1) if fails else progress_count - 1
+        self.timeline.append((0.0, 'QUEUED', 'SESSION_START', 0, 0, None))
+        for index in range(last_index + 1):
+            ratio = (index + 1) / progress_count
+            self.timeline.append((duration * ratio, 'RUNNING', 'FILE_PROGRESS', int(total_bytes * ratio), int(files * ratio), None))
+        offset, _, _, last_bytes, last_files, _ = self.timeline[-1]
+        if fails:
+            self.timeline.append((offset, 'FAILED', 'SESSION_ERROR', last_bytes, last_files, 'simulated network failure'))
+        else:
+            self.timeline.append((offset, 'COMPLETED', 'SESSION_STOP', total_bytes, files, None))
+
+    def pending_events(self):
+        '''Events not yet reached, plus the last reached one (the current state), with absolute time'''
+        elapsed = time.monotonic() - self.start_time
+        first = 0
+        for index, item in enumerate(self.timeline):
+            if item[0] <= elapsed:
+                first = index
+        return [(self.start_time + item[0], item) for item in self.timeline[first:]]
+
+
+class FakeTransferService(transfer_manager_grpc.TransferServiceServicer):
+    '''
+    Transfer service simulating transfers.
+
+    :param duration: seconds taken by a transfer
+    :param event_rate: progress events per second and per transfer
+    :param total_bytes: bytes reported for a completed transfer
+    :param files: files reported for a completed transfer
+    :param failure_rate: probability (0-1) that a transfer fails
+    :param latency: seconds added to StartTransfer
+    :param seed: seed of random generator for reproducible failures
+    '''
+
+    def __init__(self, duration=DEFAULT_DURATION_SEC, event_rate=DEFAULT_EVENT_RATE, total_bytes=DEFAULT_BYTES, files=DEFAULT_FILES,
+                 failure_rate=0.0, latency=0.0, seed=None):
+        self.duration = duration
+        self.event_rate = event_rate
+        self.total_bytes = total_bytes
+        self.files = files
+        self.failure_rate = failure_rate
+        self.latency = latency
+        self.start_count = 0
+        self.event_count = 0
+        # (transfer id, changes) received by ModifyTransfer
+        self.modifications = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        # transfer id -> SimulatedTransfer
+        self._transfers = {}
+        self._info_fields = transfer_manager.TransferInfo.DESCRIPTOR.fields_by_name
+
+    def StartTransfer(self, request, context):
+        try:
+            json.loads(request.transferSpec)
+        except ValueError as e:
+            return transfer_manager.StartTransferResponse(
+                status=transfer_manager.TransferStatus.Value('FAILED'),
+                error=transfer_manager.Error(code=1, description=f'invalid transfer spec: {e}'))
+        if self.latency > 0:
+            time.sleep(self.latency)
+        with self._lock:
+            self.start_count += 1
+            fails = self._random.random() < self.failure_rate
+            transfer = SimulatedTransfer(uuid.uuid4().hex, self.duration, self.event_rate, self.total_bytes, self.files, fails, self._random)
+            self._transfers[transfer.transfer_id] = transfer
+        return transfer_manager.StartTransferResponse(
+            transferId=transfer.transfer_id,
+            status=transfer_manager.TransferStatus.Value('QUEUED'))
+
+    def MonitorTransfers(self, request, context):
+        '''Stream events of the transfers in filters (all known transfers if none), in time order, until they end'''
+        transfer_ids = [transfer_id for item in request.filters for transfer_id in item.transferId]
+        with self._lock:
+            if not transfer_ids:
+                transfer_ids = list(self._transfers.keys())
+            transfers = [self._transfers.get(transfer_id) for transfer_id in transfer_ids]
+        queue = []
+        for transfer_id, transfer in zip(transfer_ids, transfers):
+            if transfer is None:
+                yield transfer_manager.TransferResponse(
+                    transferId=transfer_id,
+                    status=transfer_manager.TransferStatus.Value('UNKNOWN_STATUS'),
+                    error=transfer_manager.Error(code=2, description=transfer_id))
+                continue
+            for event_time, item in transfer.pending_events():
+                heapq.heappush(queue, (event_time, transfer_id, item))
+        while queue and context.is_active():
+            event_time, transfer_id, item = heapq.heappop(queue)
+            delay = event_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            with self._lock:
+                self.event_count += 1
+            yield self._response(transfer_id, item)
+
+    def ModifyTransfer(self, request, context):
+        '''Record new parameters of a transfer (the simulated timeline is not changed), only with proto files having this call'''
+        with self._lock:
+            known = request.transferId in self._transfers
+            if known:
+                self.modifications.append((request.transferId, json.loads(request.transferSpec)))
+        if not known:
+            return transfer_manager.ModifyTransferResponse(
+                transferId=request.transferId,
+                status=transfer_manager.TransferStatus.Value('UNKNOWN_STATUS'),
+                error=transfer_manager.Error(code=2, description=request.transferId))
+        return transfer_manager.ModifyTransferResponse(transferId=request.transferId, status=transfer_manager.TransferStatus.Value('RUNNING'))
+
+    def _response(self, transfer_id, item):
+        offset, status, event, bytes_transferred, files, error = item
+        info = {
+            'bytesTransferred': bytes_transferred,
+            'filesCompleted': files,
+            'bytesExpected': self.total_bytes,
+            'elapsedUsec': int(offset * 1000000),
+        }
+        response = {
+            'transferId': transfer_id,
+            'status': transfer_manager.TransferStatus.Value(status),
+            'transferEvent': event_value(event),
+            # only fields known by this version of the proto file
+            'transferInfo': transfer_manager.TransferInfo(**{name: value for name, value in info.items() if name in self._info_fields}),
+        }
+        if error is not None:
+            response['error'] = transfer_manager.Error(code=FAILURE_CODE, description=error)
+        return transfer_manager.TransferResponse(**response)
+
+
+class FakeTransferd:
+    '''
+    gRPC server with a `FakeTransferService`, in a background thread pool.
+
+    :param host: listening address
+    :param port: listening port, 0 for any
+    :param workers: maximum number of concurrent calls (each monitored transfer holds one)
+    :param kwargs: parameters of `FakeTransferService`
+    '''
+
+    def __init__(self, host='127.0.0.1', port=0, workers=DEFAULT_WORKERS, **kwargs):
+        self.service = FakeTransferService(**kwargs)
+        self._grpc_server = grpc.server(futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='transferd'))
+        transfer_manager_grpc.add_TransferServiceServicer_to_server(self.service, self._grpc_server)
+        self.host = host
+        self.port = self._grpc_server.add_insecure_port(f'{host}:{port}')
+
+    @property
+    def url(self):
+        '''URL of server, as in `trsdk.url` of config file'''
+        return f'grpc://{self.host}:{self.port}'
+
+    def start(self):
+        self._grpc_server.start()
+        logging.info('Transfer SDK stand-in on %s', self.url)
+        return self
+
+    def stop(self):
+        self._grpc_server.stop(grace=None)
+
+    def serve_forever(self):
+        self.start()
+        self._grpc_server.wait_for_termination()
+
+
+def event_value(name):
+    '''Value of a transfer event, progress events are not named the same in all versions of the proto file'''
+    if name == 'FILE_PROGRESS' and name not in transfer_manager.TransferEvent.keys():
+        name = 'FILE_STOP'
+    return transfer_manager.TransferEvent.Value(name)
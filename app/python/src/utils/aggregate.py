@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# laurent.martin.aspera@fr.ibm.com
+# Aggregation of small files before transfer: files below a size threshold are packed into tar archives in a spool folder,
+# and transferred together with large files, which are sent as is.
+# - sources are walked once (`utils.incremental.iter_local`), archives are written in parallel while walking,
+#   each with a bounded number of bytes
+# - memory is bounded: file contents are streamed into archives, and only a limited number of batches are pending
+# - archives are delivered as `.tar` files: the receiver extracts them in place with `unpack`
+#   (for an upload, this must be done on the server, e.g. by a post-processing script)
+import os
+import re
+import uuid
+import shutil
+import atexit
+import logging
+import tarfile
+import tempfile
+import threading
+from concurrent import futures
+import utils.incremental
+
+# files smaller than this are packed into archives
+SMALL_FILE_SIZE = 65536
+# archives are closed when they reach this size (data only), or this number of files
+ARCHIVE_SIZE = 256 * 1024 * 1024
+ARCHIVE_FILES = 100000
+# number of archives written in parallel
+PACK_WORKERS = 4
+# name of archives: recognized by `unpack`
+ARCHIVE_NAME_FORMAT = 'aspera_aggregate_{run}_{index:06d}.tar'
+ARCHIVE_NAME_REGEX = re.compile(r'^aspera_aggregate_[0-9a-f]{32}_[0-9]{6}\.tar$')
+
+
+class AggregateResult:
+    '''Result of `Aggregator.pack`'''
+
+    def __init__(self):
+        # transfer spec paths: sources without small files, large files of other sources, and archives,
+        # with destination relative to destination folder
+        self.paths = []
+        self.archives = []
+        self.packed_files = 0
+        self.packed_bytes = 0
+        self.large_files = 0
+
+    def __str__(self):
+        return f'{self.packed_files} files ({self.packed_bytes} bytes) in {len(self.archives)} archives, {self.large_files} large files'
+
+
+class Aggregator:
+    '''
+    Pack small files of upload sources into archives.
+
+    :param spool: folder where archives are written, None for a temporary folder removed at exit
+    :param threshold: files smaller than this are packed
+    '''
+
+    def __init__(self, spool=None, threshold=SMALL_FILE_SIZE, archive_size=ARCHIVE_SIZE, archive_files=ARCHIVE_FILES, workers=PACK_WORKERS):
+        if spool is None:
+            spool = tempfile.mkdtemp(prefix='aspera_aggregate_')
+            atexit.register(shutil.rmtree, spool, True)
+        os.makedirs(spool, exist_ok=True)
+        self.spool = spool
+        self.threshold = threshold
+        self.archive_size = archive_size
+        self.archive_files = archive_files
+        self.workers = workers
+
+    def pack(self, sources):
+        '''
+        Walk sources (files or folders) and pack small files.
+
+        As Aspera does for a source folder, relative paths start with the name of the source.
+        A source with no small file is sent as is: the same path as without aggregation, with the name of the source as destination.
+        :return: `AggregateResult`
+        '''
+        result = AggregateResult()
+        run = uuid.uuid4().hex
+        # source -> transfer spec paths of its large files, and sources with packed files
+        large = {os.path.normpath(source): [] for source in sources}
+        packed_sources = set()
+        # batches waiting to be written are limited: bounded memory
+        slots = threading.BoundedSemaphore(self.workers * 2)
+        with futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='pack') as executor:
+            jobs = []
+            batch = []
+            batch_bytes = 0
+            for item in utils.incremental.iter_local(sources):
+                if item.size >= self.threshold:
+                    large[item.source].append({'source': item.path, 'destination': item.relative})
+                    result.large_files += 1
+                    continue
+                packed_sources.add(item.source)
+                batch.append((item.path, item.relative, item.size, item.mtime, item.mode))
+                batch_bytes += item.size
+                result.packed_files += 1
+                result.packed_bytes += item.size
+                if batch_bytes >= self.archive_size or len(batch) >= self.archive_files:
+                    jobs.append(self._submit(executor, slots, run, len(jobs), batch))
+                    batch = []
+                    batch_bytes = 0
+            if batch:
+                jobs.append(self._submit(executor, slots, run, len(jobs), batch))
+            for source, paths in large.items():
+                if source in packed_sources:
+                    result.paths.extend(paths)
+                else:
+                    result.paths.append({'source': source, 'destination': os.path.basename(source)})
+            for job in jobs:
+                name = job.result()
+                result.archives.append(os.path.join(self.spool, name))
+                result.paths.append({'source': os.path.join(self.spool, name), 'destination': name})
+        logging.info('aggregate: %s', result)
+        return result
+
+    def _submit(self, executor, slots, run, index, batch):
+        slots.acquire()
+        job = executor.submit(write_archive, os.path.join(self.spool, ARCHIVE_NAME_FORMAT.format(run=run, index=index)), batch)
+        job.add_done_callback(lambda _: slots.release())
+        return job
+
+
+def write_archive(archive_path, files):
+    '''Write files in a tar archive, return its file name'''
+    # tar header built from known attributes: no stat or user/group name lookup per file
+    with tarfile.open(archive_path, 'w', format=tarfile.PAX_FORMAT) as archive:
+        for path, relative, size, mtime, mode in files:
+            info = tarfile.TarInfo(relative)
+            info.size = size
+            # integer time: no PAX extended header per file
+            info.mtime = int(mtime)
+            info.mode = mode & 0o7777
+            with open(path, 'rb') as the_file:
+                archive.addfile(info, the_file)
+    return os.path.basename(archive_path)
+
+
+def unpack(folder, remove=True):
+    '''
+    Extract archives created by `Aggregator` found in `folder` (e.g. destination of a download), and remove them.
+
+    :return: number of archives extracted
+    '''
+    count = 0
+    for entry in os.scandir(folder):
+        if not entry.is_file() or not ARCHIVE_NAME_REGEX.match(entry.name):
+            continue
+        with tarfile.open(entry.path, 'r') as archive:
+            _extract(archive, folder)
+        if remove:
+            os.remove(entry.path)
+        count += 1
+    logging.info('aggregate: %d archives extracted in %s', count, folder)
+    return count
+
+
+def _extract(archive, folder):
+    '''Extract regular files and folders of an archive, rejecting other types and paths outside `folder`'''
+    # faster than `extractall`: no link resolution per member, parent folders are created once
+    created = set()
+    for member in archive:
+        parts = member.name.split('/')
+        if member.name.startswith('/') or '..' in parts or not (member.isfile() or member.isdir()):
+            raise Exception(f'unsafe archive member: {member.name}')
+        target = os.path.join(folder, *parts)
+        if member.isdir():
+            os.makedirs(target, exist_ok=True)
+            continue
+        parent = os.path.dirname(target)
+        if parent not in created:
+            os.makedirs(parent, exist_ok=True)
+            created.add(parent)
+        with archive.extractfile(member) as source, open(target, 'wb') as destination:
+            shutil.copyfileobj(source, destination)
+        os.chmod(target, member.mode & 0o777)
+        os.utime(target, (member.mtime, member.mtime))
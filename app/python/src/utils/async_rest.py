@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# laurent.martin.aspera@fr.ibm.com
+# Asynchronous variant of `utils.rest.Rest`, on `httpx.AsyncClient` (optional dependency: pip3 install httpx)
+# Independent calls can be run concurrently with `asyncio.gather`, and one client (connection pool)
+# can be shared by many `AsyncRest` objects, e.g. by the jobs of an asyncio service.
+import time
+import base64
+import asyncio
+import logging as log
+import httpx
+import utils.codec
+import utils.metrics
+import utils.rest
+import utils.tracing
+
+# connection pool of clients created by `new_client`
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 20
+# timeout of HTTP requests (connect, read, write, pool)
+TIMEOUT_SEC = 60
+
+
+def new_client(verify=True, max_connections=MAX_CONNECTIONS, timeout=TIMEOUT_SEC):
+    '''
+    HTTP client with a connection pool, to share among `AsyncRest` objects (close it with `aclose`).
+    '''
+    return httpx.AsyncClient(
+        verify=verify,
+        timeout=timeout,
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS))
+
+
+class AsyncRest:
+    '''
+    Same as `utils.rest.Rest`, with coroutines for calls.
+
+    :param client: shared `httpx.AsyncClient`, if None one is created on first call (certificate validation set by `setVerify`),
+                   and closed by `aclose` or at end of `async with`
+    '''
+
+    def __init__(self, base_url, client=None):
+        self.base_url = base_url
+        self.authData = None
+        self.verify = True
+        self.headers = {}
+        self._client = client
+        self._own_client = client is None
+        # bearer token cache: scope -> (authorization, expiry time)
+        self._token_cache = {}
+        # scope -> lock: concurrent calls wait for the same token instead of requesting one each
+        self._token_locks = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    async def aclose(self):
+        '''Close the HTTP client, if created by this object'''
+        if self._own_client and self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def setVerify(self, verify):
+        """
+        Disable remote server certificate validation with False (not used with a shared client).
+        """
+        self.verify = verify
+
+    def addHeaders(self, headers):
+        """
+        Add provided headers for all subsequent calls.
+        """
+        self.headers.update(headers)
+
+    def setAuthBasic(self, user, password):
+        """
+        Provide Basic authentication info.
+        """
+        self.authData = None
+        self.headers['Authorization'] = 'Basic ' + base64.b64encode(f'{user}:{password}'.encode('utf-8')).decode('ascii')
+
+    def setAuthBearer(self, auth_data):
+        """
+        Provide OAuth 2 bearer parameters to generate a bearer token with JWT, see `utils.rest.Rest.setAuthBearer`.
+        """
+        missing_keys = utils.rest.JWT_AUTH_KEYS - auth_data.keys()
+        if missing_keys:
+            raise ValueError(f"Missing mandatory keys in auth_data: {', '.join(missing_keys)}")
+        self.authData = auth_data
+        self._token_cache = {}
+
+    async def setDefaultScope(self, scope=None):
+        """
+        Generate a bearer token for the scope, and use it for all subsequent calls.
+        """
+        self.headers['Authorization'] = await self.getBearerTokenAuthorization(scope)
+
+    async def getBearerTokenAuthorization(self, scope=None):
+        '''
+        Generate a bearer token, or get it from cache if still valid.
+        '''
+        lock = self._token_locks.setdefault(scope, asyncio.Lock())
+        async with lock:
+            cached = self._token_cache.get(scope)
+            if cached is not None and cached[1] > time.time():
+                utils.metrics.TOKEN_CACHE.inc(result='hit')
+                return cached[0]
+            utils.metrics.TOKEN_CACHE.inc(result='miss')
+            with utils.tracing.span('oauth.token', utils.tracing.KIND_CLIENT, **{'url.full': self.authData['token_url'], 'oauth.scope': str(scope)}):
+                response_data = await self._requestBearerToken(scope)
+            authorization = f'Bearer {response_data["access_token"]}'
+            self._token_cache[scope] = (authorization, time.time() + response_data.get('expires_in', 0) - utils.rest.TOKEN_EXPIRY_MARGIN_SEC)
+            return authorization
+
+    async def _requestBearerToken(self, scope):
+        '''
+        Call the token endpoint with a JWT assertion, and return the token response.
+        '''
+        log.info('getting API authorization')
+        token_parameters = utils.rest.jwt_token_parameters(self.authData, scope)
+        start_time = time.monotonic()
+        status = 'error'
+        try:
+            response = await self._get_client().post(
+                self.authData['token_url'],
+                auth=httpx.BasicAuth(self.authData['client_id'], self.authData['client_secret']),
+                data=token_parameters,
+                headers={
+                    'Content-Type': utils.rest.MIME_WWW,
+                    'Accept': utils.rest.MIME_JSON,
+                })
+            status = response.status_code
+        finally:
+            utils.metrics.TOKEN_LATENCY.observe(time.monotonic() - start_time, token_url=self.authData['token_url'], status=status)
+        response.raise_for_status()
+        return utils.codec.loads(response.content)
+
+    async def call(self, method, endpoint=None, body=None, query=None, headers=None):
+        """
+        Lower level HTTP request.
+        """
+        response = await self.request(method, endpoint, body, query, headers)
+        if method == 'PUT' or method == 'DELETE':
+            return None
+        return utils.codec.loads(response.content)
+
+    async def request(self, method, endpoint=None, body=None, query=None, headers=None):
+        """
+        HTTP request, return the `httpx.Response` (e.g. to read headers), raise on HTTP error.
+        """
+        url = self.base_url
+        if endpoint is not None:
+            url = f'{url}/{endpoint}'
+        req_headers = {}
+        if method != 'PUT' and method != 'DELETE':
+            req_headers['Accept'] = utils.rest.MIME_JSON
+        if method in ['POST', 'PUT'] or body is not None:
+            req_headers['Content-Type'] = utils.rest.MIME_JSON
+        req_headers.update(self.headers)
+        if headers:
+            req_headers.update(headers)
+        endpoint_label = utils.metrics.endpoint_label(endpoint)
+        with utils.tracing.span(f'{method} {endpoint_label}', utils.tracing.KIND_CLIENT, **{
+            'http.request.method': method,
+            'server.address': self.base_url,
+            'url.path': endpoint_label,
+        }) as span:
+            start_time = time.monotonic()
+            status = 'error'
+            try:
+                response = await self._get_client().request(
+                    method,
+                    url,
+                    headers=req_headers,
+                    content=None if body is None else utils.codec.dumps_bytes(body),
+                    params=query)
+                status = response.status_code
+            finally:
+                utils.metrics.REST_LATENCY.observe(
+                    time.monotonic() - start_time,
+                    base_url=self.base_url,
+                    method=method,
+                    endpoint=endpoint_label,
+                    status=status)
+            span.set_attribute('http.response.status_code', status)
+        response.raise_for_status()
+        return response
+
+    async def create(self, endpoint, data):
+        return await self.call('POST', endpoint, body=data)
+
+    async def read(self, endpoint, params=None):
+        return await self.call('GET', endpoint, query=params)
+
+    async def update(self, endpoint, data):
+        return await self.call('PUT', endpoint, body=data)
+
+    async def delete(self, endpoint):
+        return await self.call('DELETE', endpoint)
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = new_client(verify=self.verify)
+        return self._client
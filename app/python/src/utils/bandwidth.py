@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# laurent.martin.aspera@fr.ibm.com
+# Sharing of a global bandwidth budget among concurrent transfers
+# - each transfer gets a share of the budget proportional to its weight (from its priority)
+# - a transfer requesting less than its share (`target_rate_kbps` in its transfer spec, in `transport` for v2) keeps its rate,
+#   and the rest is shared by others
+# - shares are computed again when a transfer starts or ends: running transfers are updated with `ModifyTransfer`
+#   if the daemon API has it, else new shares apply to transfers submitted next
+import logging
+import threading
+import itertools
+import utils.scheduler
+import utils.transfer_client
+
+# minimum rate of a transfer, as a ratio of its share: guarantees progress of low priority transfers
+MIN_RATE_RATIO = 0.1
+# running transfers are updated only if their share changes by more than this ratio
+REBALANCE_THRESHOLD = 0.05
+
+
+def priority_weight(priority):
+    '''Weight of a transfer with this priority (see `utils.scheduler`): twice more bandwidth per priority step'''
+    step = utils.scheduler.PRIORITY_BULK - utils.scheduler.PRIORITY_NORMAL
+    return 2 ** ((utils.scheduler.PRIORITY_BULK - priority) / step)
+
+
+class _Allocation:
+    def __init__(self, weight, requested, v2=False):
+        self.weight = weight
+        # transfer spec v2: rates in `transport`
+        self.v2 = v2
+        # rate requested by transfer spec, None for no limit
+        self.requested = requested
+        # current share
+        self.rate = 0
+        # rate set on transfer: in transfer spec, or by last modification
+        self.applied = None
+        self.transfer_id = None
+
+
+class BandwidthManager:
+    '''
+    Share `total_kbps` among transfers: call `allocate` before a transfer starts, `started` with its id, and `release` when it ends.
+
+    :param transfer_client: `TransferClient` used to update rates of running transfers, None to only set rates of new transfers
+    '''
+
+    def __init__(self, total_kbps, transfer_client=None, min_rate_ratio=MIN_RATE_RATIO, threshold=REBALANCE_THRESHOLD):
+        self.total_kbps = total_kbps
+        self._transfer_client = transfer_client
+        self._min_rate_ratio = min_rate_ratio
+        self._threshold = threshold
+        self._lock = threading.Lock()
+        # key -> _Allocation
+        self._allocations = {}
+        self._keys = itertools.count()
+        self._can_modify = None
+
+    def allocate(self, t_spec, priority=utils.scheduler.PRIORITY_NORMAL, weight=None):
+        '''
+        Add a transfer and set `target_rate_kbps` and `min_rate_kbps` in its transfer spec (in `transport` for v2), return key of allocation.
+
+        :param weight: share weight, default: from priority
+        '''
+        v2 = utils.transfer_client.is_spec_v2(t_spec)
+        requested = t_spec.get('transport', {}).get('target_rate_kbps') if v2 else t_spec.get('target_rate_kbps')
+        allocation = _Allocation(priority_weight(priority) if weight is None else weight, requested, v2)
+        with self._lock:
+            key = next(self._keys)
+            self._allocations[key] = allocation
+            self._share()
+            allocation.applied = allocation.rate
+            updates = self._updates()
+        rates = self._rates(allocation)
+        if v2:
+            # copy: `transport` of the caller's transfer spec is not changed
+            t_spec['transport'] = dict(t_spec.get('transport', {}), **rates['transport'])
+        else:
+            t_spec.update(rates)
+        logging.debug('bandwidth: %d kbps for new transfer, %d transfers', allocation.rate, len(self._allocations))
+        self._apply(updates)
+        return key
+
+    def started(self, key, transfer_id):
+        '''Associate the transfer id of a started transfer, its rate can then be updated'''
+        with self._lock:
+            allocation = self._allocations.get(key)
+            if allocation is None:
+                return
+            allocation.transfer_id = transfer_id
+            updates = self._updates()
+        self._apply(updates)
+
+    def release(self, key):
+        '''Remove a transfer (ended) and share its bandwidth among others'''
+        with self._lock:
+            if self._allocations.pop(key, None) is None:
+                return
+            self._share()
+            updates = self._updates()
+        self._apply(updates)
+
+    def rates(self):
+        '''Current share of each transfer: key -> rate in kbps'''
+        with self._lock:
+            return {key: allocation.rate for key, allocation in self._allocations.items()}
+
+    def _min_rate(self, rate):
+        return int(rate * self._min_rate_ratio)
+
+    def _rates(self, allocation):
+        '''Transfer spec parameters setting current rate of allocation'''
+        rates = {'target_rate_kbps': allocation.rate, 'min_rate_kbps': self._min_rate(allocation.rate)}
+        return {'transport': rates} if allocation.v2 else rates
+
+    def _share(self):
+        '''Compute shares of the budget by weight, with rates requested below their share kept (water filling), called with lock held'''
+        remaining = self.total_kbps
+        pending = list(self._allocations.values())
+        while pending:
+            total_weight = sum(allocation.weight for allocation in pending)
+            capped = [item for item in pending if item.requested is not None and item.requested <= remaining * item.weight / total_weight]
+            if not capped:
+                for allocation in pending:
+                    allocation.rate = int(remaining * allocation.weight / total_weight)
+                return
+            for allocation in capped:
+                allocation.rate = allocation.requested
+                remaining -= allocation.requested
+                pending.remove(allocation)
+
+    def _updates(self):
+        '''Started transfers whose rate shall be updated: list of (transfer id, rate, transfer spec changes), called with lock held'''
+        if self._transfer_client is None:
+            return []
+        updates = []
+        for allocation in self._allocations.values():
+            if allocation.transfer_id is None or allocation.applied == allocation.rate:
+                continue
+            if abs(allocation.rate - allocation.applied) <= self._threshold * allocation.applied:
+                continue
+            allocation.applied = allocation.rate
+            updates.append((allocation.transfer_id, allocation.rate, self._rates(allocation)))
+        return updates
+
+    def _apply(self, updates):
+        '''Update rates of running transfers'''
+        if not updates:
+            return
+        if self._can_modify is None:
+            self._can_modify = self._transfer_client.can_modify_transfer()
+            if not self._can_modify:
+                logging.info('bandwidth: daemon cannot modify running transfers, new shares apply to next transfers only')
+        if not self._can_modify:
+            return
+        for transfer_id, rate, changes in updates:
+            logging.debug('bandwidth: transfer %s now %d kbps', transfer_id, rate)
+            try:
+                self._transfer_client.modify_transfer(transfer_id, changes)
+            except Exception as e:
+                # transfer may have ended meanwhile
+                logging.warning('bandwidth: cannot update rate of %s: %s', transfer_id, e)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# laurent.martin.aspera@fr.ibm.com
+# Pool of authenticated `utils.rest.Rest` clients, for a service acting for many tenants (orgs, users)
+# - clients are keyed by (base URL, client id or user, subject, scope, digest of credentials, verify), least recently used ones are evicted
+# - clients of the same host share one `requests.Session`: TLS connections are re-used across tenants
+# - clients with the same credentials share one bearer token cache: a token is requested once per scope until it expires
+#   (requests of tokens do not hold the pool lock: other tenants are not blocked)
+import json
+import hashlib
+import logging
+import threading
+import http.cookiejar
+import collections
+from urllib.parse import urlparse
+import requests
+import requests.adapters
+import utils.metrics
+import utils.rest
+
+# maximum number of clients kept in pool
+MAX_CLIENTS = 256
+# connections kept per host in shared sessions
+CONNECTIONS_PER_HOST = 10
+
+
+class ClientPool:
+    '''
+    Ready-to-use `Rest` clients, thread safe.
+
+    A client is authenticated when returned by `get`: its bearer token is renewed from the shared cache if expired.
+    '''
+
+    def __init__(self, max_clients=MAX_CLIENTS, connections_per_host=CONNECTIONS_PER_HOST):
+        self._max_clients = max_clients
+        self._connections_per_host = connections_per_host
+        self._lock = threading.Lock()
+        # key -> Rest, in order of use
+        self._clients = collections.OrderedDict()
+        # host -> [session, number of clients]
+        self._sessions = {}
+        # (token URL, client id, subject, digest of credentials) -> [token cache, number of clients, lock of token requests]
+        self._token_caches = {}
+
+    def get(self, base_url, auth_data=None, scope=None, user=None, password=None, verify=True):
+        '''
+        Get a client from pool, or create it.
+
+        :param auth_data: OAuth 2 parameters for JWT bearer token, see `Rest.setAuthBearer`
+        :param scope: scope of bearer token set on all calls (`setDefaultScope`)
+        :param user: user for basic authentication, if no `auth_data`
+        :param password: password for basic authentication
+        '''
+        # a client is returned only to callers with the same credentials
+        if auth_data is not None:
+            key = (base_url, auth_data['client_id'], auth_data['sub'], scope, _digest(auth_data), verify)
+        else:
+            key = (base_url, user, None, None, _digest([user, password]), verify)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                utils.metrics.CLIENT_POOL.inc(result='hit')
+            else:
+                utils.metrics.CLIENT_POOL.inc(result='miss')
+                client = self._new_client(key, base_url, auth_data, user, password)
+                client.setVerify(verify)
+            if auth_data is not None:
+                token_lock = self._token_caches[_token_cache_key(auth_data)][2]
+        if auth_data is not None:
+            # token from shared cache, or a new one if expired: only callers with the same credentials wait for the token request
+            with token_lock:
+                client.setDefaultScope(scope)
+        return client
+
+    def clear(self):
+        '''Remove all clients and close sessions'''
+        with self._lock:
+            while self._clients:
+                self._evict()
+
+    def __len__(self):
+        return len(self._clients)
+
+    def _new_client(self, key, base_url, auth_data, user, password):
+        '''Create a client and add it to pool, called with lock held'''
+        host = _host(base_url)
+        if host not in self._sessions:
+            self._sessions[host] = [self._new_session(), 0]
+        self._sessions[host][1] += 1
+        client = utils.rest.Rest(base_url, session=self._sessions[host][0])
+        if auth_data is not None:
+            credentials = _token_cache_key(auth_data)
+            if credentials not in self._token_caches:
+                self._token_caches[credentials] = [{}, 0, threading.Lock()]
+            self._token_caches[credentials][1] += 1
+            client.setAuthBearer(auth_data, token_cache=self._token_caches[credentials][0])
+        elif user is not None:
+            client.setAuthBasic(user, password)
+        self._clients[key] = client
+        while len(self._clients) > self._max_clients:
+            self._evict()
+        return client
+
+    def _new_session(self):
+        session = requests.Session()
+        # clients of different tenants share the session: never send cookies of one to another
+        session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=self._connections_per_host)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _evict(self):
+        '''Remove least recently used client, and session and token cache not used anymore, called with lock held'''
+        _, client = self._clients.popitem(last=False)
+        host = _host(client.base_url)
+        self._sessions[host][1] -= 1
+        if self._sessions[host][1] == 0:
+            logging.debug('client pool: closing session to %s', host)
+            self._sessions.pop(host)[0].close()
+        if client.authData is not None:
+            credentials = _token_cache_key(client.authData)
+            self._token_caches[credentials][1] -= 1
+            if self._token_caches[credentials][1] == 0:
+                del self._token_caches[credentials]
+
+
+def _digest(credentials):
+    '''Digest of credentials (secrets are not kept in keys)'''
+    return hashlib.sha256(json.dumps(credentials, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _token_cache_key(auth_data):
+    '''Key of shared token cache: same token URL and same credentials (including secret, private key, org...)'''
+    return (auth_data['token_url'], auth_data['client_id'], auth_data['sub'], _digest(auth_data))
+
+
+def _host(url):
+    '''Key of shared session: scheme and address'''
+    parsed = urlparse(url)
+    return f'{parsed.scheme}://{parsed.netloc}'
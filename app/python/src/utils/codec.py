@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# laurent.martin.aspera@fr.ibm.com
+# JSON codec for API responses and transfer specs
+# - `orjson` is used if installed (faster, less memory), else standard `json`
+# - `iter_items` iterates over items of a large list without loading it all: uses `ijson` if installed,
+#   else an incremental parser of a top level array with standard `json`
+import json
+import codecs
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# size of chunks read from streams
+CHUNK_SIZE = 65536
+# default path of items in `iter_items`: items of a top level array (ijson syntax)
+TOP_LEVEL_ITEMS = 'item'
+_WHITESPACE = ' \t\n\r'
+_SEPARATORS = _WHITESPACE + ',]'
+
+
+def backend():
+    '''Name of JSON library used'''
+    return 'orjson' if orjson is not None else 'json'
+
+
+def dumps(value):
+    '''Serialize to a JSON string'''
+    if orjson is not None:
+        return orjson.dumps(value).decode('utf-8')
+    return json.dumps(value)
+
+
+def dumps_bytes(value):
+    '''Serialize to JSON encoded in UTF-8, e.g. for a request body'''
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value).encode('utf-8')
+
+
+def loads(data):
+    '''Parse JSON from `str` or `bytes`'''
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def iter_items(chunks, prefix=TOP_LEVEL_ITEMS):
+    '''
+    Iterate over items of a list in a JSON document, parsed incrementally.
+
+    :param chunks: iterable of `bytes` (e.g. `response.iter_content(CHUNK_SIZE)`)
+    :param prefix: path of items, ijson syntax: `item` for a top level array, `packages.item` for key `packages` of top level object
+    '''
+    try:
+        import ijson
+    except ImportError:
+        ijson = None
+    if ijson is not None:
+        yield from ijson.items(_ChunkReader(chunks), prefix, use_float=True)
+        return
+    if prefix != TOP_LEVEL_ITEMS:
+        # no incremental parser for nested lists without ijson
+        value = loads(b''.join(chunks))
+        for key in prefix.split('.')[:-1]:
+            value = value[key]
+        yield from value
+        return
+    yield from _iter_array(chunks)
+
+
+def _iter_array(chunks):
+    '''Items of a top level array, decoded one by one with standard `json`'''
+    decoder = json.JSONDecoder()
+    # chunks may end in the middle of a UTF-8 sequence
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer = ''
+    position = 0
+    started = False
+    ended = False
+    # next token is an item (after `[` or `,`), else a separator (after an item)
+    expect_item = True
+    # an item is mandatory after a `,`
+    after_comma = False
+    while True:
+        while position < len(buffer) and buffer[position] in _WHITESPACE:
+            position += 1
+        if position < len(buffer):
+            current = buffer[position]
+            if not started:
+                if current != '[':
+                    raise ValueError('expecting a JSON array')
+                started = True
+                position += 1
+                continue
+            if not expect_item:
+                if current == ']':
+                    return
+                if current != ',':
+                    raise ValueError(f'expecting , or ] in JSON array at {current!r}')
+                expect_item = True
+                after_comma = True
+                position += 1
+                continue
+            if current == ']' and not after_comma:
+                return
+            if current in ',]':
+                raise ValueError(f'expecting an item in JSON array at {current!r}')
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+                # a number may continue in next chunk: item is complete only if followed by a separator
+                if ended or (end < len(buffer) and buffer[end] in _SEPARATORS):
+                    yield item
+                    position = end
+                    expect_item = False
+                    after_comma = False
+                    continue
+            except json.JSONDecodeError:
+                if ended:
+                    raise
+        elif ended:
+            raise ValueError('unexpected end of JSON array')
+        # need more data: keep unparsed part only
+        buffer = buffer[position:]
+        position = 0
+        chunk = next(chunks, None)
+        if chunk is None:
+            ended = True
+            buffer += utf8.decode(b'', final=True)
+        else:
+            buffer += utf8.decode(chunk)
+
+
+class _ChunkReader:
+    '''File-like object on an iterable of bytes, for ijson'''
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+
+    def read(self, size=-1):
+        # ijson reads 0 bytes to detect the type of data
+        if size == 0:
+            return b''
+        # an empty chunk would mean end of file
+        for chunk in self._chunks:
+            if chunk:
+                return chunk
+        return b''
@@ -5,26 +5,51 @@
 # Simplified function to start transfer and wait for it to finish
 import os
 import sys
-import yaml
+import stat
+import time
+import marshal
+import hashlib
 import logging
 import tempfile
 import base64
-from http.client import HTTPConnection
+import threading
 from urllib.parse import urlparse
+import utils.metrics
+import utils.tracing
 
 
 # config file with sub-paths in project's root folder
 PATHS_FILE_REL = 'config/paths.yaml'
 DIR_TOP_VAR = 'DIR_TOP'
+# optional: main configuration file, instead of `main_config` in paths file
+CONFIG_FILE_VAR = 'ASPERA_EXAMPLES_CONFIG'
 DEBUG_HTTP = False
+# block size used to read log files
+TAIL_BLOCK_SIZE = 8192
+# wait time when following a file and no new data is available
+FOLLOW_POLL_SEC = 0.2
+# prefix of parsed configuration cache files in cache folder
+CONFIG_CACHE_PREFIX = 'aspera_examples_config_'
+# per-user folder of cache files in temp folder, followed by user id
+CACHE_FOLDER_PREFIX = 'aspera_examples_cache_'
+# user id, None on systems without (Windows: the temp folder is per user)
+_UID = os.getuid() if hasattr(os, 'getuid') else None
+# checked default cache folder, False if not checked yet
+_cache_folder = False
 
 
 class Configuration:
     '''Test Environment'''
 
-    def __init__(self):
-        self._file_list = sys.argv[1:]
-        assert self._file_list, f'ERROR: Usage: {sys.argv[0]} <files to send>'
+    def __init__(self, file_list=None, files_required=True, config_file=None):
+        '''
+        :param file_list: files to transfer, default: command line arguments
+        :param files_required: if False, the file list may be empty (API only scripts)
+        :param config_file: main configuration file, default: env var ASPERA_EXAMPLES_CONFIG, or `main_config` in paths file
+        '''
+        self._file_list = sys.argv[1:] if file_list is None else list(file_list)
+        if files_required:
+            assert self._file_list, f'ERROR: Usage: {sys.argv[0]} <files to send>'
         self._top_folder = os.getenv(DIR_TOP_VAR)
         if self._top_folder is None:
             raise EnvironmentError(f"Environment variable {DIR_TOP_VAR} is not set.")
@@ -32,19 +57,28 @@ class Configuration:
         if not os.path.isdir(self._top_folder):
             raise NotADirectoryError(f"The folder specified by {DIR_TOP_VAR} does not exist or is not a directory: {self._top_folder}")
         self._log_folder = tempfile.gettempdir()
-        # read project's relative paths config file
-        self._paths = yaml.load(open(os.path.join(self._top_folder, *PATHS_FILE_REL.split('/'))), Loader=yaml.FullLoader)
-        # Read configuration from configuration file
-        self._config = yaml.load(open(self.get_path('main_config')), Loader=yaml.FullLoader)
+        # resolved and checked paths
+        self._resolved_paths = {}
+        # file list and its `utils.aggregate.AggregateResult`: packed once for all transfer specs
+        self._aggregated = None
+        with utils.tracing.span('config.load'):
+            # read project's relative paths config file
+            self._paths = load_yaml_cached(os.path.join(self._top_folder, *PATHS_FILE_REL.split('/')))
+            # Read configuration from configuration file
+            self._config = load_yaml_cached(config_file or os.getenv(CONFIG_FILE_VAR) or self.get_path('main_config'))
         log_level = getattr(logging, self.param('misc', 'level').upper(), logging.WARN)
         # set logger for debugging
         logging.basicConfig(format='%(levelname)-8s %(message)s', level=log_level)
         # debug http: see: https://stackoverflow.com/questions/10588644
         if DEBUG_HTTP:
+            from http.client import HTTPConnection
             HTTPConnection.debuglevel = 1
             requests_log = logging.getLogger('requests.packages.urllib3')
             requests_log.setLevel(log_level)
             requests_log.propagate = True
+        # optional instrumentation
+        utils.metrics.setup(self._config.get('metrics'))
+        utils.tracing.setup(self._config.get('tracing'))
 
     def param(self, section, param, default=None):
         if section not in self._config:
@@ -55,12 +89,21 @@ class Configuration:
             raise KeyError(f"Param not found: {param}")
         return self._config[section][param]
 
-    def get_path(self, name):
-        '''Get configuration sub-path in project's root folder'''
-        item_path = os.path.join(self._top_folder, *self._paths[name].split('/'))
-        assert os.path.exists(item_path), f'ERROR: {item_path} not found.'
+    def get_path(self, name, must_exist=True):
+        '''Get configuration sub-path in project's root folder (resolved and checked once)'''
+        item_path = self._resolved_paths.get(name)
+        if item_path is None:
+            item_path = os.path.join(self._top_folder, *self._paths[name].split('/'))
+            if not must_exist:
+                return item_path
+            assert os.path.exists(item_path), f'ERROR: {item_path} not found.'
+            self._resolved_paths[name] = item_path
         return item_path
 
+    def set_file_list(self, file_list):
+        '''Set list of files to transfer, instead of command line arguments'''
+        self._file_list = list(file_list)
+
     def file_list(self):
         '''
         Get list of files to transfer.
@@ -77,6 +120,11 @@ class Configuration:
 
         The `path` is usually either 'paths' for a transfer spec V1,
         or 'assets.paths' for a transfer spec V2.
+
+        With an `aggregate` section in config file, small files are packed into archives (`utils.aggregate`):
+        the destination receives `.tar` files, to be extracted there with `utils.aggregate.unpack`.
+        Sources without small files are added as without aggregation.
+        Files are packed once: other calls with the same file list add the same archives.
         """
         keys = path.split('.')
         current_node = t_spec
@@ -86,12 +134,149 @@ class Configuration:
             else:
                 raise KeyError(f"key is not a dict: {key}")
         paths = current_node[keys[-1]] = []
+        # optional: small files packed into archives, see `utils.aggregate`
+        aggregate = self._config.get('aggregate')
+        if aggregate:
+            result = self._aggregate(aggregate)
+            if result.archives:
+                sources = {os.path.normpath(f) for f in self._file_list}
+                for item in result.paths:
+                    if destination is None and item['source'] in sources:
+                        # whole source: as without aggregation
+                        item = {'source': item['source']}
+                    paths.append(dict(item))
+                return
         for f in self._file_list:
             source = {'source': f}
             if destination is not None:
                 source['destination'] = f.split('/')[-1]
             paths.append(source)
 
+    def _aggregate(self, aggregate):
+        '''Pack small files of file list, unless already done for this list'''
+        if self._aggregated is None or self._aggregated[0] != self._file_list:
+            import utils.aggregate
+            result = utils.aggregate.Aggregator(
+                spool=aggregate.get('spool'),
+                threshold=aggregate.get('threshold', utils.aggregate.SMALL_FILE_SIZE),
+                archive_size=aggregate.get('archive_size', utils.aggregate.ARCHIVE_SIZE)).pack(self._file_list)
+            if result.archives:
+                logging.warning('aggregate: %d archives sent, extract them at destination with utils.aggregate.unpack', len(result.archives))
+            self._aggregated = (list(self._file_list), result)
+        return self._aggregated[1]
+
+
+def load_yaml(path):
+    '''Parse a YAML file, using libyaml if available'''
+    import yaml
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    with open(path) as the_file:
+        return yaml.load(the_file, Loader=loader)
+
+
+def load_yaml_cached(path, cache_folder=None):
+    '''
+    Parse a YAML file, or get result from cache if file is not modified.
+
+    The parsed value is cached in `cache_folder` (see `cache_file`), keyed by path, modification time and size.
+    '''
+    file_stat = os.stat(path)
+    file_key = [file_stat.st_mtime_ns, file_stat.st_size]
+    the_cache_file = cache_file(CONFIG_CACHE_PREFIX, path, cache_folder)
+    cached = read_cache(the_cache_file)
+    if cached is not None and cached[0] == file_key:
+        return cached[1]
+    value = load_yaml(path)
+    write_cache(the_cache_file, [file_key, value])
+    return value
+
+
+def cache_folder():
+    '''
+    Per-user folder for cache files, in temp folder, readable by owner only, or None if it cannot be used safely.
+
+    The folder is created if needed, and rejected if it is a link, owned by another user, or accessible by others.
+    '''
+    global _cache_folder
+    if _cache_folder is not False:
+        return _cache_folder
+    folder = os.path.join(tempfile.gettempdir(), f'{CACHE_FOLDER_PREFIX}{"" if _UID is None else _UID}')
+    try:
+        os.mkdir(folder, 0o700)
+    except FileExistsError:
+        pass
+    except OSError as e:
+        logging.warning('cache disabled, cannot create %s: %s', folder, e)
+        folder = None
+    if folder is not None and _UID is not None:
+        folder_stat = os.lstat(folder)
+        if not stat.S_ISDIR(folder_stat.st_mode) or folder_stat.st_uid != _UID or folder_stat.st_mode & 0o077:
+            logging.warning('cache disabled, %s is not a folder owned by and accessible only by current user', folder)
+            folder = None
+    _cache_folder = folder
+    return folder
+
+
+def cache_file(prefix, key, folder=None):
+    '''
+    Path of cache file for `key` (a string, e.g. a path or JSON), or None if there is no usable cache folder.
+
+    :param folder: folder of cache file, default: `cache_folder()`
+    '''
+    if folder is None:
+        folder = cache_folder()
+        if folder is None:
+            return None
+    return os.path.join(folder, f'{prefix}{hashlib.sha1(key.encode()).hexdigest()}')
+
+
+def read_cache(path):
+    '''Value stored by `write_cache`, or None if absent, invalid, or not a file written by the current user only'''
+    if path is None:
+        return None
+    try:
+        with open(os.open(path, os.O_RDONLY | getattr(os, 'O_NOFOLLOW', 0)), 'rb') as the_file:
+            if _UID is not None:
+                file_stat = os.fstat(the_file.fileno())
+                if file_stat.st_uid != _UID or file_stat.st_mode & 0o022:
+                    logging.warning('ignoring cache file not owned by current user or writable by others: %s', path)
+                    return None
+            return marshal.load(the_file)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+
+
+def write_cache(path, value):
+    '''
+    Store a value (built-in types only) in a cache file, readable by owner only.
+
+    The file is written to a temporary file and renamed: a concurrent execution reads either the old or the new file.
+    '''
+    if path is None:
+        return
+    temp_file = f'{path}.{os.getpid()}.{threading.get_ident()}'
+    try:
+        data = marshal.dumps(value)
+        with open(os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_NOFOLLOW', 0), 0o600), 'wb') as the_file:
+            the_file.write(data)
+        os.replace(temp_file, path)
+    except (OSError, ValueError) as e:
+        logging.debug('cannot write cache %s: %s', path, e)
+        try:
+            os.remove(temp_file)
+        except OSError:
+            pass
+
+
+def remove_cache(path):
+    '''Remove a cache file, if present'''
+    if path is None:
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
 
 def basic_authorization(username, password):
     '''Create basic auth header'''
@@ -106,21 +291,73 @@ def basic_auth_header_key_value(username, password):
     }
 
 
-def last_file_line(filename):
-    with open(filename, 'rb') as file:
-        # Seek to the end of the file
-        file.seek(0, 2)
-        position = file.tell() - 1
-        last_line = b''
+def last_file_lines(filename, count=1, block_size=TAIL_BLOCK_SIZE):
+    '''
+    Get the last `count` non-empty lines of a file.
 
-        # Read backwards until a newline or beginning of the file
-        while position >= 0:
+    The file is read backwards by blocks, so only the end of the file is read, whatever its size.
+    '''
+    with open(filename, 'rb') as file:
+        position = file.seek(0, os.SEEK_END)
+        blocks = []
+        separators = 0
+        lines = []
+        while position > 0:
+            size = min(block_size, position)
+            position -= size
             file.seek(position)
-            char = file.read(1)
-            if char == b'\n' and last_line:
-                break
-            last_line = char + last_line
-            position -= 1
-
-        # Decode the binary string to a regular string
-        return last_line.decode('utf-8')
+            block = file.read(size)
+            blocks.append(block)
+            separators += block.count(b'\n')
+            # first line of the data read so far is possibly incomplete: skip it
+            if separators > count:
+                lines = [line for line in b''.join(reversed(blocks)).split(b'\n')[1:] if line.strip()]
+                if len(lines) >= count:
+                    break
+        else:
+            # beginning of file reached: all lines are complete
+            lines = [line for line in b''.join(reversed(blocks)).split(b'\n') if line.strip()]
+    return [line.decode('utf-8') for line in lines[-count:]]
+
+
+def last_file_line(filename):
+    '''Get the last non-empty line of a file, or empty string'''
+    lines = last_file_lines(filename, 1)
+    return lines[0] if lines else ''
+
+
+def follow_file(filename, from_end=True, poll_interval=FOLLOW_POLL_SEC, stop=None):
+    '''
+    Iterate over lines appended to a file, like `tail -f`.
+
+    The file is kept open and only new data is read.
+    Waits for the file to be created, and restarts from the beginning if the file is truncated.
+
+    :param from_end: skip lines already present in the file
+    :param poll_interval: seconds to wait when no new data is available
+    :param stop: optional `threading.Event`, iteration ends when it is set
+    '''
+    while not os.path.exists(filename):
+        if stop is not None and stop.is_set():
+            return
+        time.sleep(poll_interval)
+    with open(filename, 'rb') as file:
+        if from_end:
+            file.seek(0, os.SEEK_END)
+        pending = b''
+        while stop is None or not stop.is_set():
+            data = file.read(TAIL_BLOCK_SIZE)
+            if not data:
+                if os.path.getsize(filename) < file.tell():
+                    logging.debug('file truncated: %s', filename)
+                    file.seek(0)
+                    pending = b''
+                    continue
+                time.sleep(poll_interval)
+                continue
+            lines = (pending + data).split(b'\n')
+            # last element is an incomplete line (or empty)
+            pending = lines.pop()
+            for line in lines:
+                if line.strip():
+                    yield line.decode('utf-8')
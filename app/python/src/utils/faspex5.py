@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# laurent.martin.aspera@fr.ibm.com
+# Bulk download of packages received in Faspex 5
+# - the mailbox is listed page by page, packages already downloaded (in the journal) are skipped
+# - download transfer specs are requested concurrently, a few packages ahead of running downloads (tokens stay fresh)
+# - downloads run with bounded concurrency, each package in its own folder, with resume of files partially received
+# - the journal (one JSON line per event, in the download folder) is the index of downloaded packages for next runs
+import os
+import json
+import time
+import logging
+import threading
+from concurrent import futures
+import utils.transfer_client
+
+# packages requested per page of mailbox listing
+LIST_PAGE_SIZE = 100
+# number of concurrent transfer spec requests
+SETUP_WORKERS = 4
+# number of concurrent downloads
+MAX_DOWNLOADS = 4
+# journal file in download folder
+JOURNAL_NAME = '.faspex5_received.jsonl'
+# journal events
+EVENT_STARTED = 'started'
+EVENT_COMPLETED = 'completed'
+EVENT_FAILED = 'failed'
+# mailboxes of sent packages: their transfer specs are requested with `type=sent`, others with `type=received`
+MAILBOX_SENT = ['outbox', 'outbox_history']
+
+
+def list_packages(f5_api, mailbox='inbox', page_size=LIST_PAGE_SIZE):
+    '''
+    Iterate over packages of a mailbox, all pages.
+
+    Packages received while listing may shift pages: some may be listed twice, or only by the next run.
+    '''
+    offset = 0
+    while True:
+        result = f5_api.read(f'{mailbox}/packages', {'offset': offset, 'limit': page_size})
+        packages = result.get('packages', [])
+        yield from packages
+        offset += len(packages)
+        if len(packages) < page_size or offset >= result.get('total_count', offset):
+            return
+
+
+def safe_package_id(package_id):
+    '''True if package id (from server) can be used as folder name: not empty, no path separator or `..`'''
+    return isinstance(package_id, str) and package_id not in ('', '.') and '/' not in package_id and '\\' not in package_id \
+        and '..' not in package_id
+
+
+class ReceiveJournal:
+    '''
+    Journal of package downloads, appended as events occur: survives interruption of a run.
+
+    Packages with a `completed` event are not downloaded again.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.completed = set()
+        try:
+            with open(path) as the_file:
+                for line in the_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # last line of an interrupted write
+                        continue
+                    if entry.get('event') == EVENT_COMPLETED:
+                        self.completed.add(entry['package_id'])
+        except FileNotFoundError:
+            pass
+
+    def record(self, package_id, event, **fields):
+        entry = {'time': time.time(), 'package_id': package_id, 'event': event}
+        entry.update(fields)
+        line = json.dumps(entry) + '\n'
+        with self._lock:
+            with open(self.path, 'a') as the_file:
+                the_file.write(line)
+                the_file.flush()
+                os.fsync(the_file.fileno())
+            if event == EVENT_COMPLETED:
+                self.completed.add(package_id)
+
+
+class ReceiveResult:
+    '''Result of `BulkReceiver.receive`'''
+
+    def __init__(self):
+        self.listed = 0
+        self.skipped = 0
+        self.completed = []
+        # package id -> error message
+        self.failed = {}
+
+    def __str__(self):
+        return f'{self.listed} packages listed, {self.skipped} already downloaded, {len(self.completed)} downloaded, {len(self.failed)} failed'
+
+
+class BulkReceiver:
+    '''
+    Download received packages into `folder`, one sub folder per package id.
+
+    :param f5_api: `Rest` on Faspex 5 API v5, with bearer authorization
+    :param transfer_client: started `TransferClient`
+    '''
+
+    def __init__(self, f5_api, transfer_client, folder, setup_workers=SETUP_WORKERS, max_downloads=MAX_DOWNLOADS, page_size=LIST_PAGE_SIZE):
+        self._f5_api = f5_api
+        self._transfer_client = transfer_client
+        self.folder = folder
+        self._setup_workers = setup_workers
+        self._max_downloads = max_downloads
+        self._page_size = page_size
+        os.makedirs(folder, exist_ok=True)
+        self.journal = ReceiveJournal(os.path.join(folder, JOURNAL_NAME))
+
+    def receive(self, mailbox='inbox'):
+        '''Download packages of mailbox not yet downloaded, return a `ReceiveResult` (failed packages do not stop others)'''
+        result = ReceiveResult()
+        # packages listed but not finished: bounded, so that transfer specs are requested shortly before use
+        window = self._max_downloads + self._setup_workers
+        seen = set()
+        package_type = 'sent' if mailbox in MAILBOX_SENT else 'received'
+        with futures.ThreadPoolExecutor(max_workers=self._setup_workers, thread_name_prefix='f5setup') as setups, \
+                futures.ThreadPoolExecutor(max_workers=self._max_downloads, thread_name_prefix='f5download') as downloads:
+            # future -> (package id, True for download, False for transfer spec request)
+            pending = {}
+            for package in list_packages(self._f5_api, mailbox, self._page_size):
+                result.listed += 1
+                package_id = package['id']
+                if package_id in self.journal.completed or package_id in seen:
+                    result.skipped += 1
+                    continue
+                seen.add(package_id)
+                if not safe_package_id(package_id):
+                    # used as folder name: must stay in download folder
+                    logging.error('faspex5: invalid package id: %r', package_id)
+                    result.failed[package_id] = 'invalid package id'
+                    continue
+                while len(pending) >= window:
+                    self._wait(pending, downloads, result)
+                pending[setups.submit(self._transfer_spec, package_id, package_type)] = (package_id, False)
+            while pending:
+                self._wait(pending, downloads, result)
+        logging.info('faspex5: %s', result)
+        return result
+
+    def package_folder(self, package_id):
+        if not safe_package_id(package_id):
+            raise ValueError(f'invalid package id: {package_id!r}')
+        return os.path.join(self.folder, package_id)
+
+    def _wait(self, pending, downloads, result):
+        '''Wait for next finished transfer spec request (then start its download) or download'''
+        done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+        for future in done:
+            package_id, download = pending.pop(future)
+            try:
+                value = future.result()
+            except Exception as e:
+                logging.error('faspex5: package %s: %s', package_id, e)
+                self.journal.record(package_id, EVENT_FAILED, error=str(e))
+                result.failed[package_id] = str(e)
+                continue
+            if download:
+                self.journal.record(package_id, EVENT_COMPLETED, folder=self.package_folder(package_id))
+                result.completed.append(package_id)
+                continue
+            pending[downloads.submit(self._download, package_id, value)] = (package_id, True)
+
+    def _transfer_spec(self, package_id, package_type):
+        # long runs: bearer token refreshed when expired (cached until then)
+        t_spec = self._f5_api.call(
+            'POST', f'packages/{package_id}/transfer_spec/download?transfer_type=connect&type={package_type}', {'paths': [{'path': '/'}]},
+            headers={'Authorization': self._f5_api.getBearerTokenAuthorization()})
+        # not used in transfer sdk
+        t_spec.pop('authentication', None)
+        return t_spec
+
+    def _download(self, package_id, t_spec):
+        '''Download package in its folder'''
+        folder = self.package_folder(package_id)
+        os.makedirs(folder, exist_ok=True)
+        t_spec['destination_root'] = folder
+        # files partially received by an interrupted run are completed, not sent again
+        t_spec['resume_policy'] = utils.transfer_client.RETRY_RESUME_POLICY
+        self.journal.record(package_id, EVENT_STARTED, folder=folder)
+        self._transfer_client.start_transfer_and_wait(t_spec)
@@ -6,6 +6,7 @@ import xml.dom.minidom
 import requests
 import json
 import logging
+import utils.tracing
 
 IBM_CLOUD_OAUTH_URL = 'https://iam.cloud.ibm.com/identity/token'
 
@@ -27,6 +28,11 @@ def node(*, bucket, endpoint, key, crn, auth=IBM_CLOUD_OAUTH_URL):
     Raises:
     Exception: in case of problem
     '''
+    with utils.tracing.span('cos.node_info', bucket=bucket, endpoint=endpoint):
+        return _node(bucket=bucket, endpoint=endpoint, key=key, crn=crn, auth=auth)
+
+
+def _node(*, bucket, endpoint, key, crn, auth):
     # Get bearer token to access COS S3 API
     # payload to generate auth token
     token_req_data = {
@@ -34,11 +40,12 @@ def node(*, bucket, endpoint, key, crn, auth=IBM_CLOUD_OAUTH_URL):
         'response_type': 'cloud_iam',
         'apikey': key,
     }
-    response = requests.post(
-        auth,
-        data=token_req_data,
-        headers={'Content-type': 'application/x-www-form-urlencoded'},
-    )
+    with utils.tracing.span('cos.iam_token', utils.tracing.KIND_CLIENT, **{'url.full': auth}):
+        response = requests.post(
+            auth,
+            data=token_req_data,
+            headers={'Content-type': 'application/x-www-form-urlencoded'},
+        )
     if response.status_code != 200:
         raise Exception('error')
     bearer_token_info = response.json()
@@ -50,11 +57,12 @@ def node(*, bucket, endpoint, key, crn, auth=IBM_CLOUD_OAUTH_URL):
         'Authorization': f'{bearer_token_info["token_type"]} {bearer_token_info["access_token"]}',
         'Accept': 'application/xml',
     }
-    response = requests.get(
-        url=f'{endpoint}/{bucket}',
-        headers=header_auth,
-        params={'faspConnectionInfo': True},
-    )
+    with utils.tracing.span('cos.fasp_connection_info', utils.tracing.KIND_CLIENT, **{'url.full': f'{endpoint}/{bucket}'}):
+        response = requests.get(
+            url=f'{endpoint}/{bucket}',
+            headers=header_auth,
+            params={'faspConnectionInfo': True},
+        )
     if response.status_code != 200:
         raise Exception('error accessing endpoint')
     logging.debug(response.content)
@@ -67,11 +75,12 @@ def node(*, bucket, endpoint, key, crn, auth=IBM_CLOUD_OAUTH_URL):
     # Get delegated token to access the node api
     token_req_data['response_type'] = 'delegated_refresh_token'
     token_req_data['receiver_client_ids'] = 'aspera_ats'
-    response = requests.post(
-        auth,
-        data=token_req_data,
-        headers={'Content-type': 'application/x-www-form-urlencoded'},
-    )
+    with utils.tracing.span('cos.delegated_token', utils.tracing.KIND_CLIENT, **{'url.full': auth}):
+        response = requests.post(
+            auth,
+            data=token_req_data,
+            headers={'Content-type': 'application/x-www-form-urlencoded'},
+        )
     if response.status_code != 200:
         raise Exception('error when generating token')
     delegated_token_info = response.json()
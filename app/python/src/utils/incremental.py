@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# laurent.martin.aspera@fr.ibm.com
+# Incremental upload: select local files that are new or changed compared to the destination on a node
+# - local sources are scanned in parallel, one `os.scandir` per folder (`walk_folders` is also used by other modules)
+# - destination folders are listed concurrently with `files/browse`, only where local folders exist
+# - listings are kept in a manifest file: a folder is not listed again while its cached listing is recent
+#   and its modification time reported by the parent folder is unchanged
+import os
+import json
+import time
+import logging
+import posixpath
+import threading
+from concurrent import futures
+import requests
+import utils.node
+import utils.configuration
+
+# number of concurrent local folder scans
+SCAN_WORKERS = 8
+# number of concurrent remote folder listings
+LIST_WORKERS = 8
+# a file is changed if local modification time is after remote one, with this tolerance
+MTIME_TOLERANCE_SEC = 2
+# a cached folder listing is re-used during this time (changes by others are seen after this time)
+MANIFEST_TTL_SEC = 3600
+# prefix of manifest files in cache folder
+MANIFEST_PREFIX = 'aspera_examples_manifest_'
+
+
+class LocalFile:
+    '''File found in local sources'''
+
+    def __init__(self, path, relative, size, mtime, mode=None, source=None):
+        # local path
+        self.path = path
+        # path relative to destination folder, with `/` separator
+        self.relative = relative
+        self.size = size
+        self.mtime = mtime
+        self.mode = mode
+        # source (file or folder) where the file was found
+        self.source = source
+
+
+def scan_local(sources, workers=SCAN_WORKERS):
+    '''
+    List files in local sources (files or folders), scanning folders in parallel.
+
+    A source folder is sent by Aspera as a sub folder of destination: relative paths start with its name.
+    :return: list of `LocalFile`
+    '''
+    return list(iter_local(sources, workers))
+
+
+def iter_local(sources, workers=SCAN_WORKERS, on_error=None):
+    '''
+    Iterate over files in local sources (see `scan_local`) while folders are scanned: `LocalFile`, in no particular order
+
+    :param on_error: optional function (path, `OSError`) called for a folder that cannot be read, which is then skipped (default: raise)
+    '''
+    def read_folder(path, relative):
+        try:
+            return _scan_folder(path, relative)
+        except OSError as e:
+            if on_error is None:
+                raise
+            on_error(path, e)
+            return [], []
+
+    roots = []
+    for source in sources:
+        source = os.path.normpath(source)
+        name = os.path.basename(source)
+        if os.path.isdir(source):
+            roots.append((source, name))
+            continue
+        source_stat = os.stat(source)
+        yield LocalFile(source, name, source_stat.st_size, source_stat.st_mtime, source_stat.st_mode, source)
+    for index, _, files in walk_folders(roots, read_folder, workers):
+        for item in files:
+            item.source = roots[index][0]
+            yield item
+
+
+def walk_folders(roots, read_folder, workers=SCAN_WORKERS):
+    '''
+    Read folder trees in parallel, one `read_folder` call per folder, and iterate over results as folders are read.
+
+    Links to folders are followed, except to a folder that is already a parent in the walked path (loop).
+    :param roots: list of (folder path, relative path)
+    :param read_folder: function (path, relative) -> (result, list of sub folders: (path, relative, `folder_identity`))
+    :return: iterator of (index of root, folder path, result)
+    '''
+    with futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scan') as executor:
+        # job -> (index of root, path, identities of folder and its parents)
+        pending = {}
+
+        def submit(index, path, relative, identity, parents):
+            if identity is not None:
+                if identity in parents:
+                    logging.warning('scan: %s is a link to one of its parents, skipped', path)
+                    return
+                parents = parents + (identity,)
+            pending[executor.submit(read_folder, path, relative)] = (index, path, parents)
+
+        for index, (path, relative) in enumerate(roots):
+            try:
+                identity = folder_identity(os.stat(path))
+            except OSError:
+                # reported by read_folder
+                identity = None
+            submit(index, path, relative, identity, ())
+        while pending:
+            done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for job in done:
+                index, path, parents = pending.pop(job)
+                result, folders = job.result()
+                for folder, relative, identity in folders:
+                    submit(index, folder, relative, identity, parents)
+                yield index, path, result
+
+
+def folder_identity(folder_stat):
+    '''Device and inode of a folder, None if not known (e.g. `os.scandir` on Windows)'''
+    if not folder_stat.st_ino:
+        return None
+    return (folder_stat.st_dev, folder_stat.st_ino)
+
+
+def _scan_folder(path, relative):
+    '''Files and sub folders of one folder'''
+    files = []
+    folders = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            entry_relative = f'{relative}/{entry.name}'
+            try:
+                if entry.is_dir(follow_symlinks=True):
+                    folders.append((entry.path, entry_relative, folder_identity(entry.stat())))
+                    continue
+                if not entry.is_file(follow_symlinks=True):
+                    continue
+                entry_stat = entry.stat()
+            except FileNotFoundError:
+                # removed while scanned
+                continue
+            files.append(LocalFile(entry.path, entry_relative, entry_stat.st_size, entry_stat.st_mtime, entry_stat.st_mode))
+    return files, folders
+
+
+class RemoteManifest:
+    '''
+    Cache of folder listings under a destination, persisted in a file in `folder` (see `utils.configuration.cache_file`).
+
+    Entries: folder path relative to destination -> {'mtime', 'listed', 'items': {name: [type, size, mtime]}}
+    '''
+
+    def __init__(self, node_api, user, destination, folder=None, ttl=MANIFEST_TTL_SEC):
+        self._file = utils.configuration.cache_file(MANIFEST_PREFIX, json.dumps([node_api.base_url, user, destination]), folder)
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._folders = utils.configuration.read_cache(self._file)
+        if not isinstance(self._folders, dict):
+            self._folders = {}
+
+    def get(self, relative, mtime):
+        '''Cached items of a folder, or None if not cached, too old, or folder modified since listed'''
+        with self._lock:
+            entry = self._folders.get(relative)
+        if entry is None or entry['listed'] + self._ttl < time.time():
+            return None
+        if mtime is not None and entry['mtime'] != mtime:
+            return None
+        return entry['items']
+
+    def put(self, relative, mtime, items):
+        with self._lock:
+            self._folders[relative] = {'mtime': mtime, 'listed': time.time(), 'items': items}
+
+    def invalidate(self, relatives):
+        '''Forget folders, e.g. where files were uploaded'''
+        with self._lock:
+            for relative in relatives:
+                self._folders.pop(relative, None)
+
+    def save(self):
+        with self._lock:
+            folders = dict(self._folders)
+        utils.configuration.write_cache(self._file, folders)
+
+
+def list_remote(node_api, destination, folders, manifest=None, workers=LIST_WORKERS):
+    '''
+    List remote folders concurrently, from the destination down to the given folders.
+
+    :param folders: set of folder paths relative to destination to list (the destination itself is '')
+    :return: relative folder path -> {name: [type, size, mtime]} (empty if the folder does not exist)
+    '''
+    # only folders leading to requested ones are explored
+    wanted = set(folders)
+    for relative in folders:
+        while relative:
+            relative = posixpath.dirname(relative)
+            wanted.add(relative)
+    result = {}
+    with futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='browse') as executor:
+        # the modification time of the destination itself is not known: use cache only based on its age
+        pending = {executor.submit(_list_folder, node_api, destination, '', None, manifest)}
+        while pending:
+            done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for job in done:
+                relative, items = job.result()
+                result[relative] = items
+                for name, (item_type, _, mtime) in items.items():
+                    child = f'{relative}/{name}' if relative else name
+                    if item_type == 'directory' and child in wanted:
+                        pending.add(executor.submit(_list_folder, node_api, destination, child, mtime, manifest))
+    # requested folders not found on remote are empty
+    for relative in wanted:
+        result.setdefault(relative, {})
+    return result
+
+
+def _list_folder(node_api, destination, relative, mtime, manifest):
+    if manifest is not None:
+        items = manifest.get(relative, mtime)
+        if items is not None:
+            return relative, items
+    path = posixpath.join(destination, relative) if relative else destination
+    try:
+        _, entries = utils.node.browse(node_api, path)
+    except requests.exceptions.HTTPError as e:
+        if e.response is None or e.response.status_code != 404:
+            raise
+        entries = []
+    items = {entry['basename']: [entry.get('type'), entry.get('size', 0), entry.get('mtime')] for entry in entries}
+    if manifest is not None:
+        manifest.put(relative, mtime, items)
+    return relative, items
+
+
+def changed_files(node_api, destination, sources, manifest=None):
+    '''
+    Local files that are not on the destination, or with a different size, or modified after the remote file.
+
+    :return: list of `LocalFile`
+    '''
+    local_files = scan_local(sources)
+    remote = list_remote(node_api, destination, {posixpath.dirname(item.relative) for item in local_files}, manifest)
+    result = []
+    for item in local_files:
+        folder, name = posixpath.split(item.relative)
+        remote_item = remote[folder].get(name)
+        if remote_item is None or remote_item[0] != 'file' or remote_item[1] != item.size \
+                or item.mtime > utils.node.parse_time(remote_item[2]) + MTIME_TOLERANCE_SEC:
+            result.append(item)
+    if manifest is not None:
+        manifest.save()
+    logging.info('incremental: %d files changed out of %d', len(result), len(local_files))
+    return result
+
+
+def upload_paths(files):
+    '''Transfer spec `paths` for files returned by `changed_files`, relative to destination'''
+    return [{'source': item.path, 'destination': item.relative} for item in files]
+
+
+def uploaded(manifest, files):
+    '''Update manifest after upload: folders where files were uploaded, and their parents (new folders), must be listed again'''
+    folders = set()
+    for item in files:
+        relative = item.relative
+        while relative:
+            relative = posixpath.dirname(relative)
+            folders.add(relative)
+    manifest.invalidate(folders)
+    manifest.save()
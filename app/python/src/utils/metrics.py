@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# laurent.martin.aspera@fr.ibm.com
+# Optional instrumentation of REST and transfer clients: counters, gauges and histograms in Prometheus text format
+# Nothing is recorded until enabled, either with `enable()` or with a `metrics` section in config file:
+#   metrics:
+#     port: 9464                     # serve http://127.0.0.1:9464/metrics
+#     textfile: /path/to/aspera.prom # written at exit, for the node_exporter textfile collector
+import os
+import re
+import atexit
+import logging
+import threading
+
+MIME_PROMETHEUS = 'text/plain; version=0.0.4; charset=utf-8'
+# buckets for API calls, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# buckets for transfers and daemon startup, in seconds
+DURATION_BUCKETS = (0.5, 1, 2, 5, 10, 30, 60, 300, 900, 3600, 14400)
+# buckets for throughput, in bits per second
+THROUGHPUT_BUCKETS = (1e6, 1e7, 5e7, 1e8, 2.5e8, 5e8, 1e9, 2.5e9, 5e9, 1e10)
+# path segments replaced by a placeholder, so that the endpoint label has a bounded set of values
+ID_SEGMENT_REGEX = re.compile(r'^([0-9]+|[0-9a-fA-F-]{32,36}|(?=.*[0-9])[A-Za-z0-9_-]{8,})$')
+
+_enabled = False
+# `setup` done: exporters are started once per process, whatever the number of `Configuration` objects
+_setup_done = False
+_lock = threading.Lock()
+_registry = []
+
+
+class _Metric:
+    '''Base class for a metric with labels'''
+
+    def __init__(self, name, documentation, kind, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labels = tuple(labels)
+        self._values = {}
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+    def _format_labels(self, key, extra=None):
+        pairs = list(zip(self.labels, key))
+        if extra is not None:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        values = ','.join(f'{name}="{_escape(value)}"' for name, value in pairs)
+        return f'{{{values}}}'
+
+    def expose(self):
+        '''Lines in Prometheus text format'''
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with _lock:
+            for key, value in sorted(self._values.items()):
+                lines.extend(self._expose_value(key, value))
+        return lines
+
+
+class Counter(_Metric):
+    '''Monotonic counter'''
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, 'counter', labels)
+
+    def inc(self, amount=1, **labels):
+        if not _enabled:
+            return
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _expose_value(self, key, value):
+        return [f'{self.name}{self._format_labels(key)} {value}']
+
+
+class Gauge(_Metric):
+    '''Value that goes up and down'''
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, 'gauge', labels)
+
+    def set(self, value, **labels):
+        if not _enabled:
+            return
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        if not _enabled:
+            return
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def _expose_value(self, key, value):
+        return [f'{self.name}{self._format_labels(key)} {_format_number(value)}']
+
+
+class Histogram(_Metric):
+    '''Distribution of observed values in cumulative buckets'''
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, 'histogram', labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        if not _enabled:
+            return
+        key = self._key(labels)
+        with _lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # one count per bucket, then +Inf, sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def _expose_value(self, key, counts):
+        lines = []
+        for index, bound in enumerate(self.buckets):
+            lines.append(f'{self.name}_bucket{self._format_labels(key, ("le", _format_number(bound)))} {counts[index]}')
+        lines.append(f'{self.name}_bucket{self._format_labels(key, ("le", "+Inf"))} {counts[-2]}')
+        lines.append(f'{self.name}_sum{self._format_labels(key)} {counts[-1]}')
+        lines.append(f'{self.name}_count{self._format_labels(key)} {counts[-2]}')
+        return lines
+
+
+REST_LATENCY = Histogram('aspera_rest_request_seconds', 'REST API call latency', ['base_url', 'method', 'endpoint', 'status'])
+TOKEN_LATENCY = Histogram('aspera_token_request_seconds', 'OAuth token request latency', ['token_url', 'status'])
+TOKEN_CACHE = Counter('aspera_token_cache_total', 'Bearer token cache lookups', ['result'])
+CLIENT_POOL = Counter('aspera_client_pool_total', 'REST client pool lookups', ['result'])
+DAEMON_STARTUP = Histogram('aspera_daemon_startup_seconds', 'Transfer daemon startup and connection time', buckets=DURATION_BUCKETS)
+TRANSFER_DURATION = Histogram('aspera_transfer_seconds', 'Transfer duration', ['status'], buckets=DURATION_BUCKETS)
+TRANSFER_RETRIES = Counter('aspera_transfer_retries_total', 'Failed transfers started again')
+TRANSFER_BYTES = Counter('aspera_transfer_bytes_total', 'Bytes transferred', ['status'])
+TRANSFER_THROUGHPUT = Histogram('aspera_transfer_throughput_bps', 'Achieved transfer throughput', ['status'], buckets=THROUGHPUT_BUCKETS)
+SCHEDULER_QUEUED = Gauge('aspera_scheduler_queued_jobs', 'Transfer jobs waiting in scheduler', ['destination'])
+SCHEDULER_RUNNING = Gauge('aspera_scheduler_running_jobs', 'Transfer jobs running', ['destination'])
+SCHEDULER_WAIT = Histogram('aspera_scheduler_wait_seconds', 'Time transfer jobs waited in scheduler queue', ['priority'], buckets=DURATION_BUCKETS)
+
+
+def enable():
+    '''Start recording metrics'''
+    global _enabled
+    _enabled = True
+
+
+def is_enabled():
+    return _enabled
+
+
+def setup(config):
+    '''
+    Enable metrics according to the `metrics` section of configuration, if present (only the first call has effect).
+
+    :param config: `dict` with optional keys `port`, `address` and `textfile`
+    '''
+    global _setup_done
+    if not config:
+        return
+    with _lock:
+        if _setup_done:
+            return
+        _setup_done = True
+    enable()
+    if 'port' in config:
+        start_http_server(config['port'], config.get('address', '127.0.0.1'))
+    if 'textfile' in config:
+        atexit.register(write_textfile, config['textfile'])
+
+
+def endpoint_label(endpoint):
+    '''Normalize a REST endpoint: remove query and replace identifiers with a placeholder'''
+    if endpoint is None:
+        return ''
+    path = endpoint.split('?', 1)[0]
+    return '/'.join('{id}' if ID_SEGMENT_REGEX.match(segment) else segment for segment in path.split('/'))
+
+
+def record_transfer(status, duration, bytes_transferred):
+    '''Record metrics for one finished transfer'''
+    if not _enabled:
+        return
+    TRANSFER_DURATION.observe(duration, status=status)
+    TRANSFER_BYTES.inc(bytes_transferred, status=status)
+    if duration > 0:
+        TRANSFER_THROUGHPUT.observe(8 * bytes_transferred / duration, status=status)
+
+
+def generate_latest():
+    '''All metrics in Prometheus text format'''
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.expose())
+    return '\n'.join(lines) + '\n'
+
+
+def write_textfile(path):
+    '''Write metrics to a file, atomically, as expected by the textfile collector'''
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as the_file:
+        the_file.write(generate_latest())
+    os.replace(temp_path, path)
+    logging.debug('metrics written to %s', path)
+
+
+def start_http_server(port, address='127.0.0.1'):
+    '''Serve metrics on http://<address>:<port>/metrics in a background thread'''
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = generate_latest().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', MIME_PROMETHEUS)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.debug('metrics: ' + format, *args)
+
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics', daemon=True)
+    thread.start()
+    logging.info('metrics available on http://%s:%s/metrics', address, server.server_port)
+    return server
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_number(value):
+    return repr(float(value))
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+# laurent.martin.aspera@fr.ibm.com
+# Helpers for the Aspera Node API (also used behind Shares)
+# Batched transfer setup: many transfer requests in one `files/upload_setup` or `files/download_setup` call
+# Transfer spec cache: transfer specs (with their Aspera token) are re-used for the same destination while valid
+# Folder listing with `files/browse`, all pages, and concurrent listing of a folder tree
+# Incremental polling of `ops/transfers` with a persisted iteration token
+import json
+import copy
+import time
+import logging
+import calendar
+import datetime
+import threading
+import collections
+from concurrent import futures
+from urllib.parse import urlparse, parse_qs
+import requests
+import utils.codec
+import utils.configuration
+import utils.transfer_client
+
+# maximum number of transfer requests sent in one setup call
+SETUP_CHUNK_SIZE = 100
+# time a generated transfer spec is re-used, must be less than the validity of Aspera tokens generated by the node
+SPEC_CACHE_TTL_SEC = 600
+# prefix of transfer spec cache files in cache folder
+SPEC_CACHE_PREFIX = 'aspera_examples_spec_'
+# number of items requested per `files/browse` call
+BROWSE_PAGE_SIZE = 1000
+# number of concurrent `files/browse` calls when listing a tree
+BROWSE_WORKERS = 8
+# number of transfers requested per `ops/transfers` call
+TRANSFERS_PAGE_SIZE = 100
+# prefix of `ops/transfers` cursor files in cache folder
+TRANSFERS_CURSOR_PREFIX = 'aspera_examples_transfers_cursor_'
+
+
+class SetupResult:
+    '''Result of one transfer request of a batched setup: a transfer spec, or an error message'''
+
+    def __init__(self, remote, local, transfer_spec=None, error=None, cached=False):
+        # remote path: destination folder of upload, or source of download
+        self.remote = remote
+        # local path(s): sources of upload, or destination folder of download
+        self.local = local
+        self.transfer_spec = transfer_spec
+        self.error = error
+        # transfer spec comes from `TransferSpecCache`
+        self.cached = cached
+
+    def check(self):
+        '''Return the transfer spec, or raise an exception if this request failed'''
+        if self.error is not None:
+            raise Exception(f'{self.remote}: {self.error}')
+        return self.transfer_spec
+
+
+class TransferSpecCache:
+    '''
+    Cache of transfer specs generated by the Node API, keyed by (node URL, user, direction, remote path).
+
+    Entries are kept in memory and in one file per key in `folder` (see `utils.configuration.cache_file`), so that they are re-used by later runs.
+    An entry expires `ttl` seconds after the transfer spec was generated: keep it below the validity of the Aspera token.
+    '''
+
+    def __init__(self, folder=None, ttl=SPEC_CACHE_TTL_SEC):
+        self._folder = folder
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (expiry, transfer spec)
+        self._entries = {}
+
+    def get(self, key):
+        '''Copy of cached transfer spec, or None if absent or expired'''
+        if self._ttl <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            entry = utils.configuration.read_cache(self._file(key))
+            if not isinstance(entry, tuple) or len(entry) != 2 or not isinstance(entry[1], dict):
+                return None
+            with self._lock:
+                self._entries[key] = entry
+        if entry[0] <= time.time():
+            self.discard(key)
+            return None
+        return copy.deepcopy(entry[1])
+
+    def put(self, key, transfer_spec):
+        if self._ttl <= 0:
+            return
+        entry = (time.time() + self._ttl, copy.deepcopy(transfer_spec))
+        with self._lock:
+            self._entries[key] = entry
+        utils.configuration.write_cache(self._file(key), entry)
+
+    def discard(self, key):
+        '''Remove an entry, e.g. when its token was rejected'''
+        with self._lock:
+            self._entries.pop(key, None)
+        utils.configuration.remove_cache(self._file(key))
+
+    def _file(self, key):
+        return utils.configuration.cache_file(SPEC_CACHE_PREFIX, json.dumps(key), self._folder)
+
+
+def spec_cache_key(node_api, user, direction, remote):
+    '''Key of a transfer spec in `TransferSpecCache`'''
+    # remote is a list of sources for downloads
+    return (node_api.base_url, user, direction, json.dumps(remote))
+
+
+def upload_setup(node_api, requests, chunk_size=SETUP_CHUNK_SIZE, cache=None, user=None):
+    '''
+    Get transfer specs to upload to several destinations, with one API call per `chunk_size` destinations.
+
+    :param node_api: `utils.rest.Rest` on the Node API
+    :param requests: list of (destination folder, list of local sources or None)
+    :param cache: optional `TransferSpecCache`, destinations found in it are not requested
+    :param user: user of `node_api`, part of cache key
+    :return: list of `SetupResult`, in the same order as `requests`
+    '''
+    return _setup(node_api, 'files/upload_setup', 'send', [
+        (destination, sources, [{'destination': destination}]) for destination, sources in requests], chunk_size, cache, user)
+
+
+def upload(transfer_client, node_api, destination, paths, cache=None, user=None):
+    '''
+    Upload paths to destination folder with a transfer spec from `upload_setup`, and wait for the end of the transfer.
+
+    If the transfer spec came from `cache` and the transfer fails with an error that is not retryable (e.g. token rejected by the node),
+    it is removed from cache and the transfer is started again with a new transfer spec.
+    :param paths: transfer spec paths
+    :return: transfer spec used
+    '''
+    while True:
+        result = upload_setup(node_api, [(destination, None)], cache=cache, user=user)[0]
+        t_spec = result.check()
+        t_spec['paths'] = paths
+        try:
+            transfer_client.start_transfer_and_wait(t_spec)
+            return t_spec
+        except utils.transfer_client.TransferError as e:
+            if not result.cached or e.retryable:
+                raise
+            logging.warning('transfer with cached transfer spec failed (%s), requesting a new one', e)
+            cache.discard(spec_cache_key(node_api, user, 'send', destination))
+
+
+def download_setup(node_api, requests, chunk_size=SETUP_CHUNK_SIZE, cache=None, user=None):
+    '''
+    Get transfer specs to download several sets of remote files, with one API call per `chunk_size` sets.
+
+    :param node_api: `utils.rest.Rest` on the Node API
+    :param requests: list of (list of remote sources, local destination folder or None)
+    :param cache: optional `TransferSpecCache`, sources found in it are not requested
+    :param user: user of `node_api`, part of cache key
+    :return: list of `SetupResult`, in the same order as `requests`
+    '''
+    return _setup(node_api, 'files/download_setup', 'receive', [
+        (sources, destination, [{'source': source} for source in sources]) for sources, destination in requests], chunk_size, cache, user)
+
+
+def _setup(node_api, endpoint, direction, entries, chunk_size=SETUP_CHUNK_SIZE, cache=None, user=None):
+    '''
+    Call the setup endpoint by chunks and map transfer specs back to their request.
+
+    :param entries: list of (remote, local, transfer request paths)
+    '''
+    results = [None] * len(entries)
+    missing = []
+    for index, (remote, local, _) in enumerate(entries):
+        transfer_spec = None if cache is None else cache.get(spec_cache_key(node_api, user, direction, remote))
+        if transfer_spec is None:
+            missing.append(index)
+            continue
+        _add_local_paths(transfer_spec, local)
+        results[index] = SetupResult(remote, local, transfer_spec=transfer_spec, cached=True)
+    if cache is not None:
+        logging.debug('%s: %d transfer specs from cache', endpoint, len(entries) - len(missing))
+    for start in range(0, len(missing), chunk_size):
+        indexes = missing[start:start + chunk_size]
+        chunk = [entries[index] for index in indexes]
+        logging.debug('%s: %d transfer requests', endpoint, len(chunk))
+        response_data = node_api.create(endpoint, {
+            'transfer_requests': [{'transfer_request': {'paths': paths}} for _, _, paths in chunk]
+        })
+        if 'error' in response_data:
+            raise Exception(response_data['error'].get('user_message', response_data['error']))
+        # transfer specs are returned in the order of transfer requests
+        transfer_specs = response_data.get('transfer_specs', [])
+        if len(transfer_specs) != len(chunk):
+            raise Exception(f'{endpoint}: expected {len(chunk)} transfer specs, got {len(transfer_specs)}')
+        for index, (remote, local, _), item in zip(indexes, chunk, transfer_specs):
+            if 'error' in item:
+                results[index] = SetupResult(remote, local, error=item['error'].get('user_message', item['error']))
+                continue
+            transfer_spec = item['transfer_spec']
+            if cache is not None:
+                cache.put(spec_cache_key(node_api, user, direction, remote), transfer_spec)
+            _add_local_paths(transfer_spec, local)
+            results[index] = SetupResult(remote, local, transfer_spec=transfer_spec)
+    return results
+
+
+def browse(node_api, path, page_size=BROWSE_PAGE_SIZE):
+    '''
+    List a folder with `files/browse`, requesting pages until all items are received.
+
+    :return: (metadata of folder, list of items: dict with `path`, `basename`, `type`, `size`, `mtime`)
+    '''
+    items = []
+    while True:
+        response_data = node_api.create('files/browse', {'path': path, 'skip': len(items), 'count': page_size})
+        page = response_data.get('items', [])
+        items.extend(page)
+        if not page or len(items) >= response_data.get('total_count', 0):
+            return response_data.get('self', {}), items
+
+
+def browse_tree(node_api, path, workers=BROWSE_WORKERS, page_size=BROWSE_PAGE_SIZE):
+    '''
+    List a folder tree with concurrent `files/browse` calls, and iterate over its files as pages are received.
+
+    Each call lists one page of one folder: pages of a large folder are requested in parallel once its size is known.
+    Folders and pages to list wait in one queue, and a free worker takes the last one (depth first: the queue stays small).
+    Calls are made only while the caller reads files: a caller that stops reading stops the listing.
+    A folder deleted during the listing is skipped, links are not followed.
+    :return: iterator of (path relative to `path` with `/`, item as returned by `browse`)
+    '''
+    path = path.rstrip('/') or '/'
+    # (folder path, relative path, skip)
+    queue = collections.deque([(path, '', 0)])
+    with futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='browse') as executor:
+        pending = {}
+        while queue or pending:
+            while queue and len(pending) < workers:
+                folder, relative, skip = queue.pop()
+                pending[executor.submit(node_api.create, 'files/browse', {'path': folder, 'skip': skip, 'count': page_size})] = (folder, relative, skip)
+            done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for job in done:
+                folder, relative, skip = pending.pop(job)
+                try:
+                    response_data = job.result()
+                except requests.exceptions.HTTPError as e:
+                    if folder == path or e.response is None or e.response.status_code != 404:
+                        raise
+                    logging.debug('browse: %s not found', folder)
+                    continue
+                if skip == 0:
+                    queue.extend((folder, relative, next_skip) for next_skip in range(page_size, response_data.get('total_count', 0), page_size))
+                for item in response_data.get('items', []):
+                    item_relative = f'{relative}/{item["basename"]}' if relative else item['basename']
+                    if item.get('type') == 'directory':
+                        queue.append((item['path'], item_relative, 0))
+                    elif item.get('type') == 'file':
+                        yield item_relative, item
+
+
+class TransferPoller:
+    '''
+    Get transfers changed since last poll from `ops/transfers`, following the `iteration_token` of the `next` link.
+
+    The iteration token is persisted in `cursor_file` after each page, so that next runs also get only new changes
+    (default: in the cache folder, see `utils.configuration.cache_file`).
+    The first poll, without token, returns what the node returns by default (transfers of the last day).
+
+    :param query: additional query parameters for `ops/transfers` (filters)
+    '''
+
+    def __init__(self, node_api, cursor_file=None, page_size=TRANSFERS_PAGE_SIZE, query=None):
+        self._node_api = node_api
+        if cursor_file is None:
+            cursor_file = utils.configuration.cache_file(TRANSFERS_CURSOR_PREFIX, node_api.base_url)
+        self._cursor_file = cursor_file
+        self._page_size = page_size
+        self._query = query or {}
+        cursor = utils.configuration.read_cache(self._cursor_file)
+        self.iteration_token = cursor.get('iteration_token') if isinstance(cursor, dict) else None
+
+    def poll(self):
+        '''Iterate over transfers changed since last poll, page by page, until no more changes'''
+        while True:
+            query = dict(self._query, count=self._page_size)
+            if self.iteration_token is not None:
+                query['iteration_token'] = self.iteration_token
+            response = self._node_api.request('GET', 'ops/transfers', query=query)
+            transfers = utils.codec.loads(response.content)
+            next_token = _link_iteration_token(response.links.get('next', {}).get('url'))
+            yield from transfers
+            # no more changes, or the node returned the same position again: next poll continues from there
+            if not transfers or next_token is None or next_token == self.iteration_token:
+                return
+            self.iteration_token = next_token
+            self._save()
+
+    def watch(self, interval, stop=None):
+        '''
+        Poll every `interval` seconds and iterate over changed transfers, forever.
+
+        :param stop: optional `threading.Event` to end iteration
+        '''
+        while stop is None or not stop.is_set():
+            yield from self.poll()
+            if stop is None:
+                time.sleep(interval)
+            else:
+                stop.wait(interval)
+
+    def _save(self):
+        utils.configuration.write_cache(self._cursor_file, {'iteration_token': self.iteration_token})
+
+
+def _link_iteration_token(url):
+    '''Iteration token in the URL of a `next` link'''
+    if not url:
+        return None
+    values = parse_qs(urlparse(url).query).get('iteration_token')
+    return values[0] if values else None
+
+
+def parse_time(value):
+    '''Time in ISO format as returned by Node API, to seconds since epoch'''
+    if not value:
+        return 0
+    parsed = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        return calendar.timegm(parsed.timetuple())
+    return parsed.timestamp()
+
+
+def _add_local_paths(transfer_spec, local):
+    '''Set local side of transfer: sources of upload, or destination folder of download'''
+    if local is None:
+        return
+    if transfer_spec.get('direction') == 'send':
+        transfer_spec['paths'] = [{'source': source} for source in local]
+    else:
+        transfer_spec['destination_root'] = local
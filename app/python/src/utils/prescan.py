@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# laurent.martin.aspera@fr.ibm.com
+# Pre-scan of local sources before transfer: total size and number of files, unreadable files
+# - folders are scanned in parallel with `utils.incremental.walk_folders`, one `os.scandir` per folder
+# - results per folder are cached by folder modification time: an unchanged folder is not read again
+#   (a file modified in place does not change the folder time: cached sizes are estimates, good for ETA and planning)
+# - symbolic links to folders are followed, as by `ascp`, except links to a parent folder
+import os
+import stat
+import logging
+import utils.incremental
+import utils.configuration
+
+# number of folders scanned in parallel (I/O bound, e.g. on NFS)
+SCAN_WORKERS = 16
+# prefix of pre-scan cache files in cache folder
+PRESCAN_CACHE_PREFIX = 'aspera_examples_prescan_'
+
+
+class ScanResult:
+    '''Totals of a pre-scan'''
+
+    def __init__(self):
+        self.total_bytes = 0
+        self.file_count = 0
+        self.folder_count = 0
+        # list of (path, reason)
+        self.unreadable = []
+        # source path -> [bytes, files], e.g. to shard sources among transfer specs
+        self.sources = {}
+
+    def __str__(self):
+        return f'{self.file_count} files, {self.folder_count} folders, {self.total_bytes} bytes, {len(self.unreadable)} unreadable'
+
+
+class _FolderEntry:
+    '''Content of one folder, not including sub folders'''
+
+    def __init__(self, mtime_ns, total_bytes=0, file_count=0, folders=(), unreadable=()):
+        self.mtime_ns = mtime_ns
+        self.total_bytes = total_bytes
+        self.file_count = file_count
+        self.folders = folders
+        self.unreadable = unreadable
+
+
+class Prescan:
+    '''
+    Scan local sources, with a cache of folder contents persisted in `cache_folder`.
+
+    :param cache_folder: folder of cache file, None for the per-user cache folder (see `utils.configuration.cache_file`), False for no cache
+    '''
+
+    def __init__(self, cache_folder=None, workers=SCAN_WORKERS):
+        self._cache_folder = cache_folder
+        self._workers = workers
+
+    def scan(self, sources):
+        '''Scan files and folders in `sources`, return a `ScanResult`'''
+        cache_file = self._cache_file(sources)
+        cache = self._load(cache_file)
+        # folders seen in this scan: next cache
+        seen = {}
+        result = ScanResult()
+        roots = []
+        for source in sources:
+            result.sources[source] = [0, 0]
+            try:
+                source_stat = os.stat(source)
+            except OSError as e:
+                result.unreadable.append((source, e.strerror))
+                continue
+            if stat.S_ISDIR(source_stat.st_mode):
+                roots.append((source, ''))
+            elif not os.access(source, os.R_OK):
+                result.unreadable.append((source, 'permission denied'))
+            else:
+                _add(result, source, source_stat.st_size, 1)
+
+        def read_folder(path, _):
+            entry = _scan_folder(path, cache.get(path))
+            return entry, entry.folders
+
+        for index, folder, entry in utils.incremental.walk_folders(roots, read_folder, self._workers):
+            seen[folder] = entry
+            result.folder_count += 1
+            _add(result, roots[index][0], entry.total_bytes, entry.file_count)
+            result.unreadable.extend(entry.unreadable)
+        self._save(cache_file, seen)
+        logging.debug('prescan: %s', result)
+        return result
+
+    def _cache_file(self, sources):
+        if self._cache_folder is False:
+            return None
+        key = '\n'.join(sorted(os.path.abspath(source) for source in sources))
+        return utils.configuration.cache_file(PRESCAN_CACHE_PREFIX, key, self._cache_folder)
+
+    def _load(self, cache_file):
+        folders = utils.configuration.read_cache(cache_file)
+        if not isinstance(folders, dict):
+            return {}
+        try:
+            return {path: _FolderEntry(*values) for path, values in folders.items()}
+        except TypeError:
+            return {}
+
+    def _save(self, cache_file, folders):
+        utils.configuration.write_cache(cache_file, {
+            path: (entry.mtime_ns, entry.total_bytes, entry.file_count, entry.folders, entry.unreadable) for path, entry in folders.items()})
+
+
+def _add(result, source, total_bytes, file_count):
+    result.total_bytes += total_bytes
+    result.file_count += file_count
+    result.sources[source][0] += total_bytes
+    result.sources[source][1] += file_count
+
+
+def _scan_folder(path, cached):
+    '''Read one folder, or return cached entry if folder not modified since'''
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError as e:
+        return _FolderEntry(0, unreadable=((path, e.strerror),))
+    if cached is not None and cached.mtime_ns == mtime_ns:
+        return cached
+    total_bytes = 0
+    file_count = 0
+    folders = []
+    unreadable = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=True):
+                        folders.append((entry.path, '', utils.incremental.folder_identity(entry.stat())))
+                        continue
+                    entry_stat = entry.stat()
+                except OSError as e:
+                    unreadable.append((entry.path, e.strerror))
+                    continue
+                if not stat.S_ISREG(entry_stat.st_mode):
+                    continue
+                if not os.access(entry.path, os.R_OK):
+                    unreadable.append((entry.path, 'permission denied'))
+                    continue
+                total_bytes += entry_stat.st_size
+                file_count += 1
+    except OSError as e:
+        return _FolderEntry(mtime_ns, unreadable=((path, e.strerror),))
+    return _FolderEntry(mtime_ns, total_bytes, file_count, tuple(folders), tuple(unreadable))
+
+
+def transfer_spec_sources(t_spec):
+    '''Local sources of an upload transfer spec (v1 `paths` or v2 `assets.paths`)'''
+    if 'assets' in t_spec:
+        root = t_spec['assets'].get('source_root', '')
+        paths = t_spec['assets'].get('paths', [])
+    else:
+        root = t_spec.get('source_root', '')
+        paths = t_spec.get('paths', [])
+    return [os.path.join(root, item['source']) if root else item['source'] for item in paths if 'source' in item]
@@ -1,10 +1,12 @@
 import requests
 import requests.auth
-import jwt
 import calendar
 import time
 import uuid
 import logging as log
+import utils.codec
+import utils.metrics
+import utils.tracing
 
 # take come time back to account for time offset between client and server
 JWT_CLIENT_SERVER_OFFSET_SEC = 60
@@ -13,14 +15,24 @@ JWT_VALIDITY_SEC = 600
 MIME_JSON = 'application/json'
 MIME_WWW = 'application/x-www-form-urlencoded'
 IETF_GRANT_JWT = 'urn:ietf:params:oauth:grant-type:jwt-bearer'
+# renew a cached bearer token this time before it expires
+TOKEN_EXPIRY_MARGIN_SEC = 60
+# parameters required in `auth_data` of `setAuthBearer`
+JWT_AUTH_KEYS = {'token_url', 'aud', 'client_id', 'client_secret', 'key_pem_path', 'iss', 'sub'}
 
 
 class Rest:
-    def __init__(self, base_url):
+    def __init__(self, base_url, session=None):
+        '''
+        :param session: optional `requests.Session` (connection pool) shared with other `Rest` objects, else a new connection is opened per call
+        '''
         self.base_url = base_url
         self.authData = None
         self.verify = True
         self.headers = {}
+        self.session = session
+        # bearer token cache: scope -> (authorization, expiry time)
+        self._token_cache = {}
 
     def setVerify(self, verify):
         """
@@ -41,18 +53,19 @@ class Rest:
         self.authData = None
         self.headers['Authorization'] = requests.auth._basic_auth_str(user, password)
 
-    def setAuthBearer(self, auth_data):
+    def setAuthBearer(self, auth_data, token_cache=None):
         """
         Provide OAuth 2 bearer parameters to generate a bearer token with JWT.
         :param auth_data: Dictionary containing necessary OAuth2 and JWT parameters.
+        :param token_cache: optional dict shared by `Rest` objects with the same credentials: scope -> (authorization, expiry time)
         """
-        mandatory_keys = {'token_url', 'aud', 'client_id', 'client_secret', 'key_pem_path', 'iss', 'sub'}
-        missing_keys = mandatory_keys - auth_data.keys()
+        missing_keys = JWT_AUTH_KEYS - auth_data.keys()
 
         if missing_keys:
             raise ValueError(f"Missing mandatory keys in auth_data: {', '.join(missing_keys)}")
 
         self.authData = auth_data
+        self._token_cache = {} if token_cache is None else token_cache
 
     def setDefaultScope(self, scope=None):
         """
@@ -60,89 +73,113 @@ class Rest:
 
         In this example we generate a new bearer token for each script invocation.
 
-        But in real code, as the bearer token is valid for some time, it should be re-used, until expired, then refresh it.
+        Within the same `Rest` object, the bearer token is re-used until expired, then refreshed.
         """
         self.headers['Authorization'] = self.getBearerTokenAuthorization(scope)
 
     def getBearerTokenAuthorization(self, scope=None):
         '''
-        Generate a bearer token.
+        Generate a bearer token, or get it from cache if still valid.
+        '''
+        cached = self._token_cache.get(scope)
+        if cached is not None and cached[1] > time.time():
+            utils.metrics.TOKEN_CACHE.inc(result='hit')
+            return cached[0]
+        utils.metrics.TOKEN_CACHE.inc(result='miss')
+        with utils.tracing.span('oauth.token', utils.tracing.KIND_CLIENT, **{'url.full': self.authData['token_url'], 'oauth.scope': str(scope)}):
+            response_data = self._requestBearerToken(scope)
+        authorization = f'Bearer {response_data["access_token"]}'
+        self._token_cache[scope] = (authorization, time.time() + response_data.get('expires_in', 0) - TOKEN_EXPIRY_MARGIN_SEC)
+        return authorization
+
+    def _requestBearerToken(self, scope):
+        '''
+        Call the token endpoint with a JWT assertion, and return the token response.
         '''
-        # self.authData['token_url'] = 'http://localhost:12345'
         log.info('getting API authorization')
-        with open(self.authData['key_pem_path']) as key_file:
-            private_key_pem = key_file.read()
-
-        seconds_since_epoch = int(calendar.timegm(time.gmtime()))
-
-        jwt_payload = {
-            'iss': self.authData['iss'],  # issuer
-            'sub': self.authData['sub'],  # subject
-            'aud': self.authData['aud'],  # audience
-            'iat': seconds_since_epoch - JWT_CLIENT_SERVER_OFFSET_SEC,  # issued at
-            'nbf': seconds_since_epoch - JWT_CLIENT_SERVER_OFFSET_SEC,  # not before
-            'exp': seconds_since_epoch + JWT_VALIDITY_SEC,  # expiration
-            'jti': str(uuid.uuid4()),
-        }
-        if 'org' in self.authData:
-            jwt_payload['org'] = self.authData['org']
-        log.debug(jwt_payload)
-
-        token_parameters = {
-            'client_id': self.authData['client_id'],
-            'grant_type': IETF_GRANT_JWT,
-            'assertion': jwt.encode(
-                payload=jwt_payload,
-                key=private_key_pem,
-                algorithm='RS256',
-                headers={'typ': 'JWT'},
-            ),
-        }
-
-        if scope is not None:
-            token_parameters['scope'] = scope
-
-        response = requests.post(
-            url=self.authData['token_url'],
-            auth=requests.auth.HTTPBasicAuth(self.authData['client_id'], self.authData['client_secret']),
-            data=token_parameters,
-            headers={
-                'Content-Type': MIME_WWW,
-                'Accept': MIME_JSON,
-            },
-            verify=self.verify
-        )
+        token_parameters = jwt_token_parameters(self.authData, scope)
+        start_time = time.monotonic()
+        status = 'error'
+        try:
+            response = (self.session or requests).post(
+                url=self.authData['token_url'],
+                auth=requests.auth.HTTPBasicAuth(self.authData['client_id'], self.authData['client_secret']),
+                data=token_parameters,
+                headers={
+                    'Content-Type': MIME_WWW,
+                    'Accept': MIME_JSON,
+                },
+                verify=self.verify
+            )
+            status = response.status_code
+        finally:
+            utils.metrics.TOKEN_LATENCY.observe(time.monotonic() - start_time, token_url=self.authData['token_url'], status=status)
         response.raise_for_status()
-        response_data = response.json()
-        return f'Bearer {response_data["access_token"]}'
+        return response.json()
 
     def call(self, method, endpoint=None, body=None, query=None, headers=None):
         """
         Lower level HTTP request.
         """
+        response = self.request(method, endpoint, body, query, headers)
+        if method == 'PUT' or method == 'DELETE':
+            return None
+        return utils.codec.loads(response.content)
+
+    def read_items(self, endpoint, params=None, prefix=utils.codec.TOP_LEVEL_ITEMS):
+        """
+        GET a list, and iterate over its items while the response is received: the whole list is never in memory.
+        :param prefix: path of the list in the response, see `utils.codec.iter_items`
+        """
+        response = self.request('GET', endpoint, query=params, stream=True)
+        with response:
+            yield from utils.codec.iter_items(response.iter_content(utils.codec.CHUNK_SIZE), prefix)
+
+    def request(self, method, endpoint=None, body=None, query=None, headers=None, stream=False):
+        """
+        HTTP request, return the `requests.Response` (e.g. to read headers), raise on HTTP error.
+        With `stream`, the response body is read by the caller, e.g. with `iter_content`.
+        """
         url = self.base_url
         if endpoint is not None:
             url = f'{url}/{endpoint}'
         req_headers = {}
         if method != 'PUT' and method != 'DELETE':
             req_headers['Accept'] = MIME_JSON
-        if method in ['POST', 'PUT']:
+        if method in ['POST', 'PUT'] or body is not None:
             req_headers['Content-Type'] = MIME_JSON
         req_headers.update(self.headers)
         if headers:
             req_headers.update(headers)
-        response = requests.request(
-            method=method,
-            url=url,
-            headers=req_headers,
-            verify=self.verify,
-            json=body,
-            params=query
-        )
+        endpoint_label = utils.metrics.endpoint_label(endpoint)
+        with utils.tracing.span(f'{method} {endpoint_label}', utils.tracing.KIND_CLIENT, **{
+            'http.request.method': method,
+            'server.address': self.base_url,
+            'url.path': endpoint_label,
+        }) as span:
+            start_time = time.monotonic()
+            status = 'error'
+            try:
+                response = (self.session or requests).request(
+                    method=method,
+                    url=url,
+                    headers=req_headers,
+                    verify=self.verify,
+                    data=None if body is None else utils.codec.dumps_bytes(body),
+                    params=query,
+                    stream=stream
+                )
+                status = response.status_code
+            finally:
+                utils.metrics.REST_LATENCY.observe(
+                    time.monotonic() - start_time,
+                    base_url=self.base_url,
+                    method=method,
+                    endpoint=endpoint_label,
+                    status=status)
+            span.set_attribute('http.response.status_code', status)
         response.raise_for_status()
-        if method == 'PUT' or method == 'DELETE':
-            return None
-        return response.json()
+        return response
 
     def create(self, endpoint, data):
         return self.call('POST', endpoint, body=data)
@@ -155,3 +192,44 @@ class Rest:
 
     def delete(self, endpoint):
         return self.call('DELETE', endpoint)
+
+
+def jwt_token_parameters(auth_data, scope=None):
+    '''
+    Parameters of a token request with a JWT assertion signed with the private key (RFC 7523).
+    :param auth_data: see `Rest.setAuthBearer`
+    '''
+    # imported only when needed: basic auth scripts do not need it
+    import jwt
+    with open(auth_data['key_pem_path']) as key_file:
+        private_key_pem = key_file.read()
+
+    seconds_since_epoch = int(calendar.timegm(time.gmtime()))
+
+    jwt_payload = {
+        'iss': auth_data['iss'],  # issuer
+        'sub': auth_data['sub'],  # subject
+        'aud': auth_data['aud'],  # audience
+        'iat': seconds_since_epoch - JWT_CLIENT_SERVER_OFFSET_SEC,  # issued at
+        'nbf': seconds_since_epoch - JWT_CLIENT_SERVER_OFFSET_SEC,  # not before
+        'exp': seconds_since_epoch + JWT_VALIDITY_SEC,  # expiration
+        'jti': str(uuid.uuid4()),
+    }
+    if 'org' in auth_data:
+        jwt_payload['org'] = auth_data['org']
+    log.debug(jwt_payload)
+
+    token_parameters = {
+        'client_id': auth_data['client_id'],
+        'grant_type': IETF_GRANT_JWT,
+        'assertion': jwt.encode(
+            payload=jwt_payload,
+            key=private_key_pem,
+            algorithm='RS256',
+            headers={'typ': 'JWT'},
+        ),
+    }
+
+    if scope is not None:
+        token_parameters['scope'] = scope
+    return token_parameters
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# laurent.martin.aspera@fr.ibm.com
+# Priority scheduler of transfers in front of `TransferClient`
+# - jobs wait in one queue per destination (remote host), and start in order of priority when a slot is free
+# - concurrency is limited per destination and globally
+# - optionally, the bandwidth of running transfers is shared by priority (see `utils.bandwidth`)
+# - aging: a waiting job gains one priority level every `aging` seconds, so that bulk jobs still progress
+#   (the order of waiting jobs does not change over time: the sort key is `priority + submit time / aging`)
+import time
+import heapq
+import logging
+import functools
+import threading
+import itertools
+from urllib.parse import urlparse
+from concurrent import futures
+import utils.metrics
+
+# priorities: lower value starts first
+PRIORITY_URGENT = 0
+PRIORITY_NORMAL = 10
+PRIORITY_BULK = 20
+# default maximum number of transfers running at the same time
+MAX_CONCURRENT = 8
+# default maximum number of transfers running at the same time to one destination
+MAX_PER_DESTINATION = 2
+# a waiting job gains one priority level after this time
+AGING_SEC = 60
+# keys in `session_initiation` methods that identify the destination
+DESTINATION_KEYS = ['remote_host', 'url', 'ibm_service_endpoint']
+
+
+def destination_of(t_spec):
+    '''Destination host of a transfer spec: `remote_host`, or host of the session initiation method (v2 transfer spec)'''
+    if t_spec.get('remote_host'):
+        return t_spec['remote_host']
+    for method in t_spec.get('session_initiation', {}).values():
+        if not isinstance(method, dict):
+            continue
+        for key in DESTINATION_KEYS:
+            if method.get(key):
+                value = method[key]
+                return (urlparse(value).hostname or value) if '://' in value else value
+    return ''
+
+
+class TransferJob:
+    '''A transfer submitted to `TransferScheduler`: wait for its completion with `result`'''
+
+    def __init__(self, t_spec, priority, destination, on_progress, expected_bytes, on_cancel=None):
+        self.t_spec = t_spec
+        self.priority = priority
+        self.destination = destination
+        self.on_progress = on_progress
+        self.expected_bytes = expected_bytes
+        self.submit_time = time.monotonic()
+        self.start_time = None
+        self.end_time = None
+        self._future = futures.Future()
+        # called when cancelled while queued: removes job from queue
+        self._on_cancel = on_cancel
+
+    @property
+    def waited(self):
+        '''Time spent in queue, in seconds'''
+        return (self.start_time or time.monotonic()) - self.submit_time
+
+    def done(self):
+        return self._future.done()
+
+    def result(self, timeout=None):
+        '''Wait for the end of the transfer, raise its exception if it failed'''
+        return self._future.result(timeout)
+
+    def cancel(self):
+        '''Remove job from queue if not started yet, return True if cancelled'''
+        if not self._future.cancel():
+            return False
+        if self._on_cancel is not None:
+            self._on_cancel(self)
+        return True
+
+    def cancelled(self):
+        return self._future.cancelled()
+
+
+class TransferScheduler:
+    '''
+    Queue of transfers, started on `transfer_client` by worker threads.
+
+    :param per_destination: default limit of running transfers per destination
+    :param limits: destination -> limit, for destinations with another limit
+    :param aging: seconds for a waiting job to gain one priority level, 0 for no aging
+    :param bandwidth: optional `utils.bandwidth.BandwidthManager` setting rates of transfers by priority
+    '''
+
+    def __init__(self, transfer_client, max_concurrent=MAX_CONCURRENT, per_destination=MAX_PER_DESTINATION, limits=None, aging=AGING_SEC,
+                 bandwidth=None):
+        self._transfer_client = transfer_client
+        self._bandwidth = bandwidth
+        self._max_concurrent = max_concurrent
+        self._per_destination = per_destination
+        self._limits = limits or {}
+        self._aging = aging
+        self._lock = threading.Lock()
+        # destination -> heap of (sort key, sequence, job)
+        self._queues = {}
+        # destination -> number of running jobs
+        self._running = {}
+        self._running_count = 0
+        self._sequence = itertools.count()
+        self._executor = futures.ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix='transfer')
+        self._closed = False
+
+    def submit(self, t_spec, priority=PRIORITY_NORMAL, on_progress=None, expected_bytes=None, destination=None):
+        '''
+        Queue a transfer, return a `TransferJob`.
+
+        :param destination: key for the per-destination limit, default: host of transfer spec
+        '''
+        if destination is None:
+            destination = destination_of(t_spec)
+        job = TransferJob(t_spec, priority, destination, on_progress, expected_bytes, on_cancel=self._remove)
+        sort_key = priority + (job.submit_time / self._aging if self._aging > 0 else 0)
+        with self._lock:
+            if self._closed:
+                raise Exception('scheduler is shut down')
+            heapq.heappush(self._queues.setdefault(destination, []), (sort_key, next(self._sequence), job))
+            utils.metrics.SCHEDULER_QUEUED.inc(destination=destination)
+            self._dispatch()
+        return job
+
+    def queue_depth(self, destination=None):
+        '''Number of waiting jobs, for one destination or all'''
+        with self._lock:
+            if destination is not None:
+                return len(self._queues.get(destination, []))
+            return sum(len(queue) for queue in self._queues.values())
+
+    def running(self):
+        '''Number of running jobs'''
+        return self._running_count
+
+    def shutdown(self, wait=True, cancel_queued=False):
+        '''Stop accepting jobs, and wait for queued and running ones to finish (or cancel queued ones)'''
+        with self._lock:
+            self._closed = True
+            if cancel_queued:
+                for destination, queue in self._queues.items():
+                    for _, _, job in queue:
+                        # not `job.cancel`: queues are cleared here
+                        job._future.cancel()
+                    utils.metrics.SCHEDULER_QUEUED.dec(len(queue), destination=destination)
+                self._queues.clear()
+        if wait:
+            # queued jobs are started when running ones finish: wait until all are done
+            while True:
+                with self._lock:
+                    pending = [job for queue in self._queues.values() for _, _, job in queue]
+                if not pending:
+                    break
+                futures.wait([job._future for job in pending])
+        self._executor.shutdown(wait=wait)
+
+    def _remove(self, job):
+        '''Remove a cancelled job from its queue, if not already taken by `_dispatch`'''
+        with self._lock:
+            queue = self._queues.get(job.destination)
+            if queue is None:
+                return
+            for index, entry in enumerate(queue):
+                if entry[2] is job:
+                    break
+            else:
+                return
+            queue[index] = queue[-1]
+            queue.pop()
+            heapq.heapify(queue)
+            if not queue:
+                del self._queues[job.destination]
+            utils.metrics.SCHEDULER_QUEUED.dec(destination=job.destination)
+
+    def _limit(self, destination):
+        return self._limits.get(destination, self._per_destination)
+
+    def _dispatch(self):
+        '''Start waiting jobs while slots are free, best job first among destinations below their limit, called with lock held'''
+        while self._running_count < self._max_concurrent:
+            best = None
+            for destination, queue in self._queues.items():
+                # drop jobs cancelled and not yet removed by `_remove`
+                while queue and queue[0][2].cancelled():
+                    heapq.heappop(queue)
+                    utils.metrics.SCHEDULER_QUEUED.dec(destination=destination)
+                if not queue or self._running.get(destination, 0) >= self._limit(destination):
+                    continue
+                if best is None or queue[0][:2] < self._queues[best][0][:2]:
+                    best = destination
+            if best is None:
+                return
+            _, _, job = heapq.heappop(self._queues[best])
+            if not self._queues[best]:
+                del self._queues[best]
+            if not job._future.set_running_or_notify_cancel():
+                utils.metrics.SCHEDULER_QUEUED.dec(destination=best)
+                continue
+            job.start_time = time.monotonic()
+            self._running[best] = self._running.get(best, 0) + 1
+            self._running_count += 1
+            utils.metrics.SCHEDULER_QUEUED.dec(destination=best)
+            utils.metrics.SCHEDULER_RUNNING.inc(destination=best)
+            utils.metrics.SCHEDULER_WAIT.observe(job.waited, priority=job.priority)
+            logging.debug('scheduler: starting job to %s, priority %s, waited %.1fs', best, job.priority, job.waited)
+            self._executor.submit(self._run, job)
+
+    def _run(self, job):
+        error = None
+        t_spec = job.t_spec
+        allocation = None
+        on_start = None
+        try:
+            if self._bandwidth is not None:
+                # rates are set on a copy: the submitted transfer spec is not changed
+                t_spec = dict(t_spec)
+                allocation = self._bandwidth.allocate(t_spec, job.priority)
+                on_start = functools.partial(self._bandwidth.started, allocation)
+            self._transfer_client.start_transfer_and_wait(t_spec, on_progress=job.on_progress, expected_bytes=job.expected_bytes, on_start=on_start)
+        except BaseException as e:
+            error = e
+        if allocation is not None:
+            self._bandwidth.release(allocation)
+        job.end_time = time.monotonic()
+        with self._lock:
+            self._running[job.destination] -= 1
+            if self._running[job.destination] == 0:
+                del self._running[job.destination]
+            self._running_count -= 1
+            utils.metrics.SCHEDULER_RUNNING.dec(destination=job.destination)
+            self._dispatch()
+        if error is not None:
+            job._future.set_exception(error)
+        else:
+            job._future.set_result(None)
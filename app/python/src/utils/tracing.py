@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# laurent.martin.aspera@fr.ibm.com
+# Optional tracing of API calls and transfers, with spans compatible with OpenTelemetry (OTLP JSON)
+# Disabled by default: `span()` then returns a shared no-op object.
+# Enable with `enable(exporter)` or with a `tracing` section in config file:
+#   tracing:
+#     file: /tmp/aspera_spans.jsonl     # one OTLP span per line
+#     collector: http://localhost:4318  # OTLP/HTTP collector
+#     service_name: aspera-examples
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+import contextvars
+
+DEFAULT_SERVICE_NAME = 'aspera-api-examples'
+INSTRUMENTATION_SCOPE = 'utils.tracing'
+# number of spans buffered before sending to collector
+COLLECTOR_BATCH_SIZE = 100
+OTLP_TRACES_PATH = '/v1/traces'
+# OTLP status codes
+STATUS_OK = 1
+STATUS_ERROR = 2
+# OTLP span kinds
+KIND_INTERNAL = 1
+KIND_CLIENT = 3
+
+_exporter = None
+# `setup` done, and `disable` registered at exit: once per process, whatever the number of `Configuration` objects
+_setup_done = False
+_atexit_registered = False
+_setup_lock = threading.Lock()
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class _NoopSpan:
+    '''Span used when tracing is disabled'''
+
+    def set_attribute(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    '''A timed operation, child of the span current when it is entered'''
+
+    def __init__(self, name, attributes, kind=KIND_INTERNAL):
+        self.name = name
+        self.attributes = attributes
+        self.kind = kind
+        self.trace_id = None
+        self.span_id = os.urandom(8).hex()
+        self.parent_span_id = None
+        self.start_ns = None
+        self.end_ns = None
+        self.status = STATUS_OK
+        self.status_message = None
+        self._token = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    @property
+    def duration(self):
+        '''Duration in seconds'''
+        return (self.end_ns - self.start_ns) / 1e9
+
+    def __enter__(self):
+        parent = _current_span.get()
+        if parent is None:
+            self.trace_id = os.urandom(16).hex()
+        else:
+            self.trace_id = parent.trace_id
+            self.parent_span_id = parent.span_id
+        self._token = _current_span.set(self)
+        self.start_ns = time.time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end_ns = time.time_ns()
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.status = STATUS_ERROR
+            self.status_message = f'{exc_type.__name__}: {exc_value}'
+        exporter = _exporter
+        if exporter is not None:
+            exporter.export(self)
+        return False
+
+    def to_otlp(self):
+        '''Span in OTLP JSON format'''
+        result = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': [{'key': key, 'value': _otlp_value(value)} for key, value in self.attributes.items()],
+            'status': {'code': self.status},
+        }
+        if self.parent_span_id is not None:
+            result['parentSpanId'] = self.parent_span_id
+        if self.status_message is not None:
+            result['status']['message'] = self.status_message
+        return result
+
+
+class FileExporter:
+    '''Append finished spans to a file, one OTLP JSON span per line'''
+
+    def __init__(self, path):
+        self._file = open(path, 'a')
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span.to_otlp())
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def shutdown(self):
+        self._file.close()
+
+
+class MemoryExporter:
+    '''Keep finished spans in memory, e.g. for benchmarks'''
+
+    def __init__(self):
+        self._spans = []
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        with self._lock:
+            self._spans.append(span)
+
+    def take(self):
+        '''Return finished spans and forget them'''
+        with self._lock:
+            spans, self._spans = self._spans, []
+        return spans
+
+    def shutdown(self):
+        pass
+
+
+class CollectorExporter:
+    '''Send finished spans by batch to an OpenTelemetry collector using OTLP/HTTP with JSON encoding'''
+
+    def __init__(self, url, service_name=DEFAULT_SERVICE_NAME, batch_size=COLLECTOR_BATCH_SIZE):
+        self._url = url.rstrip('/') + OTLP_TRACES_PATH
+        self._service_name = service_name
+        self._batch_size = batch_size
+        self._spans = []
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        with self._lock:
+            self._spans.append(span.to_otlp())
+            if len(self._spans) < self._batch_size:
+                return
+            spans, self._spans = self._spans, []
+        self._send(spans)
+
+    def shutdown(self):
+        with self._lock:
+            spans, self._spans = self._spans, []
+        if spans:
+            self._send(spans)
+
+    def _send(self, spans):
+        import urllib.request
+        payload = {'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': self._service_name}}]},
+            'scopeSpans': [{'scope': {'name': INSTRUMENTATION_SCOPE}, 'spans': spans}],
+        }]}
+        request = urllib.request.Request(
+            self._url,
+            data=json.dumps(payload).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+            method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                response.read()
+        except OSError as e:
+            logging.warning('failed to send %d spans to %s: %s', len(spans), self._url, e)
+
+
+def span(name, kind=KIND_INTERNAL, **attributes):
+    '''
+    Create a span to be used in a `with` statement.
+
+    :param attributes: span attributes, more can be added with `set_attribute`
+    '''
+    if _exporter is None:
+        return _NOOP_SPAN
+    return Span(name, attributes, kind)
+
+
+def is_enabled():
+    return _exporter is not None
+
+
+def enable(exporter):
+    '''Start tracing, finished spans are given to `exporter` (a previous exporter is flushed and closed)'''
+    global _exporter, _atexit_registered
+    with _setup_lock:
+        previous, _exporter = _exporter, exporter
+        if not _atexit_registered:
+            atexit.register(disable)
+            _atexit_registered = True
+    if previous is not None and previous is not exporter:
+        previous.shutdown()
+
+
+def disable():
+    '''Stop tracing and flush exporter'''
+    global _exporter
+    exporter, _exporter = _exporter, None
+    if exporter is not None:
+        exporter.shutdown()
+
+
+def setup(config):
+    '''
+    Enable tracing according to the `tracing` section of configuration, if present (only the first call has effect).
+
+    :param config: `dict` with key `file` or `collector`, and optional `service_name`
+    '''
+    global _setup_done
+    if not config:
+        return
+    with _setup_lock:
+        if _setup_done:
+            return
+        _setup_done = True
+    if 'file' in config:
+        enable(FileExporter(config['file']))
+    elif 'collector' in config:
+        enable(CollectorExporter(config['collector'], config.get('service_name', DEFAULT_SERVICE_NAME)))
+    else:
+        raise KeyError('tracing: expecting file or collector')
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
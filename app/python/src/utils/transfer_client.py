@@ -7,25 +7,80 @@ import os
 import re
 import json
 import time
-import grpc
+import random
 import logging
-import subprocess
+import threading
+import utils.codec
 import utils.configuration
+import utils.metrics
+import utils.tracing
 from urllib.parse import urlparse
-import warnings
-warnings.filterwarnings("ignore", ".*obsolete", UserWarning, "google.protobuf.runtime_version")
 
-# before stub import: protobuf: avoid incompatibility of version, use pure python implementation
-os.environ['PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION'] = 'python'
-# avoid message: 'Other threads are currently calling into gRPC, skipping fork() handlers'
-os.environ['GRPC_ENABLE_FORK_SUPPORT'] = 'false'
-
-# import gRPC stubs (Transfer SDK API), make sure it is in PYTHONPATH
-import transferd_pb2_grpc as transfer_manager_grpc  # noqa: E4
-import transferd_pb2 as transfer_manager  # noqa: E4
+# gRPC and stubs (Transfer SDK API) are imported on first use, see `load_stubs`
+grpc = None
+transfer_manager_grpc = None
+transfer_manager = None
 
 ASCP_LOG_FILE = "aspera-scp-transfer.log"
 DEBUG_HTTP = False
+# default minimum time between two progress events
+PROGRESS_INTERVAL_SEC = 1
+# default time to wait for connection to daemon
+CONNECT_TIMEOUT_SEC = 5
+# default number of times monitoring is resumed after the connection to daemon is lost
+MONITOR_RETRIES = 3
+# default number of times a failed transfer is started again (0: no retry)
+RETRY_ATTEMPTS = 3
+# default delay before first retry, doubled for each next retry, up to maximum
+RETRY_BACKOFF_SEC = 2
+RETRY_BACKOFF_MAX_SEC = 60
+# default resume policy of retried transfers: files already transferred are not sent again, partial files are completed
+RETRY_RESUME_POLICY = 'sparse_csum'
+# resume policy in transfer spec v2 (`file_system.resume`) for each v1 `resume_policy`
+RESUME_POLICY_V2 = {'none': 'none', 'attrs': 'attributes', 'sparse_csum': 'sparse_checksum', 'full_csum': 'full_checksum'}
+# ascp error codes of errors that will fail again if retried (command line and configuration errors, authentication failure)
+NON_RETRYABLE_CODES = {3, 4, 5, 19}
+# ascp error codes of transient errors (network failure, connection lost)
+RETRYABLE_CODES = {12, 13, 14, 15, 16}
+# errors that will fail again (authentication, permissions, missing files, invalid parameters, license), whatever the code
+NON_RETRYABLE_ERRORS = re.compile(
+    r'authenticat|unauthori[sz]ed|forbidden|permission denied|access denied|password|(invalid|expired) token|token (is )?(invalid|expired)|'
+    r'no such file|file not found|does not exist|invalid (transfer spec|parameter|argument|option|value)|license|'
+    r'no space left|disk full|quota', re.IGNORECASE)
+# gRPC channel options from `trsdk` section of config file: parameter -> gRPC options
+# (the daemon may close connections that send keepalive pings too often: keep keepalive_time_ms high)
+CHANNEL_OPTIONS = {
+    'keepalive_time_ms': ['grpc.keepalive_time_ms'],
+    'keepalive_timeout_ms': ['grpc.keepalive_timeout_ms'],
+    'keepalive_permit_without_calls': ['grpc.keepalive_permit_without_calls'],
+    'max_message_bytes': ['grpc.max_send_message_length', 'grpc.max_receive_message_length'],
+}
+
+
+def load_stubs():
+    '''Import gRPC and the Transfer SDK stubs, if not already done (make sure stubs are in PYTHONPATH)'''
+    global grpc, transfer_manager_grpc, transfer_manager
+    if transfer_manager is not None:
+        return
+    import warnings
+    warnings.filterwarnings("ignore", ".*obsolete", UserWarning, "google.protobuf.runtime_version")
+    # before stub import: protobuf: avoid incompatibility of version, use pure python implementation
+    os.environ['PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION'] = 'python'
+    # avoid message: 'Other threads are currently calling into gRPC, skipping fork() handlers'
+    os.environ['GRPC_ENABLE_FORK_SUPPORT'] = 'false'
+    import grpc
+    import transferd_pb2_grpc as transfer_manager_grpc
+    import transferd_pb2 as transfer_manager
+
+
+class TransferError(Exception):
+    '''Failure of a transfer reported by the daemon'''
+
+    def __init__(self, message, code=0, description='', retryable=False):
+        super().__init__(message)
+        self.code = code
+        self.description = description
+        self.retryable = retryable
 
 
 class TransferClient:
@@ -36,9 +91,18 @@ class TransferClient:
         sdk_url = urlparse(self._config.param('trsdk', 'url'))
         self._server_address = sdk_url.hostname
         self._server_port = sdk_url.port
+        # unix:///path/to/socket : daemon listening on a Unix domain socket, started by someone else
+        self._unix_socket = sdk_url.path if sdk_url.scheme == 'unix' else None
+        if self._unix_socket is not None and self._config.param('trsdk', 'start_daemon', True):
+            raise Exception('trsdk.url: unix:// requires start_daemon: false (the daemon started here listens on TCP)')
+        # deadline of calls to daemon, and of waits for connection
+        self._connect_timeout = self._config.param('trsdk', 'connect_timeout', CONNECT_TIMEOUT_SEC)
         self._transfer_daemon_process = None
+        self._channel = None
         self._transfer_service = None
-        self._daemon_name = os.path.basename(self._config.get_path('sdk_daemon'))
+        # startup may be called by several threads, e.g. by `utils.scheduler`
+        self._startup_lock = threading.Lock()
+        self._daemon_name = os.path.basename(self._config.get_path('sdk_daemon', must_exist=False))
         self._daemon_log = os.path.join(self._config._log_folder, f"{self._daemon_name}.log")
 
     def create_config_file(self, conf_file):
@@ -86,6 +150,7 @@ class TransferClient:
         logging.debug('command: %s', command)
         self.create_config_file(conf_file)
         logging.info('Starting daemon...')
+        import subprocess
         self._transfer_daemon_process = subprocess.Popen(
             command,
             shell=True,
@@ -112,32 +177,78 @@ class TransferClient:
             self._server_port = port_match.group(1)
             logging.info('Allocated server port: %s', self._server_port)
 
+    def daemon_log_events(self, from_end=True, stop=None):
+        '''
+        Iterate over JSON events written by the daemon in its log file, as they are logged.
+
+        :param from_end: skip events already logged
+        :param stop: optional `threading.Event` to end iteration
+        '''
+        for line in utils.configuration.follow_file(self._daemon_log, from_end=from_end, stop=stop):
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logging.debug('not a JSON log line: %s', line)
+
+    def channel_options(self):
+        '''gRPC channel options according to `trsdk` section of config file'''
+        options = []
+        for param, grpc_options in CHANNEL_OPTIONS.items():
+            value = self._config.param('trsdk', param, False)
+            if value is not False:
+                options.extend((grpc_option, int(value)) for grpc_option in grpc_options)
+        return options
+
     def connect_to_daemon(self):
-        '''Connect to transfer manager daemon'''
-        channel_address = f'{self._server_address}:{self._server_port}'
+        '''
+        Connect to transfer manager daemon
+
+        The channel reconnects by itself if the connection is lost, and calls wait for it to be ready.
+        '''
+        load_stubs()
+        if self._unix_socket is not None:
+            channel_address = f'unix:{self._unix_socket}'
+        else:
+            channel_address = f'{self._server_address}:{self._server_port}'
         logging.info('Connecting to %s on: %s ...', self._daemon_name, channel_address)
+        compression = None
+        if self._config.param('trsdk', 'compression', False) == 'gzip':
+            compression = grpc.Compression.Gzip
         # create a connection to the transfer manager daemon
-        channel = grpc.insecure_channel(channel_address)
-        try:
-            grpc.channel_ready_future(channel).result(timeout=5)
-        except grpc.FutureTimeoutError:
+        self._channel = grpc.insecure_channel(channel_address, options=self.channel_options(), compression=compression)
+        if not self._wait_ready():
             logging.error('Failed to connect')
             raise Exception('failed to connect.')
         # channel is ok, let's get the stub
-        self._transfer_service = transfer_manager_grpc.TransferServiceStub(channel)
+        self._transfer_service = transfer_manager_grpc.TransferServiceStub(self._channel)
         logging.info('Connected !')
 
+    def _wait_ready(self):
+        '''Wait at most `trsdk.connect_timeout` seconds for the channel to be connected, return False if not'''
+        try:
+            grpc.channel_ready_future(self._channel).result(timeout=self._connect_timeout)
+        except grpc.FutureTimeoutError:
+            return False
+        return True
+
     def startup(self):
-        '''Start and connect to transfer manager daemon'''
-        if self._transfer_service is None:
-            self.start_daemon()
-            self.connect_to_daemon()
+        '''Start and connect to transfer manager daemon (only connect if `trsdk.start_daemon` is false)'''
+        if self._transfer_service is not None:
+            return self
+        with self._startup_lock:
+            if self._transfer_service is None:
+                start_time = time.monotonic()
+                with utils.tracing.span('transferd.start', daemon=self._daemon_name):
+                    if self._config.param('trsdk', 'start_daemon', True):
+                        self.start_daemon()
+                    self.connect_to_daemon()
+                utils.metrics.DAEMON_STARTUP.observe(time.monotonic() - start_time)
         return self
 
     def shutdown(self):
         '''Shutdown transfer manager daemon, if needed'''
-        if self._transfer_service is None:
-            self._transfer_service = None
+        self._transfer_service = None
+        self._channel = None
         if self._transfer_daemon_process is not None:
             logging.info('Shutting down daemon...')
             # self._transfer_daemon_process.send_signal(signal.CTRL_C_EVENT)
@@ -148,50 +259,276 @@ class TransferClient:
 
     def start_transfer(self, transfer_spec):
         '''Start a transfer and return transfer id'''
-        ts_json = json.dumps(transfer_spec)
+        load_stubs()
+        ts_json = utils.codec.dumps(transfer_spec)
         logging.debug('ts: %s', ts_json)
         # create a transfer request
         transfer_request = transfer_manager.TransferRequest(
             transferType=transfer_manager.FILE_REGULAR,
+            # the daemon has no setting for progress event frequency (only `logLevel`): see `monitor_transfer`
             config=transfer_manager.TransferConfig(),
             transferSpec=ts_json,
         )
         # send start transfer request to transfer manager daemon
-        transfer_response = self._transfer_service.StartTransfer(transfer_request)
-        self.throw_on_error(transfer_response.status, transfer_response.error)
+        with utils.tracing.span('transfer.start', direction=transfer_spec.get('direction', '')) as span:
+            transfer_response = self._transfer_service.StartTransfer(transfer_request, wait_for_ready=True, timeout=self._connect_timeout)
+            span.set_attribute('transfer.id', transfer_response.transferId)
+            self.throw_on_error(transfer_response.status, transfer_response.error)
         return transfer_response.transferId
 
-    def wait_transfer(self, transfer_id):
-        '''Wait for transfer completion'''
+    def monitor_transfer(self, transfer_id, expected_bytes=None):
+        '''
+        Iterate over progress events of a transfer, until it completes.
+
+        Intermediate progress events are emitted at most every `trsdk.progress_interval` seconds.
+        The daemon sends an event on each ascp update, as `TransferConfig` has no setting for it: throttling is done here.
+        Status changes are always emitted.
+        If the connection to the daemon is lost, monitoring is resumed when it is back (`trsdk.monitor_retries` times),
+        waiting at most `trsdk.connect_timeout` seconds each time.
+        :param expected_bytes: total size of the transfer, if known, used to compute ETA
+        '''
         logging.debug('transfer started with id %s', transfer_id)
-        # monitor transfer status
-        for transfer_info in self._transfer_service.MonitorTransfers(
-                transfer_manager.RegistrationRequest(
-                    filters=[transfer_manager.RegistrationFilter(
-                        transferId=[transfer_id])]
-                )):
-            # logging.debug('transfer info %s', transfer_info)
-            # check transfer status in response, and exit if it's done
-            status = transfer_info.status
-            logging.info('transfer: %s', transfer_manager.TransferStatus.Name(status))
-            self.throw_on_error(status, transfer_info.error)
-            if status == transfer_manager.COMPLETED:
-                break
-
-    def start_transfer_and_wait(self, t_spec):
-        '''One-call simplified procedure to start daemon, transfer and wait for it to finish'''
+        load_stubs()
+        tracker = ProgressTracker(transfer_id, expected_bytes, self._config.param('trsdk', 'progress_interval', PROGRESS_INTERVAL_SEC))
+        retries = self._config.param('trsdk', 'monitor_retries', MONITOR_RETRIES)
+        registration = transfer_manager.RegistrationRequest(filters=[transfer_manager.RegistrationFilter(transferId=[transfer_id])])
+        start_time = time.monotonic()
+        final_status = 'FAILED'
+        try:
+            while True:
+                try:
+                    # monitor transfer status (no deadline: lasts as long as the transfer, fails if daemon not reachable)
+                    for transfer_info in self._transfer_service.MonitorTransfers(registration):
+                        # logging.debug('transfer info %s', transfer_info)
+                        progress = tracker.update(transfer_info)
+                        if progress is not None:
+                            yield progress
+                        # check transfer status in response, and exit if it's done
+                        status = transfer_info.status
+                        self.throw_on_error(status, transfer_info.error)
+                        if status == transfer_manager.COMPLETED:
+                            final_status = 'COMPLETED'
+                            break
+                    break
+                except grpc.RpcError as e:
+                    if e.code() != grpc.StatusCode.UNAVAILABLE or retries <= 0:
+                        raise
+                    retries -= 1
+                    logging.warning('monitoring of %s interrupted, resuming: %s', transfer_id, e.details())
+                    if not self._wait_ready():
+                        raise Exception('lost connection to daemon')
+        finally:
+            utils.metrics.record_transfer(final_status, time.monotonic() - start_time, tracker.bytes_transferred)
+
+    def wait_transfer(self, transfer_id, on_progress=None, expected_bytes=None):
+        '''
+        Wait for transfer completion
+
+        :param on_progress: optional callback called with each `TransferProgress`
+        '''
+        with utils.tracing.span('transfer.wait', **{'transfer.id': transfer_id}) as span:
+            for progress in self.monitor_transfer(transfer_id, expected_bytes):
+                logging.info('transfer: %s', progress)
+                span.set_attribute('transfer.bytes', progress.bytes_transferred)
+                span.set_attribute('transfer.status', progress.status)
+                if on_progress is not None:
+                    on_progress(progress)
+
+    def start_transfer_and_wait(self, t_spec, on_progress=None, expected_bytes=None, on_start=None):
+        '''
+        One-call simplified procedure to start daemon, transfer and wait for it to finish
+
+        A failed transfer is started again with a resume policy, after a delay doubled on each retry (`trsdk.retry_attempts`,
+        `trsdk.retry_backoff`, `trsdk.retry_backoff_max`, `trsdk.retry_resume_policy`), unless its error is not retryable.
+        :param expected_bytes: size of transfer for ETA, if None and `trsdk.prescan` is true, local sources of uploads are scanned
+        :param on_start: optional callback called with the transfer id when the transfer is started (each attempt)
+        '''
         # TODO: remove when transfer sdk bug fixed
         # t_spec['http_fallback'] = False
         self.startup()
-        self.wait_transfer(self.start_transfer(t_spec))
+        if expected_bytes is None and t_spec.get('direction') == 'send' and self._config.param('trsdk', 'prescan', False):
+            expected_bytes = self.prescan(t_spec).total_bytes
+        attempts = self._config.param('trsdk', 'retry_attempts', RETRY_ATTEMPTS)
+        delay = self._config.param('trsdk', 'retry_backoff', RETRY_BACKOFF_SEC)
+        max_delay = self._config.param('trsdk', 'retry_backoff_max', RETRY_BACKOFF_MAX_SEC)
+        attempt = 0
+        while True:
+            try:
+                transfer_id = self.start_transfer(t_spec)
+                if on_start is not None:
+                    on_start(transfer_id)
+                self.wait_transfer(transfer_id, on_progress=on_progress, expected_bytes=expected_bytes)
+                return
+            except TransferError as e:
+                if not e.retryable or attempt >= attempts:
+                    raise
+                attempt += 1
+                # do not send again what was already transferred
+                t_spec = with_resume_policy(t_spec, self._config.param('trsdk', 'retry_resume_policy', RETRY_RESUME_POLICY))
+                # random part: transfers that failed together do not retry together
+                wait = min(delay * 2 ** (attempt - 1), max_delay) * random.uniform(0.5, 1)
+                logging.warning('%s, retry %d/%d in %.1fs', e, attempt, attempts, wait)
+                utils.metrics.TRANSFER_RETRIES.inc()
+                time.sleep(wait)
+
+    def can_modify_transfer(self):
+        '''True if the daemon API allows changing parameters of a running transfer (`ModifyTransfer`)'''
+        load_stubs()
+        return hasattr(transfer_manager, 'TransferModificationRequest')
+
+    def modify_transfer(self, transfer_id, changes):
+        '''
+        Change parameters of a running transfer, e.g. rates: `{'target_rate_kbps': 100000, 'min_rate_kbps': 0}`
+
+        :return: False if not supported by this version of the daemon API
+        '''
+        if not self.can_modify_transfer():
+            return False
+        request = transfer_manager.TransferModificationRequest(transferId=transfer_id, transferSpec=utils.codec.dumps(changes))
+        with utils.tracing.span('transfer.modify', **{'transfer.id': transfer_id}):
+            response = self._transfer_service.ModifyTransfer(request, wait_for_ready=True, timeout=self._connect_timeout)
+        self.throw_on_error(response.status, response.error)
+        return True
+
+    def prescan(self, t_spec):
+        '''Scan local sources of an upload: size and number of files, and log unreadable files before transfer starts'''
+        import utils.prescan
+        with utils.tracing.span('transfer.prescan') as span:
+            result = utils.prescan.Prescan().scan(utils.prescan.transfer_spec_sources(t_spec))
+            span.set_attribute('prescan.bytes', result.total_bytes)
+            span.set_attribute('prescan.files', result.file_count)
+        logging.info('sources: %s', result)
+        for path, reason in result.unreadable:
+            logging.warning('unreadable: %s: %s', path, reason)
+        return result
 
     def throw_on_error(self, status, error):
-        '''raise exception if status contains an error'''
+        '''raise `TransferError` if status contains an error'''
+        load_stubs()
         if status == transfer_manager.TransferStatus.FAILED:
-            logging.error(utils.configuration.last_file_line(self._daemon_log))
-            raise Exception("transfer failed: " + error.description)
+            # no log file when connected to a daemon started by someone else
+            if os.path.exists(self._daemon_log):
+                logging.error(utils.configuration.last_file_line(self._daemon_log))
+            raise TransferError(
+                "transfer failed: " + error.description, error.code, error.description, is_retryable(error.code, error.description))
         if status == transfer_manager.TransferStatus.UNKNOWN_STATUS:
-            raise Exception("unknown transfer id: " + error.description)
+            raise TransferError("unknown transfer id: " + error.description, error.code, error.description)
+
+
+def is_retryable(code, description):
+    '''
+    True if a transfer failing with this error may succeed if started again (e.g. network error)
+
+    Non-retryable conditions are checked first: ascp error code, then description (e.g. an authentication failure mentioning a timeout).
+    '''
+    if code in NON_RETRYABLE_CODES or NON_RETRYABLE_ERRORS.search(description or '') is not None:
+        return False
+    # network errors (`RETRYABLE_CODES`), and other errors that may be transient (e.g. "host not found")
+    return True
+
+
+def is_spec_v2(t_spec):
+    '''True for a transfer spec v2 (with `assets` or `session_initiation`), with options in sub sections'''
+    return 'assets' in t_spec or 'session_initiation' in t_spec
+
+
+def with_resume_policy(t_spec, policy):
+    '''Copy of transfer spec with resume policy set, if not already: `resume_policy` (v1) or `file_system.resume` (v2)'''
+    if not is_spec_v2(t_spec):
+        if 'resume_policy' in t_spec:
+            return t_spec
+        return dict(t_spec, resume_policy=policy)
+    file_system = t_spec.get('file_system', {})
+    if 'resume' in file_system:
+        return t_spec
+    return dict(t_spec, file_system=dict(file_system, resume=RESUME_POLICY_V2.get(policy, policy)))
+
+
+class TransferProgress:
+    '''Progress of a transfer at one point in time (rates in bits per second)'''
+
+    def __init__(self, transfer_id, status, event, bytes_transferred, bytes_expected, files_completed, files_failed,
+                 elapsed_sec, instant_rate_bps, average_rate_bps, eta_sec):
+        self.transfer_id = transfer_id
+        self.status = status
+        self.event = event
+        self.bytes_transferred = bytes_transferred
+        self.bytes_expected = bytes_expected
+        self.files_completed = files_completed
+        self.files_failed = files_failed
+        self.elapsed_sec = elapsed_sec
+        self.instant_rate_bps = instant_rate_bps
+        self.average_rate_bps = average_rate_bps
+        self.eta_sec = eta_sec
+
+    def __str__(self):
+        result = f'{self.status} {self.bytes_transferred} bytes, {self.files_completed} files, {self.average_rate_bps / 1000000:.2f} Mbps'
+        if self.eta_sec is not None:
+            result += f', ETA {self.eta_sec:.0f}s'
+        return result
+
+
+class ProgressTracker:
+    '''
+    Build `TransferProgress` from successive transfer events of the daemon.
+
+    Rates are computed incrementally from the previous event, using local time.
+    '''
+
+    def __init__(self, transfer_id, expected_bytes=None, interval=PROGRESS_INTERVAL_SEC):
+        load_stubs()
+        self._transfer_id = transfer_id
+        self._expected_bytes = expected_bytes
+        self._interval = interval
+        self._start_time = None
+        self._last_time = None
+        self._last_bytes = 0
+        self._last_status = None
+        self._last_emitted = None
+
+    @property
+    def bytes_transferred(self):
+        '''Bytes transferred at last event'''
+        return self._last_bytes
+
+    def update(self, transfer_info):
+        '''Update with a `TransferResponse`, return a `TransferProgress`, or None if throttled'''
+        now = time.monotonic()
+        if self._start_time is None:
+            self._start_time = now
+        info = transfer_info.transferInfo
+        bytes_transferred = getattr(info, 'bytesTransferred', 0)
+        status = transfer_manager.TransferStatus.Name(transfer_info.status)
+        instant_rate = 0.0
+        if self._last_time is not None and now > self._last_time:
+            instant_rate = 8 * max(bytes_transferred - self._last_bytes, 0) / (now - self._last_time)
+        self._last_time = now
+        self._last_bytes = bytes_transferred
+        # throttle: only status changes and periodic updates
+        if status == self._last_status and self._last_emitted is not None and now - self._last_emitted < self._interval:
+            return None
+        self._last_status = status
+        self._last_emitted = now
+        # prefer elapsed time measured by the daemon
+        elapsed = getattr(info, 'elapsedUsec', 0) / 1000000 or now - self._start_time
+        average_rate = 8 * bytes_transferred / elapsed if elapsed > 0 else 0.0
+        expected = self._expected_bytes or getattr(info, 'bytesExpected', 0) or None
+        eta = None
+        if expected is not None and average_rate > 0:
+            eta = max(expected - bytes_transferred, 0) * 8 / average_rate
+        return TransferProgress(
+            transfer_id=self._transfer_id,
+            status=status,
+            event=transfer_manager.TransferEvent.Name(transfer_info.transferEvent),
+            bytes_transferred=bytes_transferred,
+            bytes_expected=expected,
+            files_completed=getattr(info, 'filesCompleted', 0),
+            files_failed=getattr(info, 'filesFailed', 0),
+            elapsed_sec=elapsed,
+            instant_rate_bps=instant_rate,
+            average_rate_bps=average_rate,
+            eta_sec=eta,
+        )
 
 
 def ascp_level(level_string):
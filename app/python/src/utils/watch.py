@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# laurent.martin.aspera@fr.ibm.com
+# Watch a folder tree and get batches of new or modified files, ready to upload
+# - Linux: inotify events (through ctypes, no dependency), sub folders are watched as they are created
+# - other systems: polling of the tree, comparing size and modification time
+# - files already batched are kept in a snapshot (size and modification time): after an overflow of the inotify event queue,
+#   only files that differ from the snapshot are pending
+# - a file is ready when it was closed after write (or moved in), and then unchanged during `settle` seconds
+# - ready files are grouped in batches, sent when the batch reaches `batch_bytes` or `batch_files`,
+#   or when its first file has waited `window` seconds
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import utils.incremental
+
+# a file is ready when not changed during this time after it was closed
+SETTLE_SEC = 2
+# a batch is sent after this time, even if not full
+BATCH_WINDOW_SEC = 10
+BATCH_BYTES = 10 * 1024 * 1024 * 1024
+BATCH_FILES = 10000
+# time between two scans of the tree when inotify is not available
+POLL_INTERVAL_SEC = 5
+# inotify event masks, see `man inotify`
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+# struct inotify_event header: wd, mask, cookie, len (followed by name)
+EVENT_HEADER = struct.Struct('iIII')
+READ_SIZE = 65536
+
+
+class _Inotify:
+    '''Minimal inotify binding: watches by folder, returns (folder, name, mask) events'''
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        # watch descriptor -> folder
+        self._folders = {}
+
+    def add(self, folder):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(folder), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                raise OSError(error, 'inotify watch limit reached, increase fs.inotify.max_user_watches')
+            raise OSError(error, f'cannot watch {folder}: {os.strerror(error)}')
+        self._folders[wd] = folder
+
+    def remove_tree(self, folder):
+        '''Stop watching folder and its sub folders, e.g. moved out or renamed (their paths are not valid anymore)'''
+        prefix = folder + os.sep
+        for wd, path in list(self._folders.items()):
+            if path == folder or path.startswith(prefix):
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._folders[wd]
+
+    def read(self, timeout):
+        '''Events received within `timeout` seconds: list of (folder, name, mask), folder is None on overflow'''
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self._fd, READ_SIZE)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, '', mask))
+                continue
+            folder = self._folders.get(wd)
+            if mask & IN_IGNORED:
+                self._folders.pop(wd, None)
+                continue
+            if folder is not None:
+                events.append((folder, name, mask))
+        return events
+
+    def close(self):
+        os.close(self._fd)
+
+
+def _stat(path):
+    '''Size and modification time of file, None if not found'''
+    try:
+        path_stat = os.stat(path)
+    except OSError:
+        return None
+    return path_stat.st_size, path_stat.st_mtime
+
+
+class _PendingFile:
+    def __init__(self, closed, changed, stat=None):
+        # closed after write: may be ready
+        self.closed = closed
+        self.changed = changed
+        # size and time when closed: compared when settled
+        self.stat = stat
+
+
+class FolderWatcher:
+    '''
+    Watch `root` and iterate over batches of ready files with `batches`.
+
+    Files are identified by path relative to destination folder: `<name of root>/<path in root>`, as when root is a transfer source.
+    :param polling: use polling instead of inotify
+    '''
+
+    def __init__(self, root, settle=SETTLE_SEC, window=BATCH_WINDOW_SEC, batch_bytes=BATCH_BYTES, batch_files=BATCH_FILES,
+                 polling=False, poll_interval=POLL_INTERVAL_SEC):
+        self.root = os.path.normpath(os.path.abspath(root))
+        self._settle = settle
+        self._window = window
+        self._batch_bytes = batch_bytes
+        self._batch_files = batch_files
+        self._poll_interval = poll_interval
+        # path -> _PendingFile
+        self._pending = {}
+        # ready files, their total size, and time first one was ready
+        self._batch = []
+        self._batch_size = 0
+        self._batch_start = None
+        self._inotify = None
+        # files in tree, or batched: path -> (size, mtime)
+        self._snapshot = {}
+        self._next_poll = 0
+        if not polling:
+            try:
+                self._inotify = _Inotify()
+            except (OSError, AttributeError) as e:
+                logging.info('watch: inotify not available (%s), polling every %ss', e, poll_interval)
+        if self._inotify is not None:
+            self._watch_tree(self.root, new=False)
+        self._snapshot = self._scan()
+
+    def relative(self, path):
+        '''Path relative to destination folder'''
+        return '/'.join([os.path.basename(self.root)] + os.path.relpath(path, self.root).split(os.sep))
+
+    def batches(self, stop=None):
+        '''
+        Iterate over batches of ready files: list of (path, relative path), forever or until `stop` (`threading.Event`) is set.
+        '''
+        while stop is None or not stop.is_set():
+            batch = self.poll(timeout=self._next_timeout())
+            if batch:
+                yield batch
+
+    def poll(self, timeout=0):
+        '''Process events received within `timeout`, and return the batch if due, else None'''
+        if self._inotify is not None:
+            self._process(self._inotify.read(timeout))
+        else:
+            time.sleep(timeout)
+            if time.monotonic() >= self._next_poll:
+                self._poll_tree()
+        self._check_ready()
+        return self._take_batch()
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def _next_timeout(self):
+        '''Time until next file may become ready or batch may be due'''
+        timeout = self._settle if self._pending else self._window
+        if self._batch_start is not None:
+            timeout = min(timeout, max(self._batch_start + self._window - time.monotonic(), 0))
+        if self._inotify is None:
+            timeout = min(timeout, self._poll_interval)
+        return max(timeout, 0.05)
+
+    def _watch_tree(self, folder, new):
+        '''Watch folder and sub folders, files in a new folder are pending (created before its watch was added)'''
+        for current, _, files in os.walk(folder):
+            try:
+                self._inotify.add(current)
+            except OSError as e:
+                # removed or replaced by a file since listed
+                if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                    raise
+                logging.debug('watch: %s', e)
+                continue
+            if new:
+                for name in files:
+                    path = os.path.join(current, name)
+                    self._pending[path] = _PendingFile(True, time.monotonic(), _stat(path))
+
+    def _process(self, events):
+        now = time.monotonic()
+        for folder, name, mask in events:
+            if folder is None:
+                logging.warning('watch: event queue overflow, scanning tree')
+                self._rescan()
+                continue
+            path = os.path.join(folder, name) if name else folder
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._watch_tree(path, new=True)
+                elif mask & IN_MOVED_FROM:
+                    self._inotify.remove_tree(path)
+                    self._forget_tree(path)
+                continue
+            if mask & (IN_DELETE | IN_MOVED_FROM):
+                self._pending.pop(path, None)
+                self._snapshot.pop(path, None)
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                self._pending[path] = _PendingFile(True, now, _stat(path))
+            elif mask & (IN_CREATE | IN_MODIFY):
+                pending = self._pending.get(path)
+                if pending is None:
+                    self._pending[path] = _PendingFile(False, now)
+                else:
+                    # written again: wait for next close
+                    pending.closed = False
+                    pending.changed = now
+
+    def _rescan(self):
+        '''After events were lost: watch all folders again, and files that differ from snapshot are pending'''
+        now = time.monotonic()
+        self._watch_tree(self.root, new=False)
+        snapshot = self._scan()
+        for path, item in snapshot.items():
+            if self._snapshot.get(path) != item and path not in self._pending:
+                self._pending[path] = _PendingFile(True, now, item)
+        for path in self._snapshot.keys() - snapshot.keys():
+            self._pending.pop(path, None)
+            del self._snapshot[path]
+
+    def _forget_tree(self, folder):
+        '''Forget files of a folder moved away'''
+        prefix = folder + os.sep
+        for files in (self._pending, self._snapshot):
+            for path in [path for path in files if path.startswith(prefix)]:
+                del files[path]
+
+    def _poll_tree(self):
+        '''Polling: files with a new size or modification time are pending'''
+        now = time.monotonic()
+        snapshot = self._scan()
+        for path, item in snapshot.items():
+            if self._snapshot.get(path) != item:
+                self._pending[path] = _PendingFile(True, now, item)
+        for path in self._snapshot.keys() - snapshot.keys():
+            self._pending.pop(path, None)
+        self._snapshot = snapshot
+        self._next_poll = now + self._poll_interval
+
+    def _scan(self):
+        '''Size and modification time of files in tree: path -> (size, mtime), as `_stat`'''
+        # folders may be removed while scanned
+        files = utils.incremental.iter_local([self.root], on_error=lambda path, e: logging.debug('watch: %s', e))
+        return {item.path: (item.size, item.mtime) for item in files}
+
+    def _check_ready(self):
+        '''Move settled files to batch: closed, and same size and time since `settle` seconds'''
+        now = time.monotonic()
+        for path, pending in list(self._pending.items()):
+            if not pending.closed or now - pending.changed < self._settle:
+                continue
+            current = _stat(path)
+            if current is None:
+                del self._pending[path]
+                continue
+            if pending.stat != current:
+                # changed without close event (e.g. still written by another process, or through mmap): wait again
+                pending.stat = current
+                pending.changed = now
+                continue
+            del self._pending[path]
+            self._snapshot[path] = current
+            if not self._batch:
+                self._batch_start = now
+            self._batch.append(path)
+            self._batch_size += current[0]
+
+    def _take_batch(self):
+        if not self._batch:
+            return None
+        if self._batch_size < self._batch_bytes and len(self._batch) < self._batch_files \
+                and time.monotonic() - self._batch_start < self._window:
+            return None
+        batch = [(path, self.relative(path)) for path in self._batch]
+        logging.info('watch: %d files ready (%d bytes)', len(batch), self._batch_size)
+        self._batch = []
+        self._batch_size = 0
+        self._batch_start = None
+        return batch